@@ -1,4 +1,7 @@
+from pyramid.tweens import MAIN
+
 from lumin.db import register_mongodb
+from lumin.indexes import add_mongodb_index
 
 
 def includeme(config):
@@ -9,4 +12,10 @@ def includeme(config):
     config.add_directive('register_mongodb',
                          register_mongodb,
                          action_wrap=True)
+    config.add_directive('add_mongodb_index',
+                         add_mongodb_index,
+                         action_wrap=True)
+    config.add_tween('lumin.unit_of_work.unit_of_work_tween_factory',
+                     over=MAIN)
+    config.add_tween('lumin.db.request_trace_tween_factory')
     config.scan('lumin')
@@ -0,0 +1,187 @@
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import pickle
+import threading
+import time
+
+from zope.interface import Interface
+
+from pyramid.settings import asbool
+from pyramid.settings import aslist
+
+from lumin.identity import freeze
+
+
+class IDocumentCache(Interface):  # pragma: nocover
+    pass
+
+
+class DocumentCache(object):
+    """
+    A process wide LRU cache of documents loaded by
+    :class:`lumin.node.ContextById` and :class:`lumin.node.ContextBySpec`
+    for read-mostly :term:`collection` objects. Documents are stored
+    pickled, so every hit hands out a private copy and the cache can be
+    bounded by the bytes it holds as well as by its number of entries.
+
+    :param max_entries: The maximum number of cached documents.
+    **Default: 1000**
+    :param max_bytes: The maximum size of all cached documents.
+    **Default: 16MB**
+    :param ttl: Seconds a document is served from the cache before it
+    is loaded again. **Default: 300**
+    :param verify: Check the cached ``mtime`` against the stored
+    document on every hit. This costs a small indexed query but guards
+    against documents changed by other processes. **Default: False**
+    :param collections: The names of the :term:`collection` objects to
+    cache. **Default: ()**
+    """
+    def __init__(self,
+                 max_entries=1000,
+                 max_bytes=16 * 1024 * 1024,
+                 ttl=300,
+                 verify=False,
+                 collections=(),
+                 timer=time.time):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.verify = verify
+        self.collections = frozenset(collections)
+        self._timer = timer
+        self._lock = threading.Lock()
+        # key -> (oid, pickled document, expires)
+        self._entries = OrderedDict()
+        # (collection, oid) -> set of keys caching that document
+        self._keys = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, collection, spec):
+        """
+        Return a copy of the document cached for ``spec`` in
+        ``collection`` or ``None``.
+        """
+        key = (collection, freeze(spec))
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and entry[2] < self._timer():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            ## Most recently used entries live at the end
+            self._entries[key] = self._entries.pop(key)
+            self.hits += 1
+        return pickle.loads(entry[1])
+
+    def set(self, collection, spec, doc):
+        """
+        Cache ``doc`` as the document ``spec`` finds in ``collection``.
+        """
+        key = (collection, freeze(spec))
+        value = pickle.dumps(doc, pickle.HIGHEST_PROTOCOL)
+        if len(value) > self.max_bytes:
+            return
+        oid = freeze(doc.get('_id', None))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (oid, value, self._timer() + self.ttl)
+            self._keys.setdefault((collection, oid), set()).add(key)
+            self.bytes += len(value)
+            while len(self._entries) > self.max_entries or \
+                  self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, collection, oid):
+        """
+        Drop every entry caching the document ``oid`` of ``collection``.
+        """
+        with self._lock:
+            for key in list(self._keys.get((collection, freeze(oid)), ())):
+                self._remove(key)
+
+    def invalidate_queries(self, collection):
+        """
+        Drop the entries of ``collection`` cached for a spec other than
+        an ``_id``, which a newly inserted document may also match.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] == collection and not _is_id_spec(key[1]):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """
+        Return the counters to size the cache with.
+        """
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            }
+
+    def _remove(self, key):
+        oid, value, expires = self._entries.pop(key)
+        self.bytes -= len(value)
+        keys = self._keys.get((key[0], oid), None)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys[(key[0], oid)]
+
+
+def _is_id_spec(frozen_spec):
+    return len(frozen_spec) == 1 and frozen_spec[0][0] == '_id'
+
+
+def get_document_cache(registry):
+    """
+    Return the :class:`DocumentCache` registered with ``registry``,
+    creating it from the ``lumin.cache.*`` settings on first use.
+    Returns ``None`` unless ``lumin.cache.collections`` names at least
+    one :term:`collection`.
+    """
+    cache = registry.queryUtility(IDocumentCache)
+    if cache is None:
+        settings = registry.settings or {}
+        collections = aslist(settings.get('lumin.cache.collections', ''))
+        if not collections:
+            return None
+        cache = DocumentCache(
+            max_entries=int(settings.get('lumin.cache.max_entries', 1000)),
+            max_bytes=int(settings.get('lumin.cache.max_bytes',
+                                       16 * 1024 * 1024)),
+            ttl=float(settings.get('lumin.cache.ttl', 300)),
+            verify=asbool(settings.get('lumin.cache.verify', False)),
+            collections=collections,
+            )
+        registry.registerUtility(cache, IDocumentCache)
+    return cache
+
+
+def cache_for(registry, collection):
+    """
+    Return the :class:`DocumentCache` if ``collection`` is cached.
+    """
+    cache = get_document_cache(registry)
+    if cache is not None and collection in cache.collections:
+        return cache
+    return None
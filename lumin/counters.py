@@ -0,0 +1,232 @@
+from __future__ import unicode_literals
+
+import atexit
+import logging
+import threading
+import time
+
+from pymongo.errors import BulkWriteError
+try:
+    from pymongo.errors import ServerSelectionTimeoutError
+except ImportError:  # pragma: no cover
+    ## pymongo < 3.0 fails to connect with ConnectionFailure
+    from pymongo.errors import ConnectionFailure as ServerSelectionTimeoutError
+
+from zope.interface import Interface
+
+from lumin.cache import get_document_cache
+
+log = logging.getLogger(__name__)
+
+
+class ICounterBuffer(Interface):  # pragma: nocover
+    pass
+
+
+class CounterBuffer(object):
+    """
+    A process wide buffer of ``$inc`` increments to high frequency
+    counters such as view counts, keyed by :term:`collection`, ``_id``
+    and field. A background thread writes them every ``interval``
+    seconds as one unordered bulk write per collection, and once more
+    when the process exits. When no server can be selected the
+    increments are kept for the next flush. Increments the server
+    rejects, or which may have been written before an error, are
+    logged and dropped rather than risk counting them twice.
+
+    The increments written are kept for ``retain`` seconds, so the
+    value of a document loaded before they were written still counts
+    them, and its copies in the ``cache`` are dropped.
+
+    :param db: The database the counters are stored in.
+    :param interval: Seconds between flushes. **Default: 5.0**
+    :param cache: The :class:`lumin.cache.DocumentCache`, if any.
+    :param retain: Seconds to keep the written increments.
+    **Default: 300.0**
+    """
+    def __init__(self, db, interval=5.0, timer=time.time, cache=None,
+                 retain=300.0):
+        self.db = db
+        self.interval = interval
+        self.cache = cache
+        self.retain = retain
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        # (collection, _id) -> {field: n}
+        self._pending = {}
+        # the increments being written by a flush
+        self._inflight = {}
+        # [(time written, {(collection, _id): {field: n}})]
+        self._written = []
+        self.flushes = 0
+        self.written = 0
+        self.errors = 0
+        self.last_duration = 0.0
+
+    def inc(self, collection, _id, field, n=1):
+        """
+        Add ``n`` to ``field`` of the document ``_id`` in
+        ``collection`` with the next flush.
+        """
+        with self._lock:
+            fields = self._pending.setdefault((collection, _id), {})
+            fields[field] = fields.get(field, 0) + n
+        self._start()
+
+    def pending(self, collection, _id, field):
+        """
+        Return the increments to ``field`` not yet written, including
+        those being written.
+        """
+        key = (collection, _id)
+        with self._lock:
+            return (self._pending.get(key, {}).get(field, 0) +
+                    self._inflight.get(key, {}).get(field, 0))
+
+    def flushed(self, collection, _id, field, since):
+        """
+        Return the increments to ``field`` written at or after the time
+        ``since``.
+        """
+        key = (collection, _id)
+        with self._lock:
+            return sum(written.get(key, {}).get(field, 0)
+                       for (when, written) in self._written if when >= since)
+
+    def value(self, collection, doc, field, loaded=None):
+        """
+        Return the count of ``field``, a dotted path, in ``doc`` as
+        loaded from ``collection`` plus the pending increments, and
+        those written since ``doc`` was ``loaded``, a time.
+        """
+        value = doc
+        for key in field.split('.'):
+            value = value.get(key, {}) if isinstance(value, dict) else 0
+        if not isinstance(value, (int, float)):
+            value = 0
+        value += self.pending(collection, doc.get('_id'), field)
+        if loaded is not None:
+            value += self.flushed(collection, doc.get('_id'), field, loaded)
+        return value
+
+    def flush(self):
+        """
+        Write the pending increments now.
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._inflight, self._pending = self._pending, {}
+            if not self._inflight:
+                return
+            start = self._timer()
+            by_collection = {}
+            for (collection, _id), fields in self._inflight.items():
+                by_collection.setdefault(collection, []).append(
+                    (_id, fields))
+            failed = {}
+            written = {}
+            for collection, updates in by_collection.items():
+                bulk = self.db[collection].initialize_unordered_bulk_op()
+                for _id, fields in updates:
+                    bulk.find({'_id': _id}).update_one({'$inc': fields})
+                try:
+                    bulk.execute()
+                    self.written += len(updates)
+                    for _id, fields in updates:
+                        written[(collection, _id)] = fields
+                except ServerSelectionTimeoutError:
+                    ## Nothing was sent, write it all again
+                    self.errors += 1
+                    log.exception('Writing %d counters of %s failed',
+                                  len(updates), collection)
+                    for _id, fields in updates:
+                        failed[(collection, _id)] = fields
+                except BulkWriteError as e:
+                    ## The other updates of an unordered bulk write
+                    ## were applied
+                    errors = e.details.get('writeErrors', [])
+                    self.errors += 1
+                    self.written += len(updates) - len(errors)
+                    rejected = set()
+                    for error in errors:
+                        rejected.add(error['index'])
+                        _id, fields = updates[error['index']]
+                        log.error('Dropped the counters %r of %r in %s: %s',
+                                  fields, _id, collection, error.get('errmsg'))
+                    for i, (_id, fields) in enumerate(updates):
+                        if i not in rejected:
+                            written[(collection, _id)] = fields
+                except Exception:
+                    self.errors += 1
+                    log.exception('Dropped %d counters of %s, they may '
+                                  'have been written', len(updates),
+                                  collection)
+            if self.cache is not None:
+                for collection, _id in written:
+                    self.cache.invalidate(collection, _id)
+            with self._lock:
+                for key, fields in failed.items():
+                    pending = self._pending.setdefault(key, {})
+                    for field, n in fields.items():
+                        pending[field] = pending.get(field, 0) + n
+                ## In the same step as they stop being in flight
+                now = self._timer()
+                self._written = [(when, w) for (when, w) in self._written
+                                 if when >= now - self.retain]
+                if written:
+                    self._written.append((now, written))
+                self._inflight = {}
+            self.flushes += 1
+            self.last_duration = self._timer() - start
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'pending': pending,
+            'flushes': self.flushes,
+            'written': self.written,
+            'errors': self.errors,
+            'last_duration': self.last_duration,
+            }
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run,
+                                          name='lumin-counters')
+                thread.daemon = True
+                thread.start()
+                atexit.register(self.flush)
+                self._thread = thread
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+def get_counter_buffer(registry):
+    """
+    Return the :class:`CounterBuffer` registered with ``registry``,
+    creating it on first use. ``lumin.counters.interval`` sets the
+    seconds between flushes and ``lumin.counters.retain`` how long the
+    written increments are kept.
+    """
+    counters = registry.queryUtility(ICounterBuffer)
+    if counters is None:
+        from lumin.db import IMongoDBConnection
+        settings = registry.settings or {}
+        connection = registry.getUtility(IMongoDBConnection)
+        counters = CounterBuffer(
+            connection[settings['mongodb.db_name']],
+            interval=float(settings.get('lumin.counters.interval', 5.0)),
+            cache=get_document_cache(registry),
+            retain=float(settings.get('lumin.counters.retain', 300.0)),
+            )
+        registry.registerUtility(counters, ICounterBuffer)
+    return counters
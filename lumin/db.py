@@ -1,42 +1,113 @@
+import logging
+import random
+import threading
+import time
+import warnings
+
 from gridfs import GridFS
 import pymongo
 
 from zope.interface import Interface
 
-from pyramid.events import subscriber
-from pyramid.interfaces import INewRequest
+from pyramid.compat import string_types
+from pyramid.settings import asbool
+
+from lumin.indexes import ensure_indexes
+from lumin.metrics import CommandListener
+from lumin.metrics import get_metrics
+from lumin.metrics import metrics_view
+
+from lumin.son import pipeline_from_settings
 
-from lumin.son import ColanderNullTransformer
+
+log = logging.getLogger(__name__)
 
 
 class IMongoDBConnection(Interface):  # pragma: nocover
     pass
 
 
+class IMongoDBHandles(Interface):  # pragma: nocover
+    pass
+
+
+class MongoDBHandles(object):
+    """
+    The configured database of a registry and its ``GridFS``, created
+    on first use. They are held here rather than registered themselves
+    as pymongo objects answer any attribute lookup with a collection.
+    """
+    def __init__(self):
+        self.db = None
+        self.fs = None
+
+
+def _handles(registry):
+    handles = registry.queryUtility(IMongoDBHandles)
+    if handles is None:
+        handles = MongoDBHandles()
+        registry.registerUtility(handles, IMongoDBHandles)
+    return handles
+
+
 def get_mongodb(registry):
+    """
+    Return the database ``mongodb.db_name`` of the registered
+    connection with lumin's SON manipulators added, see
+    :func:`lumin.son.pipeline_from_settings`. It is configured once and
+    shared by every request.
+    """
+    handles = _handles(registry)
+    if handles.db is None:
+        db_name = registry.settings['mongodb.db_name']
+        db = registry.getUtility(IMongoDBConnection)[db_name]
+        db.add_son_manipulator(pipeline_from_settings(registry.settings))
+        handles.db = db
+    return handles.db
+
+
+def get_gridfs(registry):
+    """
+    Return the ``GridFS`` of the :func:`get_mongodb` database, created
+    on first use and then shared by every request.
+    """
+    handles = _handles(registry)
+    if handles.fs is None:
+        db = get_mongodb(registry)
+        try:
+            handles.fs = GridFS(db)
+        except TypeError:  # pragma: no cover
+            ## TODO: need to find a better way
+            ## NB: using mock db so we use a mock gfs
+            from lumin.testing import MockGridFS
+            handles.fs = MockGridFS(db)
+    return handles.fs
+
+
+def request_db(request):
+    return get_mongodb(request.registry)
 
-    db_name = registry.settings['mongodb.db_name']
-    db = registry.getUtility(IMongoDBConnection)[db_name]
-    db.add_son_manipulator(ColanderNullTransformer())
-    return db
+
+def request_fs(request):
+    return get_gridfs(request.registry)
 
 
-@subscriber(INewRequest)
 def add_mongodb(event):
-    db = get_mongodb(event.request.registry)
-    event.request.db = db
-    try:
-        event.request.fs = GridFS(db)
-    except TypeError:  # pragma: no cover
-        ## TODO: need to find a better way
-        ## NB: using mock db so we use a mock gfs
-        ## not sure if we can add a mock gfs to the
-        ## firing event in the test that requires it.
-        from lumin.testing import MockGridFS
-        event.request.fs = MockGridFS(event.request.db)
+    """
+    Set ``request.db`` and ``request.fs`` of a ``NewRequest`` ``event``.
+
+    .. deprecated:: 0.5
+       :func:`register_mongodb` adds them to every request as reified
+       properties, this subscriber is no longer needed.
+    """
+    warnings.warn('lumin.db.add_mongodb is deprecated, register_mongodb '
+                  'adds request.db and request.fs',
+                  DeprecationWarning, stacklevel=2)
+    event.request.db = get_mongodb(event.request.registry)
+    event.request.fs = get_gridfs(event.request.registry)
 
 
-def connection_from_settings(settings, pymongo=pymongo):
+def connection_from_settings(settings, pymongo=pymongo, event_listeners=None):
     """
     :param settings: a `pyramid.config.Configurator.registry.settings`
     instance. It should contain a client class to use for the connection as
@@ -46,14 +117,54 @@ def connection_from_settings(settings, pymongo=pymongo):
     class by default. I.e. see `pymongo.mongo_client.MongoClient <http://bit.ly/YK37OJ>`_
     for a list of options appropriate to
     `pymongo.mongo_client.MongoClient <http://bit.ly/YK37OJ>`
+
+    :param event_listeners: pymongo monitoring listeners of the
+    connection, see :class:`lumin.metrics.MongoDBMetrics`.
     """
     mongo_options = {k.split("mongodb.options.")[-1]: v for k, v in \
         settings.items() if k.startswith('mongodb.options.')}
+    if event_listeners:
+        mongo_options['event_listeners'] = event_listeners
     connclass = getattr(pymongo,
         settings.get("mongodb.connection_class", "MongoClient"))
     return connclass(settings.get('mongodb.db_uri'), **mongo_options)
 
 
+def event_listeners(registry):
+    """
+    Return the pymongo monitoring listeners the settings of ``registry``
+    call for, the :class:`lumin.metrics.MongoDBMetrics` listeners with
+    ``lumin.metrics = true`` and the :class:`RequestTraceListener` with
+    ``lumin.trace = true``. :func:`register_mongodb` adds them to the
+    connection it creates; pass them as the ``event_listeners`` of a
+    connection created by the application.
+    """
+    settings = registry.settings or {}
+    listeners = []
+    if asbool(settings.get('lumin.metrics', False)):
+        listeners.extend(get_metrics(registry).listeners)
+    if asbool(settings.get('lumin.trace', False)) and \
+            CommandListener is not object:
+        listeners.append(trace_listener)
+    return listeners
+
+
+def _has_listeners(conn, listeners):
+    """
+    Return whether ``conn`` was created with any of ``listeners``.
+    """
+    ## pymongo keeps them privately and lists all but the pool
+    ## listeners, which are passed along with the others. Other clients
+    ## are assumed to publish no events.
+    try:
+        attached = [listener for group in
+                    conn._event_listeners.event_listeners()
+                    for listener in group]
+    except (AttributeError, TypeError):
+        attached = []
+    return any(listener in attached for listener in listeners)
+
+
 def register_mongodb(config, conn=None):
     """
     Register a mongodb connection with the configuration registry.
@@ -78,8 +189,221 @@ def register_mongodb(config, conn=None):
 
         config = Configurator(...)
         config = config.register_mongodb()
+
+    The database is configured once, see :func:`get_mongodb`, and
+    added to requests as the ``request.db`` and ``request.fs`` reified
+    properties, so requests which do not use MongoDB never touch it.
+
+    With ``lumin.metrics = true`` the connection created from the
+    settings counts its operations and pool use, see
+    :func:`lumin.metrics.get_metrics`, and ``lumin.metrics.path``
+    serves them, e.g. ``/metrics``, to the addresses listed in
+    ``lumin.metrics.allow``, see :func:`lumin.metrics.metrics_view`. A ``conn`` must
+    be created with the :func:`event_listeners` of the registry to be
+    counted, otherwise a warning is logged.
+
+    With ``lumin.trace = true`` the connection created from the settings
+    reports its commands to the :class:`RequestTrace` of each request,
+    see :func:`request_trace_tween_factory`. As with the metrics, a
+    ``conn`` must be created with the :func:`event_listeners` of the
+    registry.
+
+    With ``lumin.indexes.ensure = true`` in the settings, the indexes
+    missing from the database are built in the background once the
+    configuration is committed. See :func:`lumin.indexes.ensure_indexes`.
     """
 
-    connection = conn if conn else connection_from_settings(config.registry.settings)
+    settings = config.registry.settings
+    metrics = asbool(settings.get('lumin.metrics', False))
+    if conn:
+        connection = conn
+        if metrics and not _has_listeners(
+                conn, get_metrics(config.registry).listeners):
+            log.warning('lumin.metrics is enabled but the connection passed '
+                        'to register_mongodb was not created with its '
+                        'listeners, nothing will be counted. Pass '
+                        'lumin.db.event_listeners(registry) as its '
+                        'event_listeners.')
+        if asbool(settings.get('lumin.trace', False)) and \
+                CommandListener is not object and \
+                not _has_listeners(conn, [trace_listener]):
+            log.warning('lumin.trace is enabled but the connection passed '
+                        'to register_mongodb was not created with its '
+                        'listener, requests will trace no commands. Pass '
+                        'lumin.db.event_listeners(registry) as its '
+                        'event_listeners.')
+    else:
+        connection = connection_from_settings(
+            settings, event_listeners=event_listeners(config.registry))
     config.registry.registerUtility(connection, IMongoDBConnection)
+    path = settings.get('lumin.metrics.path', None)
+    if metrics and path:
+        config.add_route('lumin_metrics', path)
+        config.add_view(metrics_view, route_name='lumin_metrics')
+    ## A new connection replaces the database and GridFS of the old one
+    config.registry.registerUtility(MongoDBHandles(), IMongoDBHandles)
+    config.add_request_method(request_db, 'db', reify=True)
+    config.add_request_method(request_fs, 'fs', reify=True)
+    if asbool(config.registry.settings.get('lumin.indexes.ensure', False)):
+        ## Once the configuration is committed all Collection subclasses
+        ## have been scanned
+        config.action(None, ensure_indexes, args=(config.registry, ))
     return connection
+
+
+def query_shape(command_name, command):
+    """
+    Return the shape of the query of ``command``, its filter with every
+    value replaced by ``?``, so the queries of an N+1 pattern share one
+    shape.
+    """
+    spec = None
+    for key in ('filter', 'query', 'q'):
+        if isinstance(command.get(key, None), dict):
+            spec = command[key]
+            break
+    for key in ('updates', 'deletes'):
+        statements = command.get(key, None)
+        if spec is None and statements:
+            spec = statements[0].get('q', None)
+    if spec is None:
+        return ''
+    return _shape(spec)
+
+
+def _shape(value):
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join(
+            '%s: %s' % (k, _shape(value[k])) for k in sorted(value))
+    if isinstance(value, list) and any(isinstance(v, dict) for v in value):
+        ## $and/$or clauses
+        return '[%s]' % ', '.join(_shape(v) for v in value)
+    return '?'
+
+
+class RequestTrace(object):
+    """
+    The commands issued while handling a request: their number, time
+    and the count of each ``(collection, command, shape)``, see
+    :func:`query_shape`.
+    """
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.shapes = {}
+
+    def record(self, collection, command, shape, seconds, failed=False):
+        key = (collection, command, shape)
+        self.shapes[key] = self.shapes.get(key, 0) + 1
+        self.count += 1
+        self.errors += int(failed)
+        self.seconds += seconds
+
+    def repeated(self, n=2):
+        """
+        Return the ``(collection, command, shape)`` issued at least
+        ``n`` times, most frequent first.
+        """
+        return sorted((k for (k, c) in self.shapes.items() if c >= n),
+                      key=lambda k: -self.shapes[k])
+
+    def summary(self):
+        most = sorted(self.shapes.items(), key=lambda item: -item[1])[:3]
+        return '%d commands %d errors %.1fms; %s' % (
+            self.count, self.errors, self.seconds * 1000,
+            ', '.join('%s %s %s x%d' % (collection, command, shape, n)
+                      for ((collection, command, shape), n) in most))
+
+
+class RequestTraceListener(CommandListener):
+    """
+    A pymongo command listener reporting commands to the
+    :class:`RequestTrace` of the request handled by the current thread,
+    if it is traced.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._started = {}
+
+    @property
+    def current(self):
+        return getattr(self._local, 'trace', None)
+
+    @current.setter
+    def current(self, trace):
+        self._local.trace = trace
+
+    def started(self, event):
+        if self.current is None:
+            return
+        name = event.command_name
+        collection = event.command.get(name, None)
+        if not isinstance(collection, string_types):
+            collection = ''
+        self._started[(event.connection_id, event.request_id)] = (
+            collection, query_shape(name, event.command))
+
+    def _finished(self, event, failed):
+        trace = self.current
+        started = self._started.pop(
+            (event.connection_id, event.request_id), None)
+        if trace is not None and started is not None:
+            collection, shape = started
+            trace.record(collection, event.command_name, shape,
+                         event.duration_micros / 1e6, failed)
+
+    def succeeded(self, event):
+        self._finished(event, False)
+
+    def failed(self, event):
+        self._finished(event, True)
+
+trace_listener = RequestTraceListener()
+
+
+def request_trace_tween_factory(handler, registry, listener=trace_listener):
+    """
+    With ``lumin.trace = true``, trace the MongoDB commands of a
+    ``lumin.trace.sample`` fraction of the requests, by default all,
+    and log a summary line per traced request. When the request exceeds
+    ``lumin.trace.budget`` commands or ``lumin.trace.budget_ms``
+    milliseconds of them, the summary is logged as a warning. The trace
+    is kept as ``request.lumin_trace``.
+
+    Commands of response callbacks, such as the unit of work flush, run
+    after the tween and are not counted. Only connections created with
+    the :func:`event_listeners` of the registry report their commands,
+    see :func:`register_mongodb`.
+    """
+    settings = registry.settings or {}
+    if not asbool(settings.get('lumin.trace', False)):
+        return handler
+    sample = float(settings.get('lumin.trace.sample', 1.0))
+    budget = settings.get('lumin.trace.budget', None)
+    budget = None if budget is None else int(budget)
+    budget_ms = settings.get('lumin.trace.budget_ms', None)
+    budget_ms = None if budget_ms is None else float(budget_ms)
+
+    def request_trace_tween(request):
+        if sample < 1.0 and random.random() >= sample:
+            return handler(request)
+        trace = request.lumin_trace = RequestTrace()
+        listener.current = trace
+        start = time.time()
+        try:
+            return handler(request)
+        finally:
+            listener.current = None
+            over = ((budget is not None and trace.count > budget) or
+                    (budget_ms is not None and
+                     trace.seconds * 1000 > budget_ms))
+            line = '%s %s in %.1fms: %s' % (
+                request.method, request.path_qs,
+                (time.time() - start) * 1000, trace.summary())
+            if over:
+                log.warning('MongoDB budget exceeded by %s', line)
+            else:
+                log.info('%s', line)
+
+    return request_trace_tween
@@ -0,0 +1,807 @@
+from __future__ import unicode_literals
+
+import atexit
+import calendar
+import datetime
+from itertools import groupby
+import logging
+import threading
+import time
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from bson.tz_util import utc
+
+from pymongo import ASCENDING
+from pymongo import DESCENDING
+
+from zope.interface import Interface
+
+from pyramid.compat import PY3
+from pyramid.settings import asbool
+
+from lumin.timestamps import as_datetime
+from lumin.tracking import diff
+from lumin.tracking import plain_copy
+
+if PY3:  # pragma: no cover
+    from queue import Empty
+    from queue import Full
+    from queue import Queue
+else:  # pragma: no cover
+    from Queue import Empty
+    from Queue import Full
+    from Queue import Queue
+
+log = logging.getLogger(__name__)
+
+# Key holding the patch of a history record stored as a delta
+PATCH = '_patch'
+
+
+class IHistoryQueue(Interface):  # pragma: nocover
+    pass
+
+
+class MissingKeyframeError(LookupError):
+    """
+    Raised when the keyframe a :class:`DeltaHistory` patch was made
+    against is missing, so its version can't be rebuilt.
+    """
+    def __init__(self, record_id, base):
+        super(MissingKeyframeError, self).__init__(
+            "Keyframe %r of history record %r is missing" % (base, record_id))
+        self.record_id = record_id
+        self.base = base
+
+
+class SnapshotHistory(object):
+    """
+    Stores every historical version of a document in full in the
+    ``<collection>.history`` :term:`collection`.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+
+    def record(self, record):
+        self.collection.save(record, manipulate=True)
+
+    # Indexes the queries of this layout need
+    indexes = [[('orig_id', ASCENDING), ('_id', DESCENDING)]]
+
+    def find(self, query, fields=None, limit=0, sort=DESCENDING):
+        if fields:
+            cursor = self.collection.find(query, fields)
+        else:
+            cursor = self.collection.find(query)
+        if limit:
+            cursor = cursor.limit(limit)
+        return cursor.sort('_id', sort)
+
+    def ensure_indexes(self):
+        for index in self.indexes:
+            self.collection.ensure_index(index, background=True)
+
+    def load(self, orig_id):
+        """
+        Return the versions of ``orig_id``, most recent first, and the
+        records they were read from, to pass to :meth:`discard`.
+        """
+        records = list(self.collection.find(
+            {'orig_id': orig_id}).sort('_id', DESCENDING))
+        return records, [record['_id'] for record in records]
+
+    def write(self, orig_id, versions):
+        """
+        Store the ``versions`` of ``orig_id``, most recent first, in
+        this layout. A version replaces the record with its ``_id``.
+        Returns the set of ``_id`` of the records written.
+        """
+        for version in reversed(versions):
+            self.collection.save(dict(version, orig_id=orig_id),
+                                 manipulate=True)
+        return set(version['_id'] for version in versions)
+
+    def discard(self, orig_id, records, keep=()):
+        """
+        Remove the ``records`` of ``orig_id`` returned by :meth:`load`,
+        but those with an ``_id`` in ``keep``.
+        """
+        ids = [oid for oid in records if oid not in keep]
+        if ids:
+            self.collection.remove({'_id': {'$in': ids}})
+
+    def drop(self, orig_id, versions, records, ids):
+        """
+        Remove the versions ``ids`` of ``orig_id`` from the history.
+        ``versions`` and ``records`` are as returned by :meth:`load`.
+        """
+        self.collection.remove({'_id': {'$in': list(ids)}})
+
+
+class DeltaHistory(SnapshotHistory):
+    """
+    Stores a full keyframe of a document every ``interval`` versions
+    and, for the versions in between, only the patch turning the last
+    keyframe into that version. Versions are rebuilt as the cursor
+    returned by :meth:`find` is consumed.
+
+    Records stored in full, including those written by
+    :class:`SnapshotHistory`, are read as keyframes, so the two can be
+    mixed in one :term:`collection`.
+
+    :param interval: The number of versions per keyframe. **Default: 10**
+    """
+    def __init__(self, collection, interval=10):
+        super(DeltaHistory, self).__init__(collection)
+        self.interval = interval
+
+    def record(self, record):
+        base = None
+        n = 0
+        latest = self.collection.find(
+            {'orig_id': record['orig_id']}).sort('_id', DESCENDING).limit(1)
+        for doc in latest:
+            meta = doc.get(PATCH, None)
+            if meta is None:
+                base, n = doc, 1
+            else:
+                base = self.collection.find_one({'_id': meta['base']})
+                n = meta['n'] + 1
+        self.collection.save(self._encode(record, base, n), manipulate=True)
+
+    def find(self, query, fields=None, limit=0, sort=DESCENDING):
+        cursor = self.collection.find(query)
+        if limit:
+            cursor = cursor.limit(limit)
+        cursor = cursor.sort('_id', sort)
+        return HistoryCursor(self.collection, cursor, fields)
+
+    def load(self, orig_id):
+        records = list(self.collection.find(
+            {'orig_id': orig_id}).sort('_id', DESCENDING))
+        keyframes = dict((record['_id'], record) for record in records
+                         if PATCH not in record)
+        versions = [rebuild(self.collection, record, keyframes)
+                    for record in records]
+        return versions, [record['_id'] for record in records]
+
+    def write(self, orig_id, versions):
+        base, n = None, 0
+        for version in reversed(versions):
+            record = dict(version, orig_id=orig_id)
+            encoded = self._encode(record, base, n)
+            if encoded is record:
+                base, n = record, 1
+            else:
+                n += 1
+            self.collection.save(dict(encoded), manipulate=True)
+        return set(version['_id'] for version in versions)
+
+    def discard(self, orig_id, records, keep=()):
+        ids = set(oid for oid in records if oid not in keep)
+        ## Keep the keyframes of patches recorded since ``records`` were
+        ## read, they are found with the ``orig_id`` index
+        for record in self.collection.find(
+                {'orig_id': orig_id, PATCH + '.base': {'$in': list(ids)}},
+                ['_id', PATCH]):
+            if record['_id'] not in ids:
+                ids.discard(record[PATCH]['base'])
+        super(DeltaHistory, self).discard(orig_id, list(ids))
+
+    def drop(self, orig_id, versions, records, ids):
+        ## Patches depend on their keyframe, so store the kept versions
+        ## again
+        rewrite_history(self, self, orig_id,
+                        [v for v in versions if v['_id'] not in ids], records)
+
+    def _encode(self, record, base, n):
+        """
+        Return ``record`` as the ``n``-th patch against the keyframe
+        ``base``, or ``record`` itself when it is due to be a keyframe.
+        """
+        if base is None or n >= self.interval:
+            return record
+        body = _body(record)
+        sets, unsets = diff(_body(base), body)
+        ## Every field but orig_id changed, the patch would not be smaller
+        if len(sets) + len(unsets) >= len(body) - 1:
+            return record
+        patch = {
+            'orig_id': record['orig_id'],
+            PATCH: {
+                'base': base['_id'],
+                'n': n,
+                'set': [[path.split('.'), value]
+                        for (path, value) in sets.items()],
+                'unset': [path.split('.') for path in unsets],
+                },
+            }
+        if '_id' in record:
+            patch['_id'] = record['_id']
+        return patch
+
+
+class BucketHistory(SnapshotHistory):
+    """
+    Stores the versions of a document in buckets, one history document
+    per document and window of ``seconds``, each holding up to ``size``
+    versions. Recording a version is a single upsert, and there is one
+    index entry per bucket instead of one per version. Index the
+    buckets on ``orig_id`` and ``window``.
+
+    :param seconds: The width of a bucket's time window.
+    **Default: 86400**
+    :param size: The maximum number of versions in a bucket.
+    **Default: 100**
+    """
+    indexes = [[('orig_id', ASCENDING), ('window', DESCENDING)]]
+
+    def __init__(self, collection, seconds=86400, size=100):
+        super(BucketHistory, self).__init__(collection)
+        self.seconds = seconds
+        self.size = size
+
+    def record(self, record):
+        version = dict(record)
+        oid = version.pop('orig_id')
+        if '_id' not in version:
+            version['_id'] = ObjectId()
+        window = _window(version['_id'], self.seconds)
+        self.collection.update(
+            {'orig_id': oid, 'window': window, 'count': {'$lt': self.size}},
+            {'$push': {'versions': version}, '$inc': {'count': 1}},
+            upsert=True,
+            manipulate=True)
+
+    def find(self, query, fields=None, limit=0, sort=DESCENDING):
+        return BucketCursor(self, query, fields, limit, sort)
+
+    def load(self, orig_id):
+        buckets = list(self.collection.find({'orig_id': orig_id}))
+        versions = [dict(version, orig_id=orig_id)
+                    for bucket in buckets for version in bucket['versions']]
+        versions.sort(key=lambda v: v['_id'], reverse=True)
+        return versions, [(bucket['_id'], [v['_id'] for v in bucket['versions']])
+                          for bucket in buckets]
+
+    def write(self, orig_id, versions):
+        buckets = []
+        for version in reversed(versions):
+            version = dict(version)
+            version.pop('orig_id', None)
+            window = _window(version['_id'], self.seconds)
+            if (not buckets or buckets[-1]['window'] != window
+                    or buckets[-1]['count'] >= self.size):
+                buckets.append({'_id': ObjectId(), 'orig_id': orig_id,
+                                'window': window, 'count': 0, 'versions': []})
+            buckets[-1]['versions'].append(version)
+            buckets[-1]['count'] += 1
+        for bucket in buckets:
+            self.collection.insert(bucket, manipulate=True)
+        return set(bucket['_id'] for bucket in buckets)
+
+    def discard(self, orig_id, records, keep=()):
+        ## Pull the versions read rather than removing their buckets,
+        ## which may have been recorded to since
+        emptied = []
+        for bucket_id, version_ids in records:
+            if bucket_id in keep or not version_ids:
+                continue
+            self.collection.update(
+                {'_id': bucket_id},
+                {'$pull': {'versions': {'_id': {'$in': version_ids}}},
+                 '$inc': {'count': -len(version_ids)}})
+            emptied.append(bucket_id)
+        if emptied:
+            self.collection.remove({'_id': {'$in': emptied},
+                                    'count': {'$lte': 0}})
+
+    def drop(self, orig_id, versions, records, ids):
+        self.discard(orig_id, [
+            (bucket_id, [oid for oid in version_ids if oid in ids])
+            for (bucket_id, version_ids) in records])
+
+
+class BucketCursor(object):
+    """
+    Iterates over the versions of a :class:`BucketHistory` matching a
+    ``query`` on ``orig_id`` and optionally ``_id``, in the ``sort``
+    order of their ``_id``, loading one window of buckets at a time.
+    """
+    def __init__(self, history, query, fields=None, limit=0,
+                 sort=DESCENDING):
+        self._history = history
+        self._query = dict(query)
+        self._fields = fields
+        self._limit = limit
+        self._sort = sort
+        self._versions = None
+        self._returned = 0
+
+    def _spec(self):
+        spec = dict(self._query)
+        bounds = spec.pop('_id', {})
+        window = {}
+        if '$gt' in bounds:
+            window['$gte'] = _window(bounds['$gt'], self._history.seconds)
+        if '$lt' in bounds:
+            window['$lte'] = bounds['$lt'].generation_time.replace(tzinfo=None)
+        if window:
+            spec['window'] = window
+        return spec, bounds
+
+    def _iter_versions(self):
+        spec, bounds = self._spec()
+        oid = spec['orig_id']
+        buckets = self._history.collection.find(spec).sort('window',
+                                                           self._sort)
+        for window, group in groupby(buckets, lambda b: b['window']):
+            versions = [v for bucket in group for v in bucket['versions']]
+            versions.sort(key=lambda v: v['_id'],
+                          reverse=self._sort == DESCENDING)
+            for version in versions:
+                if '$gt' in bounds and not version['_id'] > bounds['$gt']:
+                    continue
+                if '$lt' in bounds and not version['_id'] < bounds['$lt']:
+                    continue
+                version['orig_id'] = oid
+                yield version
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._versions is None:
+            self._versions = self._iter_versions()
+        if self._limit and self._returned >= self._limit:
+            raise StopIteration()
+        version = next(self._versions)
+        self._returned += 1
+        return _project(version, self._fields)
+
+    next = __next__
+
+    def count(self, with_limit_and_skip=False):
+        count = sum(1 for version in self._iter_versions())
+        if with_limit_and_skip and self._limit:
+            count = min(count, self._limit)
+        return count
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+
+class HistoryCursor(object):
+    """
+    Wraps a cursor over the records of a :class:`DeltaHistory`, yielding
+    each version in full. Keyframes are loaded once per cursor.
+    """
+    def __init__(self, collection, cursor, fields=None):
+        self._collection = collection
+        self._cursor = cursor
+        self._fields = fields
+        self._keyframes = {}
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        record = rebuild(self._collection, next(self._cursor),
+                         self._keyframes)
+        return _project(record, self._fields)
+
+    next = __next__
+
+    def count(self, *args, **kwargs):
+        return self._cursor.count(*args, **kwargs)
+
+    def limit(self, limit):
+        self._cursor = self._cursor.limit(limit)
+        return self
+
+    def skip(self, skip):
+        self._cursor = self._cursor.skip(skip)
+        return self
+
+    def sort(self, key, direction):
+        self._cursor = self._cursor.sort(key, direction)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class HistoryQueue(object):
+    """
+    A bounded, process wide queue of history records written behind the
+    request by a background thread, in batches of up to ``batch_size``.
+    Snapshot records are written with one insert per batch. Records
+    are written in the order they were queued, and the queue is flushed
+    when the process exits. While queued, a record is missing from
+    ``history()``.
+
+    When the queue is full, records are written synchronously.
+
+    :param maxsize: The maximum number of queued records.
+    **Default: 10000**
+    :param batch_size: The maximum number of records written at once.
+    **Default: 100**
+    :param interval: Seconds the background thread waits for a record
+    before checking again. **Default: 1.0**
+    """
+    def __init__(self,
+                 maxsize=10000,
+                 batch_size=100,
+                 interval=1.0,
+                 timer=time.time):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._timer = timer
+        self._queue = Queue(maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.queued = 0
+        self.written = 0
+        self.batches = 0
+        self.overflows = 0
+        self.errors = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+    def put(self, store, record):
+        """
+        Queue ``record`` to be written with the history ``store``.
+        """
+        ## Stamp the record now so history stays ordered by edit time
+        if '_id' not in record:
+            record['_id'] = ObjectId()
+        try:
+            self._queue.put_nowait((store, record, self._timer()))
+        except Full:
+            self.overflows += 1
+            store.record(record)
+            return
+        self.queued += 1
+        self._start()
+
+    def flush(self):
+        """
+        Block until every queued record is written.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+        else:
+            self._drain()
+
+    def stats(self):
+        """
+        Return the queue depth and flush latency counters.
+        """
+        return {
+            'depth': self._queue.qsize(),
+            'queued': self.queued,
+            'written': self.written,
+            'batches': self.batches,
+            'overflows': self.overflows,
+            'errors': self.errors,
+            'last_latency': self.last_latency,
+            'max_latency': self.max_latency,
+            }
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run,
+                                          name='lumin-history')
+                thread.daemon = True
+                thread.start()
+                atexit.register(self.flush)
+                self._thread = thread
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.interval)
+            except Empty:
+                continue
+            ## An error must not stop the thread, or every record
+            ## queued after it would be dropped
+            try:
+                self._write([item] + self._take(self.batch_size - 1))
+            except Exception:
+                log.exception('Writing history records failed')
+
+    def _take(self, limit):
+        items = []
+        while len(items) < limit:
+            try:
+                items.append(self._queue.get_nowait())
+            except Empty:
+                break
+        return items
+
+    def _drain(self):
+        items = self._take(self._queue.qsize())
+        while items:
+            self._write(items[:self.batch_size])
+            items = items[self.batch_size:]
+
+    def _write(self, items):
+        ## Collection objects compare by server address, which may
+        ## select a server
+        def key(item):
+            return (item[0].collection.full_name,
+                    type(item[0]) is SnapshotHistory)
+        try:
+            for (name, batch), group in groupby(items, key):
+                group = list(group)
+                try:
+                    if batch:
+                        collection = group[0][0].collection
+                        collection.insert([record for (_, record, _) in group],
+                                          manipulate=True,
+                                          continue_on_error=True)
+                    else:
+                        for store, record, _ in group:
+                            store.record(record)
+                    self.written += len(group)
+                except Exception:
+                    self.errors += len(group)
+                    log.exception('Writing %d history records failed',
+                                  len(group))
+            self.batches += 1
+            self.last_latency = self._timer() - items[0][2]
+            self.max_latency = max(self.max_latency, self.last_latency)
+        finally:
+            for item in items:
+                self._queue.task_done()
+
+
+class QueuedHistory(object):
+    """
+    Writes the records of a history ``store`` behind the request
+    through a :class:`HistoryQueue`.
+    """
+    def __init__(self, store, queue):
+        self.store = store
+        self.queue = queue
+
+    def record(self, record):
+        self.queue.put(self.store, record)
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+
+def history_page(store, orig_id, limit=10, token=None, fields=None,
+                 sort=DESCENDING):
+    """
+    Return a page of up to ``limit`` versions of ``orig_id`` from the
+    history ``store`` and the token to pass for the next page, which is
+    ``None`` on the last page. Pages continue from the ``_id`` of the
+    last version, so each is one query on the ``(orig_id, _id)`` index
+    however deep it is. Raises ``ValueError`` if ``token`` is not one of
+    these tokens.
+    """
+    query = {'orig_id': orig_id}
+    if token is not None:
+        try:
+            last = ObjectId(token)
+        except (InvalidId, TypeError):
+            raise ValueError("Invalid history page token %r" % (token, ))
+        operator = '$lt' if sort == DESCENDING else '$gt'
+        query['_id'] = {operator: last}
+    if fields:
+        ## The token is the _id of the last version
+        if not isinstance(fields, dict):
+            fields = dict.fromkeys(fields, True)
+        fields = {k: v for (k, v) in fields.items() if k != '_id'}
+        if any(fields.values()):
+            fields['_id'] = True
+    versions = list(store.find(query, fields, limit + 1, sort))
+    if len(versions) > limit:
+        versions = versions[:limit]
+        return versions, str(versions[-1]['_id'])
+    return versions, None
+
+
+def as_of(store, orig_id, when, current=None):
+    """
+    Return the version of ``orig_id`` in effect at the ``datetime``
+    ``when``, or ``None`` if it did not exist yet. A history record
+    holds the version replaced when it was written, so this is the
+    first record written after ``when``, or the ``current`` document
+    if there is none.
+    """
+    if when.tzinfo is not None:
+        when = when.astimezone(utc).replace(tzinfo=None)
+    query = {'orig_id': orig_id, '_id': {'$gt': ObjectId.from_datetime(when)}}
+    version = current
+    for version in store.find(query, limit=1, sort=ASCENDING):
+        break
+    if version is None or _ctime(version) > when:
+        return None
+    return version
+
+
+def _ctime(doc):
+    ctime = doc.get('ctime', None)
+    if ctime is None:
+        return datetime.datetime.min
+    return as_datetime(ctime)
+
+
+def rebuild(collection, record, keyframes=None):
+    """
+    Return the full version of the history ``record``. ``keyframes``
+    maps the ids of the keyframes already loaded to their documents.
+    Raises :class:`MissingKeyframeError` if the keyframe of a patch is
+    missing.
+    """
+    keyframes = {} if keyframes is None else keyframes
+    meta = record.get(PATCH, None)
+    if meta is None:
+        keyframes[record['_id']] = record
+        return record
+    base = keyframes.get(meta['base'], None)
+    if base is None:
+        base = collection.find_one({'_id': meta['base']})
+        if base is None:
+            raise MissingKeyframeError(record['_id'], meta['base'])
+        keyframes[meta['base']] = base
+    doc = plain_copy(base)
+    doc['_id'] = record['_id']
+    for path, value in meta['set']:
+        parent = doc
+        for key in path[:-1]:
+            parent = parent.setdefault(key, {})
+        parent[path[-1]] = plain_copy(value)
+    for path in meta['unset']:
+        parent = doc
+        for key in path[:-1]:
+            parent = parent.get(key, {})
+        parent.pop(path[-1], None)
+    return doc
+
+
+def _window(oid, seconds):
+    """
+    Return the start of the window of ``seconds`` the ``ObjectId``
+    ``oid`` was created in, as a naive UTC ``datetime``.
+    """
+    stamp = calendar.timegm(oid.generation_time.utctimetuple())
+    return datetime.datetime.utcfromtimestamp(stamp - stamp % seconds)
+
+
+def rewrite_history(source, target, orig_id, versions, records):
+    """
+    Replace the ``records`` of ``orig_id`` returned by ``source.load``
+    with its ``versions``, most recent first, stored by the history
+    store ``target``. The new records are written before only the ones
+    read are removed, so records written meanwhile are kept and a
+    failure leaves versions stored twice rather than lost.
+    """
+    written = target.write(orig_id, versions)
+    source.discard(orig_id, records, written)
+
+
+def history_ids(collection, batch_size=100):
+    """
+    Yield each ``orig_id`` of the history ``collection`` once, in
+    order. The ids are read ``batch_size`` records at a time on the
+    ``orig_id`` index, rather than all at once with ``distinct``, which
+    is limited to 16MB.
+    """
+    spec = {'orig_id': {'$exists': True}}
+    while True:
+        batch = list(collection.find(spec, ['orig_id'])
+                     .sort('orig_id', ASCENDING).limit(batch_size))
+        if not batch:
+            return
+        last = None
+        for i, record in enumerate(batch):
+            if i == 0 or record['orig_id'] != last:
+                last = record['orig_id']
+                yield last
+        spec = {'orig_id': {'$gt': last}}
+
+
+def _body(doc):
+    return {k: v for (k, v) in doc.items() if k != '_id'}
+
+
+def _project(doc, fields):
+    """
+    Apply the top level projection ``fields``, a ``list`` of fields to
+    include or a ``dict`` of fields to include or exclude, to ``doc``.
+    """
+    if not fields:
+        return doc
+    if not isinstance(fields, dict):
+        fields = dict.fromkeys(fields, True)
+    keep = set(k for (k, v) in fields.items() if v and k != '_id')
+    if keep:
+        if fields.get('_id', True):
+            keep.add('_id')
+        return {k: v for (k, v) in doc.items() if k in keep}
+    return {k: v for (k, v) in doc.items() if k not in fields}
+
+
+def store_for(mode, collection, settings=None):
+    """
+    Return the history store ``mode``, ``snapshot``, ``delta`` or
+    ``bucket``, for the history ``collection``, configured from the
+    ``lumin.history.*`` ``settings``.
+    """
+    settings = settings or {}
+    if mode == 'snapshot':
+        return SnapshotHistory(collection)
+    if mode == 'delta':
+        interval = int(settings.get('lumin.history.keyframe_interval', 10))
+        return DeltaHistory(collection, interval)
+    if mode == 'bucket':
+        seconds = int(settings.get('lumin.history.bucket_seconds', 86400))
+        size = int(settings.get('lumin.history.bucket_size', 100))
+        return BucketHistory(collection, seconds, size)
+    raise ValueError("Unknown lumin.history mode %r" % mode)
+
+
+def history_for(request, collection):
+    """
+    Return the store for the history ``collection`` selected by the
+    ``lumin.history`` setting, ``snapshot`` (the default), ``delta`` or
+    ``bucket``. See :func:`store_for`. With ``lumin.history.write_behind``
+    enabled, records are written through the :class:`HistoryQueue`.
+    """
+    settings = request.registry.settings or {}
+    store = store_for(settings.get('lumin.history', 'snapshot'),
+                      collection, settings)
+    queue = get_history_queue(request.registry)
+    if queue is not None:
+        store = QueuedHistory(store, queue)
+    return store
+
+
+def get_history_queue(registry):
+    """
+    Return the :class:`HistoryQueue` registered with ``registry``,
+    creating it from the ``lumin.history.*`` settings on first use.
+    Returns ``None`` unless ``lumin.history.write_behind`` is enabled.
+    """
+    queue = registry.queryUtility(IHistoryQueue)
+    if queue is None:
+        settings = registry.settings or {}
+        if not asbool(settings.get('lumin.history.write_behind', False)):
+            return None
+        queue = HistoryQueue(
+            maxsize=int(settings.get('lumin.history.queue_size', 10000)),
+            batch_size=int(settings.get('lumin.history.batch_size', 100)),
+            interval=float(settings.get('lumin.history.flush_interval', 1.0)),
+            )
+        registry.registerUtility(queue, IHistoryQueue)
+    return queue
+
+
+def convert_history(source, target, batch_size=100):
+    """
+    Rewrite every version read with the history store ``source`` with
+    the store ``target``, e.g. to compress existing snapshots with a
+    :class:`DeltaHistory`, one ``orig_id`` at a time. Both must use the
+    same :term:`collection`. See :func:`rewrite_history`. The history of
+    a document with a missing keyframe is logged and left as it is.
+    Returns the number of versions rewritten.
+    """
+    count = 0
+    for oid in history_ids(source.collection, batch_size):
+        try:
+            versions, records = source.load(oid)
+        except MissingKeyframeError as e:
+            log.warning('Skipped the history of %r: %s', oid, e)
+            continue
+        rewrite_history(source, target, oid, versions, records)
+        count += len(versions)
+    return count
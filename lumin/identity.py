@@ -0,0 +1,73 @@
+from __future__ import unicode_literals
+
+from pyramid.settings import asbool
+
+
+def freeze(value):
+    """
+    Return a hashable equivalent of ``value``, a :term:`SON` spec or
+    any value nested in it.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for (k, v) in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+class IdentityMap(object):
+    """
+    A request scoped map of the :term:`context` objects loaded from each
+    :term:`collection`, keyed by collection name and the spec they were
+    loaded with. Within a request repeated lookups of the same document
+    share one loaded context instead of querying MongoDB again.
+
+    Enable it by setting ``lumin.identity_map = true`` in the
+    configuration .ini
+    """
+    def __init__(self):
+        self._contexts = {}
+
+    def _key(self, collection, spec):
+        return (collection, freeze(spec))
+
+    def get(self, collection, spec):
+        return self._contexts.get(self._key(collection, spec), None)
+
+    def add(self, context, spec=None):
+        spec = context._spec if spec is None else spec
+        self._contexts[self._key(context.collection, spec)] = context
+
+    def discard(self, collection, spec):
+        self._contexts.pop(self._key(collection, spec), None)
+
+    def discard_id(self, collection, _id):
+        """
+        Discard every context of ``collection`` holding the document
+        ``_id``, whatever spec it was loaded with.
+        """
+        for key, context in list(self._contexts.items()):
+            data = getattr(context, 'data', None) or {}
+            if key[0] == collection and (
+                    key[1] == freeze({'_id': _id}) or
+                    data.get('_id', None) == _id):
+                del self._contexts[key]
+
+    def clear(self):
+        self._contexts.clear()
+
+    def __len__(self):
+        return len(self._contexts)
+
+
+def get_identity_map(request):
+    """
+    Return the :class:`IdentityMap` of ``request``, or ``None`` when
+    the ``lumin.identity_map`` setting isn't enabled.
+    """
+    imap = getattr(request, 'lumin_identity_map', None)
+    if imap is None:
+        settings = request.registry.settings or {}
+        if asbool(settings.get('lumin.identity_map', False)):
+            imap = request.lumin_identity_map = IdentityMap()
+    return imap
@@ -0,0 +1,196 @@
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import logging
+
+from pymongo import ASCENDING
+
+from zope.interface import Interface
+
+from pyramid.compat import string_types
+
+log = logging.getLogger(__name__)
+
+
+class IIndexRegistry(Interface):  # pragma: nocover
+    pass
+
+
+def normalize_keys(keys):
+    """
+    Return the index ``keys``, a field name or a list of
+    ``(field, direction)`` pairs, as a list of pairs.
+    """
+    if isinstance(keys, string_types):
+        return [(keys, ASCENDING)]
+    return [tuple(key) for key in keys]
+
+
+class IndexRegistry(object):
+    """
+    The indexes each :term:`collection` needs, and the options to create
+    them with, e.g. ``unique`` or ``expireAfterSeconds``.
+    """
+    def __init__(self):
+        self._indexes = OrderedDict()
+
+    def add(self, collection, keys, **options):
+        keys = tuple(normalize_keys(keys))
+        self._indexes[(collection, keys)] = options
+
+    def add_declared(self, collection, indexes):
+        """
+        Add ``indexes`` declared like ``Collection.__indexes__``, each
+        either index keys or a ``dict`` of the ``keys`` and options.
+        """
+        for index in indexes:
+            if isinstance(index, dict):
+                options = dict(index)
+                self.add(collection, options.pop('keys'), **options)
+            else:
+                self.add(collection, index)
+
+    def update(self, other):
+        self._indexes.update(other._indexes)
+
+    def __iter__(self):
+        for (collection, keys), options in self._indexes.items():
+            yield collection, list(keys), options
+
+    def __len__(self):
+        return len(self._indexes)
+
+    def apply(self, db, create=True):
+        """
+        Build the indexes missing from ``db`` in the background, unless
+        ``create`` is false, and compare the others with their
+        declaration. Returns a report of the ``created``, ``existing``
+        and ``drifted`` indexes, the latter with the ``{option:
+        (existing, declared)}`` that differ, and of the ``undeclared``
+        indexes of the collections in the registry.
+        """
+        report = {'created': [], 'existing': [], 'drifted': [],
+                  'undeclared': []}
+        declared = {}
+        for collection, keys, options in self:
+            declared.setdefault(collection, []).append(keys)
+        for collection, keys, options in self:
+            info = db[collection].index_information()
+            existing = _find_index(info, keys)
+            if existing is None:
+                if create:
+                    db[collection].create_index(keys, background=True,
+                                                **options)
+                report['created'].append((collection, keys))
+                continue
+            drift = {}
+            for option, value in options.items():
+                if existing.get(option, None) != value:
+                    drift[option] = (existing.get(option, None), value)
+            if drift:
+                report['drifted'].append((collection, keys, drift))
+            else:
+                report['existing'].append((collection, keys))
+        for collection, keys_list in declared.items():
+            info = db[collection].index_information()
+            for name, spec in info.items():
+                keys = normalize_keys(spec['key'])
+                if name != '_id_' and keys not in keys_list:
+                    report['undeclared'].append((collection, keys))
+        return report
+
+
+def _find_index(info, keys):
+    for spec in info.values():
+        if normalize_keys(spec['key']) == keys:
+            return spec
+    return None
+
+
+def get_index_registry(registry):
+    """
+    Return the :class:`IndexRegistry` of the indexes added with the
+    ``add_mongodb_index`` directive.
+    """
+    indexes = registry.queryUtility(IIndexRegistry)
+    if indexes is None:
+        indexes = IndexRegistry()
+        registry.registerUtility(indexes, IIndexRegistry)
+    return indexes
+
+
+def add_mongodb_index(config, collection, keys, **options):
+    """
+    Declare an index of ``collection``, built by
+    :func:`ensure_indexes`. This is added as a
+    `pyramid.config.Configurator <http://bit.ly/QNns19>`_ directive in
+    :meth:`lumin.includeme`.
+
+    .. code-block:: python
+
+        config.add_mongodb_index('users', 'email', unique=True)
+    """
+    get_index_registry(config.registry).add(collection, keys, **options)
+
+
+def builtin_indexes(settings):
+    """
+    Return an :class:`IndexRegistry` of the indexes of lumin's own
+    collections: the sessions, expired after ``lumin.session.timeout``
+    seconds, and the GridFS ``tempstore``.
+    """
+    from lumin.grid_fs import MongoUploadTmpStore
+    indexes = IndexRegistry()
+    sessions = settings.get('lumin.session.collection', 'lumin.sessions')
+    indexes.add(sessions, 'atime', expireAfterSeconds=int(
+        settings.get('lumin.session.timeout', 1200)))
+    max_age = settings.get('lumin.session.cookie_max_age', None)
+    if max_age:
+        indexes.add(sessions, 'ctime', expireAfterSeconds=int(max_age))
+    files = '%s.files' % MongoUploadTmpStore.__collection__
+    indexes.add(files, 'uid')
+    indexes.add(files, 'uploadDate')
+    return indexes
+
+
+def declared_indexes(settings):
+    """
+    Return an :class:`IndexRegistry` of the ``__indexes__`` declared by
+    the imported :class:`lumin.node.Collection` subclasses naming a
+    ``collection``, and of the indexes of their history.
+    """
+    from lumin.history import store_for
+    from lumin.node import Collection
+    history = store_for(settings.get('lumin.history', 'snapshot'), None,
+                        settings)
+    indexes = IndexRegistry()
+    classes = Collection.__subclasses__()
+    while classes:
+        cls = classes.pop()
+        classes.extend(cls.__subclasses__())
+        if cls.collection is None:
+            continue
+        indexes.add_declared(cls.collection, cls.__indexes__)
+        indexes.add_declared('%s.history' % cls.collection, history.indexes)
+    return indexes
+
+
+def ensure_indexes(registry, db=None, create=True):
+    """
+    Build the built-in, declared and added indexes missing from ``db``
+    and log those which drifted from their declaration. See
+    :meth:`IndexRegistry.apply` for the report returned.
+    """
+    settings = registry.settings or {}
+    if db is None:
+        from lumin.db import IMongoDBConnection
+        connection = registry.getUtility(IMongoDBConnection)
+        db = connection[settings['mongodb.db_name']]
+    indexes = builtin_indexes(settings)
+    indexes.update(declared_indexes(settings))
+    indexes.update(get_index_registry(registry))
+    report = indexes.apply(db, create)
+    for collection, keys, drift in report['drifted']:
+        log.warning('Index %r of %s differs from its declaration: %r',
+                    keys, collection, drift)
+    return report
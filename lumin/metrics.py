@@ -0,0 +1,264 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+
+from zope.interface import Interface
+
+from pyramid.compat import string_types
+from pyramid.httpexceptions import HTTPForbidden
+from pyramid.response import Response
+from pyramid.settings import aslist
+
+try:
+    from pymongo.monitoring import CommandListener
+except ImportError:  # pragma: no cover
+    ## pymongo < 3.1 publishes no command events
+    CommandListener = object
+try:
+    from pymongo.monitoring import ConnectionPoolListener
+except ImportError:  # pragma: no cover
+    ## pymongo < 3.9 publishes no pool events
+    ConnectionPoolListener = object
+
+# Upper bounds in seconds of the latency and wait time buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class IMongoDBMetrics(Interface):  # pragma: nocover
+    pass
+
+
+class Histogram(object):
+    """
+    Counts of the values observed at most each of ``buckets``, and of
+    all values, with their sum.
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        return {
+            'buckets': list(zip(self.buckets, self.counts)),
+            'count': self.count,
+            'sum': self.sum,
+            }
+
+
+class CommandMetrics(CommandListener):
+    """
+    A pymongo command listener counting the commands, errors and
+    latency of each :term:`collection` and command.
+    """
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self._started = {}
+
+    def started(self, event):
+        name = event.command_name
+        collection = event.command.get(name, None)
+        if not isinstance(collection, string_types):
+            collection = ''
+        key = (event.connection_id, event.request_id)
+        with self.metrics._lock:
+            self._started[key] = (collection, name)
+
+    def _finished(self, event, failed):
+        key = (event.connection_id, event.request_id)
+        with self.metrics._lock:
+            collection, name = self._started.pop(
+                key, ('', event.command_name))
+            self.metrics._command(collection, name,
+                                  event.duration_micros / 1e6, failed)
+
+    def succeeded(self, event):
+        self._finished(event, False)
+
+    def failed(self, event):
+        self._finished(event, True)
+
+
+class PoolMetrics(ConnectionPoolListener):
+    """
+    A pymongo connection pool listener counting the connections opened
+    and checked out, checkout failures and the time spent waiting for a
+    connection.
+    """
+    def __init__(self, metrics, timer=time.time):
+        self.metrics = metrics
+        self._timer = timer
+        self._waiting = {}
+
+    def _inc(self, name, n=1):
+        with self.metrics._lock:
+            self.metrics.pool[name] += n
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._inc('cleared')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._inc('open')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._inc('open', -1)
+
+    ## Checkouts are published by the thread waiting for them
+    def connection_check_out_started(self, event):
+        self._waiting[threading.current_thread().ident] = self._timer()
+
+    def connection_check_out_failed(self, event):
+        self._waiting.pop(threading.current_thread().ident, None)
+        self._inc('checkout_errors')
+
+    def connection_checked_out(self, event):
+        start = self._waiting.pop(threading.current_thread().ident, None)
+        with self.metrics._lock:
+            self.metrics.pool['checkouts'] += 1
+            self.metrics.pool['checked_out'] += 1
+            if start is not None:
+                self.metrics.pool_wait.observe(self._timer() - start)
+
+    def connection_checked_in(self, event):
+        self._inc('checked_out', -1)
+
+
+class MongoDBMetrics(object):
+    """
+    The per process counters and histograms of the operations lumin's
+    MongoDB connection makes, by :term:`collection` and command, and of
+    its connection pool. Pass :attr:`listeners` as the
+    ``event_listeners`` of the client, which
+    :func:`lumin.db.register_mongodb` does with ``lumin.metrics =
+    true``.
+    """
+    def __init__(self, buckets=BUCKETS):
+        self._lock = threading.Lock()
+        self._buckets = buckets
+        # (collection, command) -> [count, errors, Histogram]
+        self.commands = {}
+        self.pool = {'open': 0, 'checked_out': 0, 'checkouts': 0,
+                     'checkout_errors': 0, 'cleared': 0}
+        self.pool_wait = Histogram(buckets)
+        self.listeners = []
+        if CommandListener is not object:  # pragma: no branch
+            self.listeners.append(CommandMetrics(self))
+        if ConnectionPoolListener is not object:  # pragma: no branch
+            self.listeners.append(PoolMetrics(self))
+
+    def _command(self, collection, name, seconds, failed):
+        stats = self.commands.get((collection, name), None)
+        if stats is None:
+            stats = self.commands[(collection, name)] = [
+                0, 0, Histogram(self._buckets)]
+        stats[0] += 1
+        stats[1] += int(failed)
+        stats[2].observe(seconds)
+
+    def snapshot(self):
+        """
+        Return the current metrics as a ``dict`` of the ``commands``,
+        a ``dict`` of the ``count``, ``errors`` and ``latency`` of each
+        ``(collection, command)``, the ``pool`` counters and the
+        ``pool_wait`` histogram.
+        """
+        with self._lock:
+            return {
+                'commands': {
+                    key: {'count': count, 'errors': errors,
+                          'latency': latency.snapshot()}
+                    for key, (count, errors, latency)
+                    in self.commands.items()},
+                'pool': dict(self.pool),
+                'pool_wait': self.pool_wait.snapshot(),
+                }
+
+    def exposition(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        lines.append('# TYPE lumin_mongodb_commands_total counter')
+        lines.append('# TYPE lumin_mongodb_command_errors_total counter')
+        lines.append('# TYPE lumin_mongodb_command_seconds histogram')
+        for (collection, name), stats in sorted(
+                snapshot['commands'].items()):
+            labels = 'collection="%s",command="%s"' % (
+                _escape(collection), _escape(name))
+            lines.append('lumin_mongodb_commands_total{%s} %d' % (
+                labels, stats['count']))
+            lines.append('lumin_mongodb_command_errors_total{%s} %d' % (
+                labels, stats['errors']))
+            lines.extend(_histogram('lumin_mongodb_command_seconds',
+                                    stats['latency'], labels))
+        for name, value in sorted(snapshot['pool'].items()):
+            lines.append('lumin_mongodb_pool_%s %d' % (name, value))
+        lines.append('# TYPE lumin_mongodb_pool_wait_seconds histogram')
+        lines.extend(_histogram('lumin_mongodb_pool_wait_seconds',
+                                snapshot['pool_wait']))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _histogram(name, histogram, labels=''):
+    prefix = labels + ',' if labels else ''
+    lines = []
+    for bound, count in histogram['buckets']:
+        lines.append('%s_bucket{%sle="%s"} %d' % (name, prefix, bound, count))
+    lines.append('%s_bucket{%sle="+Inf"} %d' % (
+        name, prefix, histogram['count']))
+    suffix = '{%s}' % labels if labels else ''
+    lines.append('%s_count%s %d' % (name, suffix, histogram['count']))
+    lines.append('%s_sum%s %s' % (name, suffix, histogram['sum']))
+    return lines
+
+
+def get_metrics(registry):
+    """
+    Return the :class:`MongoDBMetrics` registered with ``registry``,
+    creating it on first use.
+    """
+    metrics = registry.queryUtility(IMongoDBMetrics)
+    if metrics is None:
+        metrics = MongoDBMetrics()
+        registry.registerUtility(metrics, IMongoDBMetrics)
+    return metrics
+
+
+def metrics_view(request):
+    """
+    Serve :meth:`MongoDBMetrics.exposition` to the addresses listed in
+    ``lumin.metrics.allow``, by default none. The address checked is
+    ``request.remote_addr``: behind a reverse proxy every request comes
+    from the proxy's address, so don't allow it: have a middleware
+    set ``remote_addr`` from the proxy's ``X-Forwarded-For``, or keep
+    ``lumin.metrics.path`` off the paths the proxy passes on.
+    """
+    settings = request.registry.settings or {}
+    allowed = aslist(settings.get('lumin.metrics.allow', ''))
+    if request.remote_addr not in allowed:
+        return HTTPForbidden()
+    return Response(get_metrics(request.registry).exposition(),
+                    content_type='text/plain', charset='utf-8')
@@ -1,24 +1,73 @@
 from __future__ import unicode_literals
 
-import copy
 import datetime
+import re
 
+from bson import BSON
+from bson.errors import InvalidDocument
 from bson.objectid import ObjectId
 
 from pymongo import DESCENDING
 from pymongo.errors import DuplicateKeyError
 
+from webob.exc import HTTPBadRequest
 from webob.exc import HTTPInternalServerError
 
 from pyramid.exceptions import NotFound
 from pyramid.security import Allow
 from pyramid.security import Everyone
 from pyramid.security import authenticated_userid
-
-from lumin.util import TS_FORMAT
+from pyramid.settings import asbool
+
+from lumin.cache import cache_for
+from lumin.counters import get_counter_buffer
+from lumin.history import as_of
+from lumin.history import history_for
+from lumin.history import history_page
+from lumin.history import SnapshotHistory
+from lumin.identity import get_identity_map
+from lumin.readpref import read_collection
+from lumin.readpref import read_for
+from lumin.timestamps import now
+from lumin.tracking import ChangeTracker
+from lumin.tracking import diff
+from lumin.tracking import merge
+from lumin.tracking import plain_copy
+from lumin.unit_of_work import get_unit_of_work
 from lumin.util import normalize
 
 
+def _smaller(update, document):
+    """
+    Whether the encoded ``update`` is smaller than ``document``.
+    """
+    try:
+        return len(BSON.encode(update)) < len(BSON.encode(document))
+    except InvalidDocument:
+        ## Values only SON manipulators can encode, e.g. colander.null
+        return len(update.get('$set', ())) < len(document)
+
+
+def _invalidate(cache, collection, oid, inserted):
+    if oid is not None:
+        cache.invalidate(collection, oid)
+    if inserted:
+        cache.invalidate_queries(collection)
+
+
+class ConflictError(Exception):
+    """
+    Raised when a versioned document was changed by another writer
+    since it was loaded. ``current`` is the document as now stored.
+    """
+    def __init__(self, spec, current, paths=()):
+        super(ConflictError, self).__init__(
+            "Update conflict: %r was changed concurrently" % (spec, ))
+        self.spec = spec
+        self.current = current
+        self.paths = list(paths)
+
+
 class Factory(object):
     """Pyramid context factory base class."""
 
@@ -40,12 +89,68 @@ class Collection(Factory):
     # Database collection name
     collection = None
 
+    # Indexes of the collection, each either index keys or a dict of
+    # the keys and index options, see :mod:`lumin.indexes`
+    __indexes__ = ()
+
+    # Names of the SON manipulators of the collection and its history
+    # instead of the ``mongodb.manipulators``, ``()`` for none but the
+    # native timestamps one, see :func:`lumin.son.pipeline_from_settings`
+    __manipulators__ = None
+
+    # Read preference, and optionally read concern, of the documents
+    # found and got from the collection and of its history, e.g.
+    # ``'secondaryPreferred local'``, unless set for the route or
+    # collection, see :func:`lumin.readpref.read_for`
+    __read__ = None
+    __history_read__ = None
+
+    # Projection a context was loaded with, if any
+    _fields = None
+
+    # How many times a versioned save merges concurrent changes and
+    # tries again before giving up, see :meth:`_update_document`
+    merge_retries = 3
+
+    # Fields lumin sets on every save, they never conflict
+    _touched = ('_version', 'mtime', 'changed_by')
+
+    def _get_data(self):
+        return self._tracker.data
+
+    def _set_data(self, data):
+        self._tracker = ChangeTracker(data)
+
+    data = property(_get_data, _set_data)
+
+    def _get_orig(self):
+        return self._tracker.orig
+
+    def _set_orig(self, orig):
+        self._tracker.snapshot = orig
+
+    ## The document as it was loaded or last updated. It is only copied
+    ## once ``data`` is changed, see :class:`lumin.tracking.ChangeTracker`
+    orig = property(_get_orig, _set_orig)
+
     def __init__(self, request, name=None, duplicate_key_error=DuplicateKeyError):
         super(Collection, self).__init__(request)
 
         name = self.collection = name if name is not None else self.collection
+        ## Writes, and the reads which must see them such as slug
+        ## allocation, go to the primary; only the documents returned
+        ## by find and get are read with the preference of __read__
         self._collection = request.db[name]
+        self._collection_reads = read_collection(request, name, self.__read__)
         self._collection_history = request.db['%s.history' % name]
+        self._collection_counters = request.db['%s.counters' % name]
+        self._history = history_for(request, self._collection_history)
+        self._identity_map = get_identity_map(request)
+        self._cache = cache_for(request.registry, name)
+        ## Documents read from a secondary may lag the primary, they are
+        ## served from the cache but not added to it
+        read = read_for(request, name, self.__read__)
+        self._cache_reads = read is None or read[0] == 'primary'
         self.duplicate_key_error = duplicate_key_error
 
     @property
@@ -53,10 +158,316 @@ class Collection(Factory):
         return self.collection
 
     def find(self, **kwargs):
-        return self._collection.find(kwargs)
+        return self._query(kwargs)
 
-    def get(self, _id):
-        return ContextById(self.request, _id=_id, name=self.collection)
+    def find_views(self, spec=None, fields=None, sort=None, limit=0):
+        """
+        Lazily yield a read only :class:`ContextView` per document
+        :meth:`find` would return for ``spec``. Meant for listings,
+        which do not need the change tracking, identity map and request
+        of a full :class:`ContextById`.
+
+        :param sort: a ``list`` of ``(key, direction)`` pairs.
+        **Default: None**
+        :param limit: The number of documents to return, ``0`` for all.
+        **Default: 0**
+        """
+        for doc in self._query(spec or {}, fields, sort, limit):
+            yield ContextView(doc, self.collection)
+
+    def _query(self, spec, fields=None, sort=None, limit=0):
+        """
+        The cursor of :meth:`find` and :meth:`find_views`, which read
+        with the preference of ``__read__``.
+        """
+        cursor = self._collection_reads.find(spec, fields)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return cursor
+
+    def get(self, _id, fields=None, hint=None):
+        context = self._identity_lookup({'_id': _id}, fields)
+        if isinstance(context, ContextById):
+            return context
+        return ContextById(self.request, _id=_id, name=self.collection,
+                           fields=fields, hint=hint)
+
+    def get_many(self, ids, fields=None):
+        """
+        Load the documents ``ids`` of this :term:`collection` with a
+        single ``$in`` query, skipping those already in the identity map
+        or the document cache.
+
+        Returns a ``list`` of a :class:`ContextById` per id found, in
+        the order of ``ids``, and the ``list`` of the ids not found.
+        """
+        found = {}
+        wanted = []
+        for _id in ids:
+            if _id in found or _id in wanted:
+                continue
+            spec = {'_id': _id}
+            context = self._identity_lookup(spec, fields)
+            if isinstance(context, ContextById):
+                found[_id] = context
+                continue
+            doc = None
+            if self._cache is not None and not fields:
+                doc = self._cache.get(self.collection, spec)
+                if doc is not None and not self._cache_fresh(doc):
+                    doc = None
+            if doc is not None:
+                found[_id] = self._context_for(doc, fields)
+            else:
+                wanted.append(_id)
+        if wanted:
+            for doc in self._collection_reads.find(
+                    {'_id': {'$in': wanted}}, fields):
+                if self._cache is not None and self._cache_reads and \
+                        not fields:
+                    self._cache.set(self.collection, {'_id': doc['_id']}, doc)
+                found[doc['_id']] = self._context_for(doc, fields)
+        contexts = []
+        missing = []
+        for _id in ids:
+            if _id in found:
+                contexts.append(found[_id])
+            elif _id not in missing:
+                missing.append(_id)
+        return contexts, missing
+
+    def _context_for(self, doc, fields=None):
+        context = ContextById(self.request, _id=doc['_id'],
+                              name=self.collection, data=doc, fields=fields)
+        context._identity_add()
+        return context
+
+    def _history_reads(self):
+        """
+        Return the history store to read history from, reading with
+        the preference of the ``<collection>.history`` collection.
+        Records are always written through ``_history``.
+        """
+        name = '%s.history' % self.collection
+        if read_for(self.request, name, self.__history_read__) is None:
+            return self._history
+        return history_for(self.request, read_collection(
+            self.request, name, self.__history_read__))
+
+    def _identity_lookup(self, spec, fields=None):
+        """
+        Return the context already loaded for ``spec`` in this request,
+        if the identity map is enabled.
+        """
+        if self._identity_map is None or fields:
+            return None
+        return self._identity_map.get(self.collection, spec)
+
+    def _identity_add(self, spec=None):
+        if self._identity_map is not None and not self._fields:
+            self._identity_map.add(self, spec)
+
+    def _identity_discard(self, *specs):
+        if self._identity_map is not None:
+            for spec in specs:
+                self._identity_map.discard(self.collection, spec)
+
+    def _identity_discard_id(self, _id):
+        if self._identity_map is not None:
+            self._identity_map.discard_id(self.collection, _id)
+
+    def _now(self):
+        return now(self.request.registry.settings)
+
+    def _insert(self, doc):
+        """
+        Insert ``doc``, or queue it in the request's
+        :class:`lumin.unit_of_work.UnitOfWork`. Returns its ``_id``.
+        """
+        work = get_unit_of_work(self.request)
+        if work is not None:
+            return work.insert(self._collection, doc)
+        return self._collection.insert(doc)
+
+    def _remove(self, _id):
+        work = get_unit_of_work(self.request)
+        if work is not None:
+            work.remove(self._collection, {'_id': _id})
+            return None
+        return self._collection.remove(_id)
+
+    def _write_history(self, record):
+        ## Only snapshots are written without reading the history first
+        work = get_unit_of_work(self.request)
+        if work is not None and type(self._history) is SnapshotHistory:
+            work.insert(self._history.collection, record)
+        else:
+            self._history.record(record)
+
+    def _check_writable(self):
+        if self._fields:
+            raise TypeError(
+                "{} was loaded with fields {!r} and is read only".format(
+                    self.__name__, self._fields))
+
+    def _versioned(self):
+        settings = self.request.registry.settings or {}
+        return asbool(settings.get('lumin.versioned', False))
+
+    def _update_document(self, merge=False):
+        """
+        Write ``data`` over the stored document. With the
+        ``lumin.delta_save`` setting enabled only the fields changed
+        since the document was loaded or last saved are sent, as a
+        ``$set``/``$unset`` update, unless that is larger than the
+        document itself or only sets the ``mtime``/``changed_by`` every
+        save sets. A context loaded with a projection can only be
+        saved this way.
+
+        With the ``lumin.versioned`` setting enabled every save
+        increments the ``_version`` of the document and only succeeds
+        if the stored version is still the one loaded. Otherwise
+        :class:`ConflictError` is raised or, with ``merge``, the changes
+        to ``data`` are merged with the stored document and saved again
+        unless both changed the same fields.
+        """
+        settings = self.request.registry.settings or {}
+        versioned = self._versioned()
+        retries = self.merge_retries if merge else 0
+        while True:
+            spec = self._spec
+            if versioned:
+                version = self.orig.get('_version', None)
+                spec = dict(spec, _version=version if version is not None
+                            else {'$exists': False})
+                self.data['_version'] = (version or 0) + 1
+            if asbool(settings.get('lumin.delta_save', False)):
+                document = self._delta()
+            else:
+                self._check_writable()
+                document = self.data
+            work = None if versioned else get_unit_of_work(self.request)
+            if work is not None:
+                work.update(self._collection, spec, document)
+                return None
+            result = self._collection.update(
+                spec,
+                document,
+                manipulate=True)
+            if not versioned or not result or result['updatedExisting']:
+                return result
+            current = next(iter(self._collection.find(
+                self._spec).limit(1)), None)
+            if current is None:
+                return result
+            self._merge(current, retries)
+            retries -= 1
+
+    def _merge(self, current, retries):
+        """
+        Replace the contents of ``data`` with the changes made to it
+        merged into the ``current`` stored document, which becomes
+        ``orig``. Raises
+        :class:`ConflictError` if no ``retries`` are left or both
+        changed the same fields.
+        """
+        if retries <= 0 or self._fields:
+            raise ConflictError(self._spec, current)
+        merged, conflicts = merge(self.orig, self.data, current,
+                                  self._touched)
+        conflicts = [p for p in conflicts if p not in self._touched]
+        if conflicts:
+            raise ConflictError(self._spec, current, conflicts)
+        ## In place, the identity map shares the tracker
+        self._tracker.replace(merged, current)
+
+    def _save(self, merge=False, record=False):
+        """
+        Save ``data`` with :meth:`_update_document`. With ``record`` the
+        stored version it replaced, which a merge may have changed, is
+        recorded in history once the write succeeded.
+        """
+        self._touch()
+        result = self._update_document(merge)
+
+        if result and result["updatedExisting"] is False:
+            raise KeyError("Update failed: Document not found %r" % self._spec)
+        if record:
+            self._record()
+        self._tracker.reset()
+        self._identity_add()
+        self._cache_invalidate(self.oid)
+
+    def _delta(self):
+        sets, unsets = diff(self.orig, self.data)
+        update = {}
+        if sets:
+            update['$set'] = sets
+        if unsets:
+            update['$unset'] = dict.fromkeys(unsets, '')
+        ## Only the fields every save sets changing may mean ``data`` was
+        ## changed without the tracker knowing, so it is saved whole
+        changed = [path for path in list(sets) + unsets
+                   if path not in self._touched]
+        if update and (self._fields or
+                       changed and _smaller(update, self.data)):
+            return update
+        self._check_writable()
+        return self.data
+
+    def _find_unique(self, spec, fields=None, hint=None):
+        """
+        Fetch the documents matching ``spec`` in a single round trip.
+        At most two are returned, which is enough to tell a unique match
+        from a duplicate without counting. Whole documents of cached
+        :term:`collection` objects are served from the document cache,
+        and added to it when read from the primary.
+        """
+        cache = self._cache if not fields else None
+        if cache is not None:
+            doc = cache.get(self.collection, spec)
+            if doc is not None and self._cache_fresh(doc):
+                return [doc]
+        cursor = self._collection_reads.find(spec, fields).limit(2)
+        if hint is not None:
+            cursor = cursor.hint(hint)
+        docs = list(cursor)
+        if cache is not None and self._cache_reads and len(docs) == 1:
+            cache.set(self.collection, spec, docs[0])
+        return docs
+
+    def _cache_fresh(self, doc):
+        """
+        Check a cached document against the stored ``mtime`` when the
+        cache is set to verify hits; a document written by another
+        process is dropped from the cache.
+        """
+        if not self._cache.verify:
+            return True
+        stored = next(iter(self._collection.find(
+            {'_id': doc['_id']}, ['mtime']).limit(1)), None)
+        if stored is not None and stored.get('mtime') == doc.get('mtime'):
+            return True
+        self._cache.invalidate(self.collection, doc['_id'])
+        return False
+
+    def _cache_invalidate(self, oid=None, inserted=False):
+        """
+        Drop the cached copies of document ``oid``. A newly ``inserted``
+        document may match cached specs other than an ``_id``, so those
+        are dropped too. Under a unit of work they are dropped again once
+        it is flushed, as a concurrent request may cache the stored
+        document until then.
+        """
+        if self._cache is None:
+            return
+        _invalidate(self._cache, self.collection, oid, inserted)
+        work = get_unit_of_work(self.request)
+        if work is not None:
+            work.after_flush(_invalidate, self._cache, self.collection,
+                             oid, inserted)
 
     def insert(self, doc, title_or_id, increment=True, seperator='-'):
         """
@@ -75,46 +486,199 @@ class Collection(Factory):
         **Default: ```"-"``**
         """
 
-        ctime = mtime = datetime.datetime.utcnow().strftime(TS_FORMAT)
+        ctime = mtime = self._now()
         doc['ctime'] = ctime
         doc['mtime'] = mtime
         doc['_id'] = normalize(title_or_id)
 
         if increment:
-            suffix = 0
-            _id = doc['_id']
-            while True:
-                try:
-                    oid = self._collection.insert(doc)
-                    break
-                except self.duplicate_key_error:
-                    suffix += 1
-                    _id_suffixed = seperator.join([_id, str(suffix)])
-                    doc['_id'] = _id_suffixed
+            oid = self._insert_slugged(doc, '_id', seperator)
         else:
-            oid = self._collection.insert(doc)
+            oid = self._insert(doc)
+        self._cache_invalidate(inserted=True)
 
         return oid
 
+    def insert_many(self, docs, titles, increment=True, seperator='-'):
+        """
+        Insert ``docs`` into the :term:`collection` with a single
+        unordered batch insert.
+
+        :param docs: A list of dictionaries to be stored in the DB
+
+        :param titles: A list of strings, one per document in ``docs``,
+        to be normalized for a URL and used as the _id for each document.
+
+        :param increment: Whether to increment titles already in the DB
+        or repeated within ``titles``. Collisions are resolved with one
+        query for the whole batch.
+        **Default: ``True``**
+
+        :param seperator: character to separate a title from its
+        incremental id.
+        **Default: ```"-"``**
+
+        Returns the list of _id assigned to ``docs``, in order.
+        """
+        self._insert_many_slugged(docs, titles, '_id', increment, seperator)
+        return [doc['_id'] for doc in docs]
+
+    def _insert_many_slugged(self, docs, titles, field, increment, seperator):
+        if len(docs) != len(titles):
+            raise ValueError(
+                "expected {} titles, recieved {}".format(len(docs), len(titles)))
+        if not docs:
+            return
+
+        ctime = mtime = self._now()
+        slugs = [normalize(title) for title in titles]
+        if increment:
+            slugs = self._allocate_slugs(field, slugs, seperator)
+        for doc, slug in zip(docs, slugs):
+            doc['ctime'] = ctime
+            doc['mtime'] = mtime
+            doc[field] = slug
+        ## A slug taken concurrently makes the batch raise
+        ## ``duplicate_key_error`` once the remaining documents are written
+        try:
+            self._collection.insert(docs, continue_on_error=True)
+        finally:
+            self._cache_invalidate(inserted=True)
+
+    def _allocate_slugs(self, field, slugs, seperator):
+        """
+        Return ``slugs`` suffixed so that they are unique within the
+        batch and in the :term:`collection`. The counters are left alone;
+        :meth:`_insert_slugged` resyncs them when it runs into a slug
+        allocated here.
+        """
+        highest, used = self._highest_slug_suffixes(
+            field, set(slugs), seperator)
+        allocated = []
+        ## A suffixed slug may equal another title's slug, e.g.
+        ## "Report" twice and "Report 1"
+        taken = set()
+        for slug in slugs:
+            suffix = 0
+            if slug in used or slug in taken:
+                suffix = highest.get(slug, 0) + 1
+            name = seperator.join([slug, str(suffix)]) if suffix else slug
+            while name in taken:
+                suffix += 1
+                name = seperator.join([slug, str(suffix)])
+            highest[slug] = max(highest.get(slug, 0), suffix)
+            taken.add(name)
+            allocated.append(name)
+        return allocated
+
+    def _insert_slugged(self, doc, field, seperator):
+        """
+        Insert ``doc`` with ``doc[field]`` unchanged if it is free, or
+        else replaced by the next suffixed slug from the
+        :term:`collection` counters, so unique titles cost a single
+        insert. A duplicate key of a suffixed slug can only happen when
+        a matching document was written behind the counter's back, in
+        which case the counter is resynced and the insert retried.
+        """
+        slug = doc[field]
+        try:
+            return self._collection.insert(doc)
+        except self.duplicate_key_error:
+            pass
+        doc[field] = self._next_slug(field, slug, seperator)
+        while True:
+            try:
+                return self._collection.insert(doc)
+            except self.duplicate_key_error:
+                self._sync_slug_counter(field, slug, seperator)
+                doc[field] = self._next_slug(field, slug, seperator)
+
+    def _slug_counter_key(self, field, slug, seperator):
+        return '%s:%s%s' % (field, slug, seperator)
+
+    def _next_slug(self, field, slug, seperator):
+        """
+        Atomically allocate the next suffixed ``slug`` for ``field``,
+        i.e. ``title-1``, ``title-2``. The counter is only created once
+        the bare ``slug`` is taken.
+        """
+        key = self._slug_counter_key(field, slug, seperator)
+        counter = self._collection_counters.find_and_modify(
+            {'_id': key},
+            {'$inc': {'seq': 1}},
+            upsert=True,
+            new=True)
+        suffix = counter['seq'] - 1
+        if suffix == 0:
+            ## A fresh counter knows nothing about documents inserted
+            ## before it existed, so claim the suffix after the highest
+            ## one already in use.
+            highest, used = self._highest_slug_suffixes(
+                field, [slug], seperator)
+            suffix = highest.get(slug, 0) + 1
+            self._collection_counters.update(
+                {'_id': key, 'seq': {'$lt': suffix + 1}},
+                {'$set': {'seq': suffix + 1}})
+        return seperator.join([slug, str(suffix)])
+
+    def _sync_slug_counter(self, field, slug, seperator):
+        """
+        Move the counter for ``slug`` past the highest suffix in use.
+        """
+        highest, used = self._highest_slug_suffixes(field, [slug], seperator)
+        seq = highest.get(slug, -1) + 1
+        self._collection_counters.update(
+            {'_id': self._slug_counter_key(field, slug, seperator),
+             'seq': {'$lt': seq}},
+            {'$set': {'seq': seq}})
+
+    def _highest_slug_suffixes(self, field, slugs, seperator):
+        """
+        Map each of ``slugs`` in use in ``field`` to its highest suffix,
+        ``0`` for the bare slug, and return it with the set of ``slugs``
+        stored bare, with a single prefix-range lookup.
+        """
+        slugs = list(slugs)
+        patterns = [re.compile(r'^%s(?:%s\d+)?$' % (
+            re.escape(slug), re.escape(seperator))) for slug in slugs]
+        spec = patterns[0] if len(patterns) == 1 else {'$in': patterns}
+        wanted = set(slugs)
+        highest = {}
+        used = set()
+        for doc in self._collection.find({field: spec}, [field]):
+            value = doc[field]
+            if value in wanted:
+                highest[value] = max(highest.get(value, 0), 0)
+                used.add(value)
+            prefix, _, suffix = value.rpartition(seperator)
+            if prefix in wanted and suffix.isdigit():
+                highest[prefix] = max(highest.get(prefix, 0), int(suffix))
+        return highest, used
+
     def delete(self, _id):
         """
         Delete the entry represented by this ``_id`` from this
         :term:`collection`
         """
-        result = self._collection.remove(_id)
+        result = self._remove(_id)
+        self._identity_discard_id(_id)
+        self._cache_invalidate(_id)
 
     def save(self, to_save, manipulate=True):
         """
         Exposes the native pymongo save method
         """
         self._collection.save(to_save, manipulate)
+        self._identity_discard_id(to_save.get('_id', None))
+        self._cache_invalidate(to_save.get('_id', None))
 
 
 class ContextById(Collection):
 
     _default__acl__ = []
 
-    def __init__(self, request, _id=None, name=None, data=None):
+    def __init__(self, request, _id=None, name=None, data=None,
+                 fields=None, hint=None):
         super(ContextById, self).__init__(request, name=name)
 
         # We get the object id from the request slug; the ``_id``
@@ -123,20 +687,29 @@ class ContextById(Collection):
                    request.matchdict.get('slug', None)
 
         self._spec = {"_id": self._id}
+        ## A context loaded with a projection only holds part of the
+        ## document and must not be written back
+        self._fields = fields
 
+        mapped = None
         if self._id and data is None:
-            try:
-                cursor = self._collection.find({'_id': self._id})
-                if cursor.count() > 1:
+            mapped = self._identity_lookup(self._spec, fields)
+        if mapped is not None:
+            ## Share the document already loaded in this request
+            self._tracker = mapped._tracker
+        else:
+            if self._id and data is None:
+                docs = self._find_unique(self._spec, fields, hint)
+                if len(docs) > 1:
                     raise HTTPInternalServerError(
                         "Duplicate object found for '%s'." % self._id
                         )
-                data = next(cursor)
-            except StopIteration:
-                raise NotFound(self._id)
+                if not docs:
+                    raise NotFound(self._id)
+                data = docs[0]
+                self._identity_add()
 
-        self.data = data if data else {}
-        self.orig = copy.deepcopy(self.data)
+            self.data = data if data else {}
         for ace in self._default__acl__:
             if ace not in self.__acl__:
                 self.add_ace(ace)
@@ -271,13 +844,32 @@ class ContextById(Collection):
             else:
                 operator = "$lt"
             query['_id'] = {operator: stamp}
-        if fields:
-            cursor = self._collection_history.find(
-                query, fields).limit(limit).sort('_id', DESCENDING)
-        else:
-            cursor = self._collection_history.find(
-                query).limit(limit).sort('_id', DESCENDING)
-        return cursor
+        return self._history_reads().find(query, fields, limit, sort)
+
+    def history_page(self, limit=10, token=None, fields=None,
+                     sort=DESCENDING):
+        """
+        Return a ``list`` of up to ``limit`` historical versions of this
+        :term:`context` and the token of the next page, ``None`` on the
+        last page. See :meth:`history` for ``fields`` and ``sort``.
+
+        :param token: the token returned with the previous page. An
+        invalid token raises ``HTTPBadRequest``. **Default: None**
+        """
+        try:
+            return history_page(self._history_reads(), self.oid, limit,
+                                token, fields, sort)
+        except ValueError as e:
+            raise HTTPBadRequest(str(e))
+
+    def as_of(self, when):
+        """
+        Return the version of this :term:`context` in effect at the UTC
+        :mod:``datetime.datetime`` ``when``, or ``None`` if it did not
+        exist yet.
+        """
+        return as_of(self._history_reads(), self.oid, when,
+                     plain_copy(self.data))
 
     def remove(self):
         """
@@ -287,46 +879,138 @@ class ContextById(Collection):
         """
         self.data['deleted'] = True
         self._record()
-        result = self._collection.remove(self._id)
+        result = self._remove(self._id)
+        self._identity_discard(self._spec)
+        self._identity_discard_id(self._id)
+        self._cache_invalidate(self._id)
         if result and result['err']:
             raise result['err']
 
-    def save(self):
+    def save(self, merge=False):
         """
         Save current data of this :term:`context`.
+
+        :param merge: Merge concurrent changes to a versioned document
+        instead of raising :class:`ConflictError`, see
+        :meth:`Collection._update_document`. **Default: False**
         """
+        self._save(merge)
 
-        self._touch()
-        result = self._collection.update(
-            self._spec,
-            self.data,
-            manipulate=True)
+    def update(self, data, merge=False):
+        """
+        Update the item this :term:`context` represents in its
+        :term:`collection` and, once saved, record the version it
+        replaced in history.
+        """
+        self._check_writable()
+        self.data.update(data)
+        self._save(merge, record=True)
 
-        if result["updatedExisting"] is False:
-            raise KeyError("Update failed: Document not found %r" % self._spec)
+    def inc(self, field, n=1, record=False):
+        """
+        Atomically add ``n`` to ``field`` and return its new value.
+        See :meth:`modify`.
+        """
+        self.modify({'$inc': {field: n}}, record)
+        value = self.data
+        for key in field.split('.'):
+            value = value[key]
+        return value
 
-    def update(self, data):
+    def push(self, field, value, record=False):
         """
-        Record current data in history and update the item this
-        :term:`context` represents in its :term:`collection`.
+        Atomically append ``value`` to the list ``field``. See
+        :meth:`modify`.
         """
-        self._record()
-        self.data.update(data)
-        self.orig = copy.deepcopy(self.data)
-        self.save()
+        self.modify({'$push': {field: value}}, record)
+
+    def pull(self, field, value, record=False):
+        """
+        Atomically remove every ``value`` from the list ``field``. See
+        :meth:`modify`.
+        """
+        self.modify({'$pull': {field: value}}, record)
+
+    def add_to_set(self, field, value, record=False):
+        """
+        Atomically append ``value`` to the list ``field`` unless it is
+        already in it. See :meth:`modify`.
+        """
+        self.modify({'$addToSet': {field: value}}, record)
+
+    def set_fields(self, fields=None, record=False, **kw):
+        """
+        Atomically set the ``fields`` ``dict`` and keyword arguments.
+        See :meth:`modify`.
+        """
+        values = dict(fields or {}, **kw)
+        self.modify({'$set': values}, record)
+
+    def inc_later(self, field, n=1):
+        """
+        Add ``n`` to the counter ``field`` with the next flush of the
+        process wide :class:`lumin.counters.CounterBuffer`, instead of
+        writing on every call.
+        """
+        get_counter_buffer(self.request.registry).inc(
+            self.collection, self.oid, field, n)
+
+    def counter(self, field):
+        """
+        Return the value of the counter ``field`` including the
+        increments of this process not yet written, or written since
+        ``data`` was loaded.
+        """
+        return get_counter_buffer(self.request.registry).value(
+            self.collection, self.data, field, self._tracker.loaded)
+
+    def modify(self, update, record=False):
+        """
+        Apply the ``update`` operators to the item this :term:`context`
+        represents with a single findAndModify, so concurrent changes
+        are not lost, and replace ``data`` with the updated document.
+        Unsaved changes to ``data`` are discarded.
+
+        :param record: Record the document as it was just before the
+        update in history. This reads the updated document again.
+        **Default: False**
+        """
+        update = dict(update)
+        user = authenticated_userid(self.request)
+        touched = dict(update.get('$set', {}))
+        touched['mtime'] = self._now()
+        touched['changed_by'] = user if user is not None else ''
+        update['$set'] = touched
+        if self._versioned():
+            update['$inc'] = dict(update.get('$inc', {}), _version=1)
+        if record:
+            result = self._collection.find_and_modify(
+                self._spec, update, new=False)
+            if result is not None:
+                result['orig_id'] = result.pop('_id')
+                self._history.record(result)
+                result = next(iter(self._collection.find(
+                    self._spec, self._fields).limit(1)), None)
+        else:
+            result = self._collection.find_and_modify(
+                self._spec, update, new=True, fields=self._fields)
+        if result is None:
+            raise KeyError("Update failed: Document not found %r" % self._spec)
+        ## In place, the identity map shares the tracker
+        self._tracker.replace(result, None)
+        self._identity_add()
+        self._cache_invalidate(self.oid)
 
     def _record(self):
-        self._touch()
-        self.orig['orig_id'] = self.data['_id']
-        del self.orig['_id']
-        self._collection_history.save(
-            self.orig,
-            manipulate=True
-        )
+        self._check_writable()
+        record = dict(self.orig)
+        record['orig_id'] = self.data['_id']
+        del record['_id']
+        self._write_history(record)
 
     def _touch(self):
         user = authenticated_userid(self.request)
-        self.data['mtime'] = datetime.datetime.utcnow().strftime(TS_FORMAT)
+        self.data['mtime'] = self._now()
         self.data['changed_by'] = user if user is not None else ''
 
 
@@ -340,6 +1024,9 @@ class ContextBySpec(Collection):
     :param data: Allows construction from dict
     :param unique: Should this context be a single item
     which represent the slug in the url
+    :param fields: A projection to load the document with. A context
+    loaded with a projection is read only.
+    :param hint: An index hint for loading the document
     """
     _default__acl__ = []
 
@@ -349,9 +1036,12 @@ class ContextBySpec(Collection):
                  name=None,  # NB: collection name
                  data=None,
                  spec={},
-                 duplicate_key_error=DuplicateKeyError):
+                 duplicate_key_error=DuplicateKeyError,
+                 fields=None,
+                 hint=None):
 
-        super(ContextBySpec, self).__init__(request, name)
+        super(ContextBySpec, self).__init__(
+            request, name, duplicate_key_error=duplicate_key_error)
         ## We can't limit to one or the other. Currently resource in
         ## cam sends both. Saddly this is horribly broken, yet
         ## works. One Fine day we will refactor this and cam and make
@@ -366,20 +1056,27 @@ class ContextBySpec(Collection):
             ## This should probably be enforced as bson.oid
             ## See the note in this if's else clause.
             self._spec = {'_id': _id}
+        self._fields = fields
+        mapped = None
         if self._spec and data is None:
+            mapped = self._identity_lookup(self._spec, fields)
+        if mapped is not None:
+            ## Share the document already loaded in this request
+            self._tracker = mapped._tracker
+        elif self._spec and data is None:
             ## If we have a spec let's look for it in the db
-            cursor = self._collection.find(self._spec)
-            if cursor.count() > 1:
+            docs = self._find_unique(self._spec, fields, hint)
+            if len(docs) > 1:
                 raise HTTPInternalServerError(
                     "Multiple objects found for specification: '%s'." % \
                     self._spec,
             )
-            try:
-                ## set data to teh document found
-                self.data = next(cursor)
-            except StopIteration:
+            if not docs:
                 ## or it doesn't exist
                 raise NotFound(repr(self._spec))
+            ## set data to teh document found
+            self.data = docs[0]
+            self._identity_add()
         else:
             ## if we didn't have an _id or spec
             ## let's assign data and update
@@ -398,8 +1095,6 @@ class ContextBySpec(Collection):
             ## oid _id not the spec...  We really neeed to refactor
             ## this stuff and make it sane...
             self._spec['_id'] = self.oid
-        ## make a copy of the dat for history tracking
-        self.orig = copy.deepcopy(self.data)
         for ace in self._default__acl__:
             if ace not in self.__acl__:
                 self.add_ace(ace)
@@ -483,13 +1178,32 @@ class ContextBySpec(Collection):
             else:
                 operator = "$lt"
             query['_id'] = {operator: stamp}
-        if fields:
-            cursor = self._collection_history.find(
-                query, fields).limit(limit).sort('_id', DESCENDING)
-        else:
-            cursor = self._collection_history.find(
-                query).limit(limit).sort('_id', DESCENDING)
-        return cursor
+        return self._history_reads().find(query, fields, limit, sort)
+
+    def history_page(self, limit=10, token=None, fields=None,
+                     sort=DESCENDING):
+        """
+        Return a ``list`` of up to ``limit`` historical versions of this
+        :term:`context` and the token of the next page, ``None`` on the
+        last page. See :meth:`history` for ``fields`` and ``sort``.
+
+        :param token: the token returned with the previous page. An
+        invalid token raises ``HTTPBadRequest``. **Default: None**
+        """
+        try:
+            return history_page(self._history_reads(), self.oid, limit,
+                                token, fields, sort)
+        except ValueError as e:
+            raise HTTPBadRequest(str(e))
+
+    def as_of(self, when):
+        """
+        Return the version of this :term:`context` in effect at the UTC
+        :mod:``datetime.datetime`` ``when``, or ``None`` if it did not
+        exist yet.
+        """
+        return as_of(self._history_reads(), self.oid, when,
+                     plain_copy(self.data))
 
     def insert(self, doc, title_or_id, increment=True, seperator='-'):
         """
@@ -508,26 +1222,31 @@ class ContextBySpec(Collection):
         **Default: ```"-"``**
         """
 
-        ctime = mtime = datetime.datetime.utcnow().strftime(TS_FORMAT)
+        ctime = mtime = self._now()
         doc['ctime'] = ctime
         doc['mtime'] = mtime
         doc['__name__'] = normalize(title_or_id)
         if increment:
-            suffix = 0
-            _id = doc['__name__']
-            while True:
-                try:
-                    self._collection.insert(doc)
-                    break
-                except self.duplicate_key_error as e:
-                    suffix += 1
-                    __name___suffixed = seperator.join([_id, str(suffix)])
-                    doc['__name__'] = __name___suffixed
+            self._insert_slugged(doc, '__name__', seperator)
         else:
-            self._collection.insert(doc)
+            self._insert(doc)
+        self._cache_invalidate(inserted=True)
 
         return {key: val for key, val in doc.items() if key in self._spec}
 
+    def insert_many(self, docs, titles, increment=True, seperator='-'):
+        """
+        Insert ``docs`` into the :term:`collection` with a single
+        unordered batch insert, using the normalized ``titles`` as their
+        __name__. See :meth:`Collection.insert_many`.
+
+        Returns the specifying dictionary of each of ``docs``, in order.
+        """
+        self._insert_many_slugged(
+            docs, titles, '__name__', increment, seperator)
+        return [{key: val for key, val in doc.items() if key in self._spec}
+                for doc in docs]
+
     def remove(self):
         """
         Record current data in history and remove the entry
@@ -536,43 +1255,69 @@ class ContextBySpec(Collection):
         """
 
         self._record()
-        result = self._collection.remove(self.oid)
+        result = self._remove(self.oid)
+        self._identity_discard(self._spec)
+        self._identity_discard_id(self.oid)
+        self._cache_invalidate(self.oid)
         if result and result['err']:
             raise result['err']
 
-    def save(self):
+    def save(self, merge=False):
         """
-        Save current data of this :term:`context`.
+        Save current data of this :term:`context`. See
+        :meth:`ContextById.save`.
         """
-        self._touch()
-        result = self._collection.update(
-            self._spec,
-            self.data,
-            manipulate=True)
-
-        if result and result["updatedExisting"] is False:
-            raise KeyError("Update failed: Document not found %r" % self._spec)
+        self._save(merge)
 
-    def update(self, data):
+    def update(self, data, merge=False):
         """
-        Record current data in history and update the item this
-        :term:`context` represents in its :term:`collection`.
+        Update the item this :term:`context` represents in its
+        :term:`collection` and, once saved, record the version it
+        replaced in history.
         """
-        self._record()
+        self._check_writable()
         self.data.update(data)
-        self.orig = copy.deepcopy(self.data)
-        self.save()
+        self._save(merge, record=True)
 
     def _record(self):
-        self._touch()
-        self.orig['orig_id'] = self.data['_id']
-        del self.orig['_id']
-        self._collection_history.save(
-            self.orig,
-            manipulate=True
-        )
+        self._check_writable()
+        record = dict(self.orig)
+        record['orig_id'] = self.data['_id']
+        del record['_id']
+        self._write_history(record)
 
     def _touch(self):
         user = authenticated_userid(self.request)
-        self.data['mtime'] = datetime.datetime.utcnow().strftime(TS_FORMAT)
+        self.data['mtime'] = self._now()
         self.data['changed_by'] = user if user is not None else ''
+
+
+class ContextView(object):
+    """
+    A read only view of a document, with the ``__name__``, ``oid``,
+    ``data`` and ``__acl__`` of a :class:`ContextById` but none of its
+    write methods. The document is used as loaded, it is neither
+    copied nor tracked. See :meth:`Collection.find_views`.
+    """
+    __slots__ = ('data', 'collection', '__parent__')
+
+    _default__acl__ = ContextById._default__acl__
+
+    def __init__(self, data, collection=None, parent=None):
+        self.data = data
+        self.collection = collection
+        self.__parent__ = parent
+
+    @property
+    def __name__(self):
+        return self.data.get('_id', None)
+
+    @property
+    def oid(self):
+        return self.data.get('_id', None)
+
+    @property
+    def __acl__(self):
+        acl = self.data.get('__acl__', [])
+        missing = [ace for ace in self._default__acl__ if ace not in acl]
+        return acl + missing if missing else acl
@@ -0,0 +1,68 @@
+from __future__ import unicode_literals
+
+from pymongo import ReadPreference
+
+MODES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
+    }
+
+
+def parse_read(value):
+    """
+    Return the read preference mode and read concern level of
+    ``value``, a string like ``'secondaryPreferred'`` or
+    ``'secondaryPreferred majority'``.
+    """
+    parts = value.split()
+    if not parts or parts[0] not in MODES or len(parts) > 2:
+        raise ValueError("Invalid read preference %r" % value)
+    return parts[0], parts[1] if len(parts) > 1 else None
+
+
+def read_for(request, name, default=None):
+    """
+    Return the read preference mode and read concern level, as
+    :func:`parse_read`, for reads of the :term:`collection` ``name``
+    made by ``request``, or ``None`` for the defaults of the
+    connection. The first of these settings found applies:
+
+    - ``lumin.read.route.<route name>`` for the route ``request``
+      matched,
+    - ``lumin.read.collection.<name>``,
+    - ``default``, e.g. ``Collection.__read__``,
+    - ``lumin.read.history`` for a ``<name>.history`` collection.
+    """
+    settings = request.registry.settings or {}
+    route = getattr(request, 'matched_route', None)
+    value = None
+    if route is not None:
+        value = settings.get('lumin.read.route.%s' % route.name, None)
+    if value is None:
+        value = settings.get('lumin.read.collection.%s' % name, default)
+    if value is None and name and name.endswith('.history'):
+        value = settings.get('lumin.read.history', None)
+    if value is None:
+        return None
+    return parse_read(value)
+
+
+def read_collection(request, name, default=None):
+    """
+    Return the :term:`collection` ``name`` of ``request.db`` reading
+    with the preference and concern of :func:`read_for`. Writes always
+    go to the primary.
+    """
+    collection = request.db[name]
+    read = read_for(request, name, default)
+    if read is None or not hasattr(collection, 'with_options'):
+        return collection
+    mode, level = read
+    options = {'read_preference': MODES[mode]}
+    if level is not None:
+        from pymongo.read_concern import ReadConcern
+        options['read_concern'] = ReadConcern(level)
+    return collection.with_options(**options)
@@ -0,0 +1,143 @@
+from __future__ import unicode_literals
+
+import datetime
+import logging
+import time
+
+from bson import BSON
+from bson.errors import InvalidDocument
+from bson.objectid import ObjectId
+
+from lumin.history import history_ids
+from lumin.history import MissingKeyframeError
+
+log = logging.getLogger(__name__)
+
+THIN_PERIODS = {
+    'daily': lambda stamp: stamp.date(),
+    'weekly': lambda stamp: stamp.isocalendar()[:2],
+    }
+
+
+class RetentionPolicy(object):
+    """
+    Decides which historical versions of a document to keep. A version
+    is kept when it is one of the ``keep_last`` most recent versions or
+    younger than ``keep_age``. Older versions are thinned to the most
+    recent one per day or week with ``thin``, or removed.
+
+    :param keep_last: The number of most recent versions to keep.
+    **Default: None**
+    :param keep_age: A ``datetime.timedelta``, versions younger than it
+    are kept. **Default: None**
+    :param thin: ``'daily'`` or ``'weekly'`` to keep one of the older
+    versions per day or week. **Default: None**
+    """
+    def __init__(self, keep_last=None, keep_age=None, thin=None):
+        if keep_last is None and keep_age is None and thin is None:
+            raise ValueError("A retention policy must keep some versions")
+        if thin is not None and thin not in THIN_PERIODS:
+            raise ValueError("Unknown thinning period %r" % thin)
+        self.keep_last = keep_last
+        self.keep_age = keep_age
+        self.thin = thin
+
+    def expired(self, versions, now):
+        """
+        Return the set of ``_id`` of the ``versions``, most recent
+        first, to remove at the naive UTC datetime ``now``.
+        """
+        expired = set()
+        periods = set()
+        for i, version in enumerate(versions):
+            oid = version['_id']
+            if not isinstance(oid, ObjectId):
+                continue
+            if self.keep_last is not None and i < self.keep_last:
+                continue
+            stamp = oid.generation_time.replace(tzinfo=None)
+            if self.keep_age is not None and stamp > now - self.keep_age:
+                continue
+            if self.thin is not None:
+                period = THIN_PERIODS[self.thin](stamp)
+                if period not in periods:
+                    periods.add(period)
+                    continue
+            expired.add(oid)
+        return expired
+
+
+def policy_from_settings(settings, name):
+    """
+    Return the :class:`RetentionPolicy` of the :term:`collection`
+    ``name`` configured by the ``lumin.history.retention.<name>.*``
+    settings ``keep_last``, ``keep_days`` and ``thin``, or ``None``.
+    """
+    prefix = 'lumin.history.retention.%s.' % name
+    keep_last = settings.get(prefix + 'keep_last', None)
+    keep_days = settings.get(prefix + 'keep_days', None)
+    thin = settings.get(prefix + 'thin', None)
+    if keep_last is None and keep_days is None and thin is None:
+        return None
+    return RetentionPolicy(
+        keep_last=None if keep_last is None else int(keep_last),
+        keep_age=(None if keep_days is None
+                  else datetime.timedelta(days=float(keep_days))),
+        thin=thin,
+        )
+
+
+def compact(store, policy, batch_size=100, pause=0, now=None):
+    """
+    Apply ``policy`` to the history kept by ``store``. Documents are
+    compacted one ``orig_id`` at a time, so no operation holds a lock
+    for long, and a report is yielded after every ``batch_size`` of
+    them, sleeping ``pause`` seconds in between. Stop iterating to stop
+    compacting.
+
+    Each report is a ``dict`` of the ``documents`` compacted, the
+    ``versions`` removed and an estimate of the ``bytes`` reclaimed
+    within the batch.
+
+    Only the records read are removed, after the versions kept are
+    stored again where the layout needs it, so versions recorded
+    meanwhile are kept and stopping midway loses none.
+    """
+    now = now or datetime.datetime.utcnow()
+    collection = store.collection
+    report = _report()
+    for oid in history_ids(collection, batch_size):
+        try:
+            versions, records = store.load(oid)
+        except MissingKeyframeError as e:
+            log.warning('Skipped the history of %r: %s', oid, e)
+            continue
+        expired = policy.expired(versions, now)
+        if expired:
+            before = _stored_size(collection, oid)
+            store.drop(oid, versions, records, expired)
+            report['versions'] += len(expired)
+            report['bytes'] += before - _stored_size(collection, oid)
+        report['documents'] += 1
+        if report['documents'] >= batch_size:
+            yield report
+            report = _report()
+            if pause:
+                time.sleep(pause)
+    if report['documents']:
+        yield report
+
+
+def _report():
+    return {'documents': 0, 'versions': 0, 'bytes': 0}
+
+
+def _stored_size(collection, oid):
+    size = 0
+    for record in collection.find({'orig_id': oid}):
+        try:
+            size += len(BSON.encode(record))
+        except InvalidDocument:
+            ## Values only SON manipulators can encode, e.g. colander.null
+            pass
+    return size
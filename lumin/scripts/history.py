@@ -0,0 +1,111 @@
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import optparse
+import sys
+import textwrap
+
+from pyramid.paster import bootstrap
+
+from lumin.db import get_mongodb
+from lumin.history import convert_history
+from lumin.history import store_for
+from lumin.retention import compact
+from lumin.retention import policy_from_settings
+
+MODES = ['snapshot', 'delta', 'bucket']
+
+
+def main(argv=sys.argv, quiet=False):
+    """
+    Convert the history of the named :term:`collection` objects between
+    the layouts of :mod:`lumin.history`.
+    """
+    description = """\
+    Rewrite the history of each COLLECTION of the application
+    configured in CONFIG_URI from one layout to another, by default
+    from snapshots to keyframes with deltas. The lumin.history.*
+    settings of CONFIG_URI configure the layouts. For example:
+
+    lumin_history development.ini pages users
+    lumin_history --from delta --to bucket development.ini pages
+    """
+    parser = optparse.OptionParser(
+        usage='%prog config_uri collection [collection ...]',
+        description=textwrap.dedent(description),
+        )
+    parser.add_option('-f', '--from', dest='source', default='snapshot',
+                      choices=MODES,
+                      help='The history layout to convert from')
+    parser.add_option('-t', '--to', dest='target', default='delta',
+                      choices=MODES,
+                      help='The history layout to convert to')
+    options, args = parser.parse_args(argv[1:])
+    if len(args) < 2:
+        parser.error('You must provide a config_uri and a collection')
+    env = bootstrap(args[0])
+    try:
+        settings = env['registry'].settings
+        db = get_mongodb(env['registry'])
+        for name in args[1:]:
+            collection = db['%s.history' % name]
+            ## Snapshots are read as keyframes by the delta layout
+            source = store_for(options.source == 'bucket' and 'bucket'
+                               or 'delta', collection, settings)
+            target = store_for(options.target, collection, settings)
+            count = convert_history(source, target)
+            target.ensure_indexes()
+            if not quiet:
+                print('%s: rewrote %d versions' % (name, count))
+    finally:
+        env['closer']()
+    return 0
+
+
+def compact_main(argv=sys.argv, quiet=False):
+    """
+    Apply the retention policies of the named :term:`collection`
+    objects to their history.
+    """
+    description = """\
+    Remove the historical versions of each COLLECTION of the
+    application configured in CONFIG_URI that its
+    lumin.history.retention.COLLECTION.* settings no longer keep.
+    For example:
+
+    lumin_compact_history development.ini pages users
+    """
+    parser = optparse.OptionParser(
+        usage='%prog config_uri collection [collection ...]',
+        description=textwrap.dedent(description),
+        )
+    parser.add_option('-b', '--batch-size', dest='batch_size', type='int',
+                      default=100,
+                      help='The number of documents compacted per batch')
+    parser.add_option('-p', '--pause', dest='pause', type='float',
+                      default=0,
+                      help='Seconds to pause between batches')
+    options, args = parser.parse_args(argv[1:])
+    if len(args) < 2:
+        parser.error('You must provide a config_uri and a collection')
+    env = bootstrap(args[0])
+    try:
+        settings = env['registry'].settings
+        db = get_mongodb(env['registry'])
+        for name in args[1:]:
+            policy = policy_from_settings(settings, name)
+            if policy is None:
+                print('%s: no retention policy configured' % name)
+                continue
+            store = store_for(settings.get('lumin.history', 'snapshot'),
+                              db['%s.history' % name], settings)
+            for report in compact(store, policy, options.batch_size,
+                                  options.pause):
+                if not quiet:
+                    print('%s: compacted %d documents, removed %d versions, '
+                          'reclaimed %d bytes' % (
+                              name, report['documents'], report['versions'],
+                              report['bytes']))
+    finally:
+        env['closer']()
+    return 0
@@ -0,0 +1,49 @@
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import optparse
+import sys
+import textwrap
+
+from pyramid.paster import bootstrap
+
+from lumin.indexes import ensure_indexes
+
+
+def main(argv=sys.argv, quiet=False):
+    """
+    Build the indexes missing from the database and report those which
+    differ from their declaration.
+    """
+    description = """\
+    Build the indexes declared by lumin and the application configured
+    in CONFIG_URI which are missing from its database, and report the
+    indexes which differ from their declaration. For example:
+
+    lumin_indexes development.ini
+    lumin_indexes --dry-run development.ini
+    """
+    parser = optparse.OptionParser(
+        usage='%prog config_uri',
+        description=textwrap.dedent(description),
+        )
+    parser.add_option('-n', '--dry-run', dest='dry_run', action='store_true',
+                      default=False,
+                      help='Report the missing indexes without building them')
+    options, args = parser.parse_args(argv[1:])
+    if len(args) != 1:
+        parser.error('You must provide a config_uri')
+    env = bootstrap(args[0])
+    try:
+        report = ensure_indexes(env['registry'], create=not options.dry_run)
+    finally:
+        env['closer']()
+    if not quiet:
+        verb = 'missing' if options.dry_run else 'building'
+        for collection, keys in report['created']:
+            print('%s: %s %r' % (collection, verb, keys))
+        for collection, keys, drift in report['drifted']:
+            print('%s: %r differs: %r' % (collection, keys, drift))
+        for collection, keys in report['undeclared']:
+            print('%s: %r is not declared' % (collection, keys))
+    return 1 if report['drifted'] else 0
@@ -0,0 +1,58 @@
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import optparse
+import sys
+import textwrap
+
+from pyramid.paster import bootstrap
+
+from lumin.db import IMongoDBConnection
+from lumin.history import store_for
+from lumin.timestamps import convert_history_timestamps
+from lumin.timestamps import convert_timestamps
+
+
+def main(argv=sys.argv, quiet=False):
+    """
+    Convert the string ``ctime`` and ``mtime`` of the named
+    :term:`collection` objects and their history to native dates.
+    """
+    description = """\
+    Convert the ctime and mtime timestamps stored as strings in each
+    COLLECTION of the application configured in CONFIG_URI, and in its
+    history, to native BSON dates. Enable lumin.native_timestamps
+    before running it so no new strings are written. For example:
+
+    lumin_timestamps development.ini pages users
+    """
+    parser = optparse.OptionParser(
+        usage='%prog config_uri collection [collection ...]',
+        description=textwrap.dedent(description),
+        )
+    parser.add_option('-b', '--batch-size', dest='batch_size', type='int',
+                      default=500,
+                      help='The number of documents read per batch')
+    options, args = parser.parse_args(argv[1:])
+    if len(args) < 2:
+        parser.error('You must provide a config_uri and a collection')
+    env = bootstrap(args[0])
+    try:
+        registry = env['registry']
+        settings = registry.settings
+        ## Read the stored strings rather than transformed documents
+        db = registry.getUtility(IMongoDBConnection)[
+            settings['mongodb.db_name']]
+        for name in args[1:]:
+            count = convert_timestamps(db[name],
+                                       batch_size=options.batch_size)
+            store = store_for(settings.get('lumin.history', 'snapshot'),
+                              db['%s.history' % name], settings)
+            history = convert_history_timestamps(
+                store, batch_size=options.batch_size)
+            if not quiet:
+                print('%s: converted %d documents and %d history records'
+                      % (name, count, history))
+    finally:
+        env['closer']()
+    return 0
@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+from lumin.readpref import read_collection
 
 COLLECTION = 'users'
 
@@ -10,7 +11,7 @@ class GroupFinder:
 
     def __call__(self, userid, request):
         try:
-            user = next(request.db[self.collection_name].find(
+            user = next(read_collection(request, self.collection_name).find(
                 {'_id': userid}))
         except StopIteration:
             user = None
@@ -19,6 +19,8 @@ from pyramid.session import manage_accessed
 from pyramid.session import signed_deserialize
 from pyramid.session import signed_serialize
 
+from lumin.unit_of_work import get_unit_of_work
+
 datetime_now = datetime.now
 
 ## ripped and modified from
@@ -70,6 +72,11 @@ def LuminSessionFactoryConfig(
 
     You can set the session collection name by adding a
     ``lumin.session.collection`` key/value to the configuration .ini
+
+    Sessions expire through TTL indexes on the collection, see
+    :mod:`lumin.indexes`. Set ``lumin.session.timeout`` and
+    ``lumin.session.cookie_max_age`` to ``timeout`` and
+    ``cookie_max_age`` so they are built to match.
     """
 
     @implementer(ISession)
@@ -95,17 +102,8 @@ def LuminSessionFactoryConfig(
                 "lumin.session.collection",
                 "lumin.sessions")
             self.db = self.request.db
-            ## These should be run manually in an entry point or by a
-            ## sysadm so they don't get called on a fresh db wiht 10000
-            ## sessions
-            # self.db[self.collection].ensure_index(
-            #     "atime",
-            #     expireAfterSeconds=self._timeout
-            #     )
-            # self.db[self.collection].ensure_index(
-            #     "ctime",
-            #     expireAfterSeconds=self._cookie_max_age
-            #     )
+            ## The TTL indexes expiring sessions are built by
+            ## lumin.indexes.ensure_indexes
             now = time.time()
             created = accessed = now
             new = True
@@ -163,7 +161,13 @@ def LuminSessionFactoryConfig(
             # XXX probably needs to unset cookie
 
         def save(self):
-            self.db[self.collection].save(self)
+            work = get_unit_of_work(self.request)
+            oid = dict.get(self, '_id', None)
+            if work is not None and oid is not None:
+                work.update(self.db[self.collection],
+                            {'_id': oid}, dict(self), upsert=True)
+            else:
+                self.db[self.collection].save(self)
 
         # non-modifying dictionary methods
         get = manage_accessed(dict.get)
@@ -4,8 +4,14 @@ from decimal import Decimal
 
 from pymongo.son_manipulator import SONManipulator
 
+from pyramid.path import DottedNameResolver
+from pyramid.settings import asbool
+from pyramid.settings import aslist
+
 import colander
 
+from lumin.timestamps import convert_document
+
 SENTINEL = {'_type': 'colander.null'}
 
 
@@ -145,6 +151,110 @@ class DecimalTransformer(SONManipulator):
                             self._recursive_out(v)
 
 
+class TimestampTransformer(SONManipulator):
+    """
+    Added to the db when ``lumin.native_timestamps`` is enabled. Turns
+    the ``ctime`` and ``mtime`` of documents stored before, as strings
+    in :data:`lumin.util.TS_FORMAT`, into ``datetime`` objects as they
+    are read, so both forms read the same until
+    :func:`lumin.timestamps.convert_timestamps` has run.
+
+    .. code-block:: python
+
+       import pymongo
+       db = pymongo.Connection().testdb['acollection']
+       from lumin.son import TimestampTransformer
+       db.add_son_manipulator(TimestampTransformer())
+    """
+    def transform_outgoing(self, son, collection):
+        """
+        converts top level string timestamps to ``datetime``.
+        """
+        convert_document(son)
+        return son
+
+
+# The manipulators ``mongodb.manipulators`` and
+# ``Collection.__manipulators__`` can name, besides dotted names
+MANIPULATORS = {
+    'colander_null': ColanderNullTransformer,
+    'decimal': DecimalTransformer,
+    'timestamps': TimestampTransformer,
+    }
+
+
+class ManipulatorPipeline(SONManipulator):
+    """
+    The :term:`son_manipulator` lumin adds to the database. It applies
+    the ``default`` manipulators to every :term:`collection` but those
+    in ``overrides``, a ``dict`` of the manipulators of each collection
+    name, which may be none at all. Collections without manipulators
+    skip transformation entirely.
+    """
+    def __init__(self, default, overrides=None):
+        self.default = list(default)
+        self.overrides = dict(overrides or {})
+
+    def manipulators(self, collection):
+        name = getattr(collection, 'name', None)
+        return self.overrides.get(name, self.default)
+
+    def transform_incoming(self, son, collection):
+        for manipulator in self.manipulators(collection):
+            son = manipulator.transform_incoming(son, collection)
+        return son
+
+    def transform_outgoing(self, son, collection):
+        for manipulator in reversed(self.manipulators(collection)):
+            son = manipulator.transform_outgoing(son, collection)
+        return son
+
+
+def pipeline_from_settings(settings):
+    """
+    Return the :class:`ManipulatorPipeline` of the names or dotted names
+    listed in the ``mongodb.manipulators`` setting, by default
+    ``colander_null`` and, with ``lumin.native_timestamps`` enabled,
+    ``timestamps``. The :class:`lumin.node.Collection` subclasses
+    imported by now may override them with ``__manipulators__``, which
+    also applies to their history. With ``lumin.native_timestamps``
+    enabled ``timestamps`` is added to any list lacking it, as the
+    ``ctime`` and ``mtime`` stored before read wrong without it.
+    """
+    from lumin.node import Collection
+    instances = {}
+    native = asbool(settings.get('lumin.native_timestamps', False))
+
+    def resolve(names):
+        manipulators = []
+        for name in names:
+            if name not in instances:
+                factory = MANIPULATORS.get(name, None)
+                if factory is None:
+                    factory = DottedNameResolver().resolve(name)
+                instances[name] = factory()
+            manipulators.append(instances[name])
+        if native and not any(isinstance(m, TimestampTransformer)
+                              for m in manipulators):
+            manipulators.extend(resolve(['timestamps']))
+        return manipulators
+
+    names = settings.get('mongodb.manipulators', None)
+    if names is None:
+        names = ['colander_null']
+    overrides = {}
+    classes = Collection.__subclasses__()
+    while classes:
+        cls = classes.pop()
+        classes.extend(cls.__subclasses__())
+        if cls.collection is None or cls.__manipulators__ is None:
+            continue
+        manipulators = resolve(cls.__manipulators__)
+        overrides[cls.collection] = manipulators
+        overrides['%s.history' % cls.collection] = manipulators
+    return ManipulatorPipeline(resolve(aslist(names)), overrides)
+
+
 class DeNull:
     """
     ``DeNull`` is a callable that recursively replaces
@@ -57,6 +57,8 @@ class MockGridFS:
 
 
 class Database(mongomock.Database):
+    name = None
+
     def __init__(self, conn):
         super(Database, self).__init__(conn)
 
@@ -64,6 +66,7 @@ class Database(mongomock.Database):
         db = self._collections.get(db_name, None)
         if db is None:
             db = self._collections[db_name] = Collection(self)
+            db.full_name = '%s.%s' % (self.name, db_name)
         return db
 
     def __getattr__(self, attr):
@@ -78,6 +81,7 @@ class Connection(mongomock.Connection):
         db = self._databases.get(db_name, None)
         if db is None:
             db = self._databases[db_name] = Database(self)
+            db.name = db_name
         return db
 
     def __getattr__(self, attr):
@@ -85,9 +89,123 @@ class Connection(mongomock.Connection):
 
 
 class Collection(mongomock.Collection):
+    # Set by the Database, as pymongo's ``<database>.<collection>``
+    full_name = None
+
     def __call__(self, *args, **kwargs):
         pass
 
+    def insert(self, data, **kwargs):
+        # Accepts and ignores pymongo write options like
+        # ``continue_on_error``
+        return super(Collection, self).insert(data)
+
+    def update(self, spec, document, upsert=False, *args, **kwargs):
+        # Adds ``$push``, ``$pull`` with a condition, upserts with
+        # update operators and the ``updatedExisting`` result of a
+        # single document update
+        existing = self.find_one(spec) is not None
+        result = {'n': int(existing), 'updatedExisting': existing,
+                  'err': None, 'ok': 1.0}
+        if not any(key.startswith('$') for key in document):
+            if upsert and not existing:
+                self.insert(dict(document, _id=spec.get('_id', None))
+                            if '_id' in spec else dict(document))
+                return result
+            super(Collection, self).update(
+                spec, document, upsert, *args, **kwargs)
+            return result
+        doc = self.find_one(spec)
+        if doc is None:
+            if not upsert:
+                return result
+            doc = {k: v for (k, v) in spec.items() if not isinstance(v, dict)}
+            self.insert(doc)
+        target = self._documents[doc['_id']]
+        for field, value in document.get('$push', {}).items():
+            target.setdefault(field, []).append(value)
+        for field, value in document.get('$pull', {}).items():
+            target[field] = [
+                item for item in target.get(field, [])
+                if not (self._filter_applies(value, item)
+                        if isinstance(value, dict) else item == value)]
+        rest = {k: v for (k, v) in document.items()
+                if k not in ('$push', '$pull')}
+        if rest:
+            super(Collection, self).update({'_id': doc['_id']}, rest)
+        return result
+
+    def create_index(self, keys, **kwargs):
+        # Records the index without enforcing it
+        if not isinstance(keys, list):
+            keys = [(keys, 1)]
+        name = '_'.join('%s_%s' % (k, d) for (k, d) in keys)
+        indexes = self.__dict__.setdefault('_indexes', {})
+        kwargs.pop('background', None)
+        indexes[name] = dict(kwargs, key=list(keys))
+        return name
+
+    ensure_index = create_index
+
+    def index_information(self):
+        info = {'_id_': {'key': [('_id', 1)]}}
+        info.update(self.__dict__.get('_indexes', {}))
+        return info
+
+    def initialize_unordered_bulk_op(self):
+        return BulkOperationBuilder(self)
+
+    initialize_ordered_bulk_op = initialize_unordered_bulk_op
+
+    def distinct(self, key):
+        values = []
+        for doc in self.find():
+            if key in doc and doc[key] not in values:
+                values.append(doc[key])
+        return values
+
+
+class BulkOperationBuilder(object):
+    # Runs the queued operations one by one on execute
+    def __init__(self, collection):
+        self.collection = collection
+        self.ops = []
+
+    def insert(self, doc):
+        self.ops.append(('insert', doc, None, False))
+
+    def find(self, spec, upsert=False):
+        builder = self
+
+        class BulkWriteOperation(object):
+            def upsert(self):
+                return builder.find(spec, upsert=True)
+
+            def update_one(self, document):
+                builder.ops.append(('update', spec, document, upsert))
+
+            replace_one = update_one
+
+            def remove_one(self):
+                builder.ops.append(('remove', spec, None, False))
+
+        return BulkWriteOperation()
+
+    def execute(self):
+        result = {'nInserted': 0, 'nMatched': 0, 'nRemoved': 0}
+        for op, spec, document, upsert in self.ops:
+            if op == 'insert':
+                self.collection.insert(spec)
+                result['nInserted'] += 1
+            elif op == 'update':
+                updated = self.collection.update(spec, document, upsert)
+                result['nMatched'] += updated['n']
+            else:
+                result['nRemoved'] += int(
+                    self.collection.find_one(spec) is not None)
+                self.collection.remove(spec)
+        return result
+
 
 class DummySchemaNode(object):
     typ = None
@@ -40,17 +40,17 @@ class TestConfiguration(unittest.TestCase):
         conn = get_mongodb(self.config.registry)
         self.assertTrue(isinstance(conn, Database))
 
-    def test_add_mongodb(self):
+    def test_request_db(self):
         self._includelumin()
         self._registerdb()
-        import pyramid
-        request = pyramid.testing.DummyRequest(
-            path='/',
-            )
-        import pyramid
-        # fire an event to call add_mongodb
-        self.config.registry.handle(pyramid.events.NewRequest(request))
-        self.assertTrue(hasattr(request, 'db'))
+        self.config.commit()
+        from pyramid.interfaces import IRequestExtensions
+        from pyramid.request import Request
+        request = Request.blank('/')
+        request.registry = self.config.registry
+        request._set_extensions(
+            self.config.registry.queryUtility(IRequestExtensions))
+        self.assertTrue(request.db is request.db)
 
 
 class TestIncludeMe(unittest.TestCase):
@@ -0,0 +1,194 @@
+from __future__ import unicode_literals
+import unittest
+
+import mongomock
+
+import pyramid.testing
+
+
+class DummyTimer(object):
+    now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDocumentCache(unittest.TestCase):
+    def _make_one(self, **kw):
+        from lumin.cache import DocumentCache
+        self.timer = DummyTimer()
+        return DocumentCache(timer=self.timer, **kw)
+
+    def test_miss_then_hit(self):
+        cache = self._make_one()
+        self.assertEqual(cache.get('test', {'_id': 1}), None)
+        cache.set('test', {'_id': 1}, {'_id': 1, 'title': 'Frob'})
+        self.assertEqual(cache.get('test', {'_id': 1}),
+                         {'_id': 1, 'title': 'Frob'})
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+        self.assertTrue(stats['bytes'] > 0)
+
+    def test_hits_are_copies(self):
+        cache = self._make_one()
+        cache.set('test', {'_id': 1}, {'_id': 1, 'tags': []})
+        cache.get('test', {'_id': 1})['tags'].append('x')
+        self.assertEqual(cache.get('test', {'_id': 1})['tags'], [])
+
+    def test_colander_null(self):
+        import colander
+        cache = self._make_one()
+        cache.set('test', {'_id': 1}, {'_id': 1, 'title': colander.null})
+        self.assertTrue(cache.get('test', {'_id': 1})['title'] is colander.null)
+
+    def test_ttl(self):
+        cache = self._make_one(ttl=10)
+        cache.set('test', {'_id': 1}, {'_id': 1})
+        self.timer.now = 11
+        self.assertEqual(cache.get('test', {'_id': 1}), None)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.bytes, 0)
+
+    def test_max_entries_evicts_least_recently_used(self):
+        cache = self._make_one(max_entries=2)
+        cache.set('test', {'_id': 1}, {'_id': 1})
+        cache.set('test', {'_id': 2}, {'_id': 2})
+        cache.get('test', {'_id': 1})
+        cache.set('test', {'_id': 3}, {'_id': 3})
+        self.assertEqual(cache.get('test', {'_id': 2}), None)
+        self.assertEqual(cache.get('test', {'_id': 1}), {'_id': 1})
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_max_bytes(self):
+        cache = self._make_one(max_bytes=200)
+        cache.set('test', {'_id': 1}, {'_id': 1, 'body': 'x' * 120})
+        cache.set('test', {'_id': 2}, {'_id': 2, 'body': 'x' * 120})
+        self.assertEqual(len(cache), 1)
+        self.assertTrue(cache.bytes <= 200)
+        cache.set('test', {'_id': 3}, {'_id': 3, 'body': 'x' * 500})
+        self.assertEqual(cache.get('test', {'_id': 3}), None)
+
+    def test_invalidate_all_specs_of_a_document(self):
+        cache = self._make_one()
+        doc = {'_id': 1, '__name__': 'frob'}
+        cache.set('test', {'_id': 1}, doc)
+        cache.set('test', {'__name__': 'frob'}, doc)
+        cache.set('other', {'_id': 1}, doc)
+        cache.invalidate('test', 1)
+        self.assertEqual(cache.get('test', {'_id': 1}), None)
+        self.assertEqual(cache.get('test', {'__name__': 'frob'}), None)
+        self.assertEqual(cache.get('other', {'_id': 1}), doc)
+
+    def test_invalidate_queries(self):
+        cache = self._make_one()
+        doc = {'_id': 1, '__name__': 'frob'}
+        cache.set('test', {'_id': 1}, doc)
+        cache.set('test', {'__name__': 'frob'}, doc)
+        cache.invalidate_queries('test')
+        self.assertEqual(cache.get('test', {'_id': 1}), doc)
+        self.assertEqual(cache.get('test', {'__name__': 'frob'}), None)
+
+    def test_clear(self):
+        cache = self._make_one()
+        cache.set('test', {'_id': 1}, {'_id': 1})
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.bytes, 0)
+
+
+class TestGetDocumentCache(unittest.TestCase):
+    def tearDown(self):
+        pyramid.testing.tearDown()
+
+    def test_not_configured(self):
+        from lumin.cache import get_document_cache
+        config = pyramid.testing.setUp()
+        self.assertEqual(get_document_cache(config.registry), None)
+
+    def test_configured(self):
+        from lumin.cache import cache_for
+        from lumin.cache import get_document_cache
+        config = pyramid.testing.setUp(settings={
+            'lumin.cache.collections': 'pages\nnews',
+            'lumin.cache.max_entries': '10',
+            'lumin.cache.ttl': '60',
+            'lumin.cache.verify': 'true',
+            })
+        cache = get_document_cache(config.registry)
+        self.assertEqual(cache.max_entries, 10)
+        self.assertEqual(cache.ttl, 60)
+        self.assertTrue(cache.verify)
+        self.assertTrue(get_document_cache(config.registry) is cache)
+        self.assertTrue(cache_for(config.registry, 'news') is cache)
+        self.assertEqual(cache_for(config.registry, 'users'), None)
+
+
+class TestCachedContexts(unittest.TestCase):
+    settings = {'lumin.cache.collections': 'test'}
+
+    def setUp(self):
+        self.config = pyramid.testing.setUp(settings=self.settings)
+        self.request = pyramid.testing.DummyRequest()
+        self.request.db = mongomock.Database(mongomock.Connection())
+        self.request.db['test'].insert(
+            {'_id': 'frobnitz', 'title': 'Frob', 'mtime': 'then'})
+
+    def tearDown(self):
+        pyramid.testing.tearDown()
+
+    def _cache(self):
+        from lumin.cache import get_document_cache
+        return get_document_cache(self.config.registry)
+
+    def test_loads_from_cache(self):
+        from lumin.node import ContextById
+        ContextById(self.request, 'frobnitz', 'test')
+        self.request.db['test'].update(
+            {'_id': 'frobnitz'}, {'$set': {'title': 'Changed'}})
+        context = ContextById(self.request, 'frobnitz', 'test')
+        self.assertEqual(context.data['title'], 'Frob')
+        self.assertEqual(self._cache().hits, 1)
+
+    def test_projection_skips_cache(self):
+        from lumin.node import ContextById
+        ContextById(self.request, 'frobnitz', 'test', fields=['title'])
+        self.assertEqual(len(self._cache()), 0)
+
+    def test_delete_invalidates(self):
+        from lumin.node import Collection
+        from pyramid.exceptions import NotFound
+        collection = Collection(self.request, 'test')
+        collection.get('frobnitz')
+        collection.delete('frobnitz')
+        self.assertRaises(NotFound, collection.get, 'frobnitz')
+
+    def test_insert_invalidates_queries(self):
+        from lumin.node import ContextBySpec
+        ContextBySpec(self.request, name='test', spec={'title': 'Frob'})
+        self.request.db['test'].insert({'_id': 'other', 'title': 'Frob'})
+        ContextBySpec(self.request, name='test', spec={'_id': 'other'}).insert(
+            {'title': 'Frob'}, 'frob')
+        from webob.exc import HTTPInternalServerError
+        self.assertRaises(HTTPInternalServerError, ContextBySpec,
+                          self.request, name='test', spec={'title': 'Frob'})
+
+
+class TestVerifiedCachedContexts(TestCachedContexts):
+    settings = {'lumin.cache.collections': 'test',
+                'lumin.cache.verify': 'true'}
+
+    def test_loads_from_cache(self):
+        from lumin.node import ContextById
+        ContextById(self.request, 'frobnitz', 'test')
+        ContextById(self.request, 'frobnitz', 'test')
+        self.assertEqual(self._cache().hits, 1)
+
+    def test_stale_mtime_reloads(self):
+        from lumin.node import ContextById
+        ContextById(self.request, 'frobnitz', 'test')
+        self.request.db['test'].update(
+            {'_id': 'frobnitz'}, {'$set': {'title': 'Changed', 'mtime': 'now'}})
+        context = ContextById(self.request, 'frobnitz', 'test')
+        self.assertEqual(context.data['title'], 'Changed')
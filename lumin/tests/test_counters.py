@@ -0,0 +1,154 @@
+from __future__ import unicode_literals
+import unittest
+
+import pyramid.testing
+
+from lumin.testing import Connection
+
+
+class TestCounterBuffer(unittest.TestCase):
+    def setUp(self):
+        self.db = Connection()['test']
+        self.db['pages'].insert({'_id': 'a', 'views': 1})
+        self.db['pages'].insert({'_id': 'b'})
+        self.db['files'].insert({'_id': 'c'})
+
+    def _make_one(self):
+        from lumin.counters import CounterBuffer
+        counters = CounterBuffer(self.db)
+        ## Flush by hand
+        counters._start = lambda: None
+        return counters
+
+    def test_aggregates_and_flushes(self):
+        counters = self._make_one()
+        for i in range(3):
+            counters.inc('pages', 'a', 'views')
+        counters.inc('pages', 'b', 'views', 5)
+        counters.inc('pages', 'b', 'stats.downloads')
+        counters.inc('files', 'c', 'views')
+        self.assertEqual(counters.pending('pages', 'a', 'views'), 3)
+        self.assertEqual(self.db['pages'].find_one({'_id': 'a'})['views'], 1)
+        counters.flush()
+        self.assertEqual(counters.pending('pages', 'a', 'views'), 0)
+        self.assertEqual(self.db['pages'].find_one({'_id': 'a'})['views'], 4)
+        self.assertEqual(self.db['pages'].find_one({'_id': 'b'})['views'], 5)
+        self.assertEqual(self.db['files'].find_one({'_id': 'c'})['views'], 1)
+        stats = counters.stats()
+        self.assertEqual((stats['flushes'], stats['written'], stats['pending']),
+                         (1, 3, 0))
+
+    def test_value_merges_pending(self):
+        counters = self._make_one()
+        doc = self.db['pages'].find_one({'_id': 'a'})
+        counters.inc('pages', 'a', 'views', 2)
+        counters.inc('pages', 'a', 'stats.downloads')
+        self.assertEqual(counters.value('pages', doc, 'views'), 3)
+        self.assertEqual(counters.value('pages', doc, 'stats.downloads'), 1)
+
+    def test_value_keeps_written(self):
+        timer = iter([10.0] * 3 + [400.0] * 3)
+        counters = self._make_one()
+        counters._timer = lambda: next(timer)
+        doc = self.db['pages'].find_one({'_id': 'a'})
+        counters.inc('pages', 'a', 'views', 2)
+        counters.flush()
+        self.assertEqual(counters.value('pages', doc, 'views', 5.0), 3)
+        self.assertEqual(counters.value('pages', doc, 'views', 20.0), 1)
+        ## Dropped once ``retain`` has passed
+        counters.inc('pages', 'b', 'views')
+        counters.flush()
+        self.assertEqual(counters.value('pages', doc, 'views', 5.0), 1)
+
+    def _fail_with(self, counters, error, write=False):
+        initialize = counters.db['pages'].initialize_unordered_bulk_op
+
+        def broken():
+            bulk = initialize()
+            execute = bulk.execute
+
+            def fail():
+                if write:
+                    execute()
+                raise error
+            bulk.execute = fail
+            return bulk
+        counters.db['pages'].initialize_unordered_bulk_op = broken
+
+    def test_unreachable_flush_is_retried(self):
+        from pymongo.errors import ServerSelectionTimeoutError
+        counters = self._make_one()
+        counters.inc('pages', 'a', 'views')
+        self._fail_with(counters, ServerSelectionTimeoutError('down'))
+        counters.flush()
+        self.assertEqual(counters.stats()['errors'], 1)
+        self.assertEqual(counters.pending('pages', 'a', 'views'), 1)
+        del counters.db['pages'].initialize_unordered_bulk_op
+        counters.flush()
+        self.assertEqual(self.db['pages'].find_one({'_id': 'a'})['views'], 2)
+
+    def test_failed_updates_are_not_written_twice(self):
+        from pymongo.errors import BulkWriteError
+        counters = self._make_one()
+        counters.inc('pages', 'a', 'views')
+        counters.inc('pages', 'b', 'views')
+        self._fail_with(counters, BulkWriteError({'writeErrors': [
+            {'index': 1, 'errmsg': 'bad'}]}), write=True)
+        counters.flush()
+        self.assertEqual(counters.stats()['written'], 1)
+        self.assertEqual(counters.pending('pages', 'a', 'views'), 0)
+        self.assertEqual(counters.pending('pages', 'b', 'views'), 0)
+        del counters.db['pages'].initialize_unordered_bulk_op
+        counters.flush()
+        self.assertEqual(self.db['pages'].find_one({'_id': 'a'})['views'], 2)
+
+    def test_unknown_errors_are_dropped(self):
+        counters = self._make_one()
+        counters.inc('pages', 'a', 'views')
+        self._fail_with(counters, ValueError('lost'), write=True)
+        counters.flush()
+        self.assertEqual(counters.stats()['errors'], 1)
+        self.assertEqual(counters.pending('pages', 'a', 'views'), 0)
+        self.assertEqual(self.db['pages'].find_one({'_id': 'a'})['views'], 2)
+
+    def test_context(self):
+        from lumin.counters import ICounterBuffer
+        from lumin.node import ContextById
+        config = pyramid.testing.setUp()
+        try:
+            counters = self._make_one()
+            config.registry.registerUtility(counters, ICounterBuffer)
+            request = pyramid.testing.DummyRequest()
+            request.db = self.db
+            context = ContextById(request, _id='a', name='pages')
+            context.inc_later('views')
+            context.inc_later('views')
+            self.assertEqual(context.counter('views'), 3)
+            counters.flush()
+            ## Loaded before the flush
+            self.assertEqual(context.counter('views'), 3)
+            self.assertEqual(
+                ContextById(request, _id='a', name='pages').counter('views'),
+                3)
+        finally:
+            pyramid.testing.tearDown()
+
+    def test_flush_invalidates_cache(self):
+        from lumin.cache import get_document_cache
+        from lumin.counters import ICounterBuffer
+        from lumin.node import ContextById
+        config = pyramid.testing.setUp(
+            settings={'lumin.cache.collections': 'pages'})
+        try:
+            counters = self._make_one()
+            counters.cache = get_document_cache(config.registry)
+            config.registry.registerUtility(counters, ICounterBuffer)
+            request = pyramid.testing.DummyRequest()
+            request.db = self.db
+            ContextById(request, _id='a', name='pages').inc_later('views', 2)
+            counters.flush()
+            self.assertEqual(
+                ContextById(request, _id='a', name='pages').counter('views'),
+                3)
+        finally:
+            pyramid.testing.tearDown()
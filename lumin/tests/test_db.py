@@ -42,17 +42,106 @@ class TestConfiguration(unittest.TestCase):
         conn = get_mongodb(self.config.registry)
         self.assertTrue(isinstance(conn, Database))
 
-    def test_add_mongodb(self):
-        self._includelumin()
-        self._registerdb()
-        import pyramid
-        request = pyramid.testing.DummyRequest(
-            path='/',
-            )
-        import pyramid
-        # fire an event to call add_mongodb
-        self.config.registry.handle(pyramid.events.NewRequest(request))
-        self.assertTrue(hasattr(request, 'db'))
+    def test_request_properties(self):
+        from pyramid.interfaces import IRequestExtensions
+        from pyramid.request import Request
+        from lumin.db import get_gridfs
+        from lumin.db import get_mongodb
+        from lumin.db import register_mongodb
+        self.config.registry.settings['mongodb.db_name'] = 'frozznob'
+        register_mongodb(self.config, conn={'frozznob': Connection()['f']})
+        self.config.commit()
+        extensions = self.config.registry.queryUtility(IRequestExtensions)
+        request = Request.blank('/')
+        request.registry = self.config.registry
+        request._set_extensions(extensions)
+        self.assertTrue(request.db is get_mongodb(self.config.registry))
+        self.assertTrue(request.fs is get_gridfs(self.config.registry))
+        other = Request.blank('/')
+        other.registry = self.config.registry
+        other._set_extensions(extensions)
+        self.assertTrue(other.db is request.db)
+
+    def test_add_mongodb_deprecated(self):
+        import warnings
+        from lumin.db import add_mongodb
+        from lumin.db import get_gridfs
+        from lumin.db import get_mongodb
+        from lumin.db import register_mongodb
+        self.config.registry.settings['mongodb.db_name'] = 'frozznob'
+        register_mongodb(self.config, conn={'frozznob': Connection()['f']})
+        request = pyramid.testing.DummyRequest()
+        request.registry = self.config.registry
+        event = pyramid.testing.DummyResource(request=request)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            add_mongodb(event)
+        self.assertTrue(caught[0].category is DeprecationWarning)
+        self.assertTrue(request.db is get_mongodb(self.config.registry))
+        self.assertTrue(request.fs is get_gridfs(self.config.registry))
+
+
+class TestRegisterListeners(unittest.TestCase):
+    def setUp(self):
+        self.config = pyramid.testing.setUp(settings={
+            'mongodb.db_name': 'frozznob', 'lumin.metrics': 'true'})
+
+    def tearDown(self):
+        pyramid.testing.tearDown()
+
+    def _register(self, conn):
+        import logging
+        from lumin.db import register_mongodb
+        records = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record)
+        logger = logging.getLogger('lumin.db')
+        handler = Handler()
+        logger.addHandler(handler)
+        try:
+            register_mongodb(self.config, conn=conn)
+        finally:
+            logger.removeHandler(handler)
+            conn.close()
+        return [record.getMessage() for record in records
+                if record.levelno == logging.WARNING]
+
+    def test_event_listeners(self):
+        from lumin.db import event_listeners
+        from lumin.metrics import get_metrics
+        self.assertEqual(event_listeners(self.config.registry),
+                         get_metrics(self.config.registry).listeners)
+        self.config.registry.settings['lumin.metrics'] = 'false'
+        self.assertEqual(event_listeners(self.config.registry), [])
+
+    def test_conn_without_metrics_listeners(self):
+        import pymongo
+        warnings = self._register(pymongo.MongoClient(connect=False))
+        self.assertEqual(len(warnings), 1)
+        self.assertTrue('lumin.metrics' in warnings[0])
+
+    def test_conn_without_trace_listener(self):
+        import pymongo
+        from lumin.metrics import get_metrics
+        settings = self.config.registry.settings
+        settings['lumin.trace'] = 'true'
+        conn = pymongo.MongoClient(
+            connect=False,
+            event_listeners=get_metrics(self.config.registry).listeners)
+        warnings = self._register(conn)
+        self.assertEqual(len(warnings), 1)
+        self.assertTrue('lumin.trace' in warnings[0])
+
+    def test_conn_with_metrics_listeners(self):
+        import pymongo
+        from lumin.db import event_listeners
+        self.config.registry.settings['lumin.trace'] = 'true'
+        conn = pymongo.MongoClient(
+            connect=False,
+            event_listeners=event_listeners(self.config.registry))
+        self.assertEqual(self._register(conn), [])
 
 
 class TestIncludeMe(unittest.TestCase):
@@ -86,3 +175,100 @@ class TestConnectionFromSettings(unittest.TestCase):
         inst = self._call_fut()
         from mongomock import Connection
         self.assertTrue(isinstance(inst, Connection))
+
+
+class DummyEvent(object):
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+class TestQueryShape(unittest.TestCase):
+    def _call_fut(self, name, command):
+        from lumin.db import query_shape
+        return query_shape(name, command)
+
+    def test_shapes(self):
+        self.assertEqual(
+            self._call_fut('find', {'find': 'pages', 'filter': {
+                '_id': 'a', 'tags': {'$in': ['x', 'y']}}}),
+            '{_id: ?, tags: {$in: ?}}')
+        self.assertEqual(
+            self._call_fut('update', {'update': 'pages', 'updates': [
+                {'q': {'_id': 1}, 'u': {'$set': {'a': 1}}}]}),
+            '{_id: ?}')
+        self.assertEqual(
+            self._call_fut('find', {'find': 'pages', 'filter': {
+                '$or': [{'a': 1}, {'b': 2}]}}),
+            '{$or: [{a: ?}, {b: ?}]}')
+        self.assertEqual(self._call_fut('ismaster', {'ismaster': 1}), '')
+
+
+class TestRequestTrace(unittest.TestCase):
+    def setUp(self):
+        self.config = pyramid.testing.setUp(settings={
+            'lumin.trace': 'true', 'lumin.trace.budget': '2'})
+
+    def tearDown(self):
+        pyramid.testing.tearDown()
+
+    def _command(self, listener, request_id, _id):
+        command = {'find': 'pages', 'filter': {'_id': _id}}
+        listener.started(DummyEvent(
+            command_name='find', command=command,
+            connection_id=('localhost', 27017), request_id=request_id))
+        listener.succeeded(DummyEvent(
+            command_name='find', connection_id=('localhost', 27017),
+            request_id=request_id, duration_micros=1000))
+
+    def _tween(self, listener, view):
+        from lumin.db import request_trace_tween_factory
+        return request_trace_tween_factory(
+            view, self.config.registry, listener)
+
+    def test_disabled(self):
+        from lumin.db import request_trace_tween_factory
+        self.config.registry.settings['lumin.trace'] = 'false'
+        view = lambda request: None
+        self.assertTrue(
+            request_trace_tween_factory(view, self.config.registry) is view)
+
+    def test_records_request(self):
+        from lumin.db import RequestTraceListener
+        listener = RequestTraceListener()
+        ## Outside of a traced request nothing is recorded
+        self._command(listener, 1, 'a')
+
+        def view(request):
+            self._command(listener, 2, 'b')
+            self._command(listener, 3, 'c')
+            return 'response'
+        request = pyramid.testing.DummyRequest()
+        self.assertEqual(self._tween(listener, view)(request), 'response')
+        trace = request.lumin_trace
+        self.assertEqual(trace.count, 2)
+        self.assertAlmostEqual(trace.seconds, 0.002)
+        self.assertEqual(trace.repeated(),
+                         [('pages', 'find', '{_id: ?}')])
+        self.assertTrue(listener.current is None)
+
+    def test_budget_warning(self):
+        import logging
+        from lumin.db import RequestTraceListener
+        listener = RequestTraceListener()
+        records = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record)
+        logger = logging.getLogger('lumin.db')
+        handler = Handler()
+        logger.addHandler(handler)
+        try:
+            def view(request):
+                for i in range(3):
+                    self._command(listener, i, i)
+            self._tween(listener, view)(pyramid.testing.DummyRequest())
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(records[0].levelno, logging.WARNING)
+        self.assertTrue('pages find {_id: ?} x3' in records[0].getMessage())
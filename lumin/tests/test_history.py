@@ -0,0 +1,436 @@
+from __future__ import unicode_literals
+import unittest
+
+import pyramid.testing
+
+from lumin.testing import Connection
+
+
+class TestDeltaHistory(unittest.TestCase):
+    def setUp(self):
+        self.collection = Connection()['test']['test.history']
+
+    def _make_one(self, interval=3):
+        from lumin.history import DeltaHistory
+        return DeltaHistory(self.collection, interval)
+
+    def _record(self, store, n):
+        for i in range(n):
+            store.record({'orig_id': 'doc', 'version': i, 'title': 'Doc',
+                          'author': 'me', 'body': {'text': 'x' * 20, 'rev': i}})
+
+    def test_keyframe_every_interval(self):
+        from lumin.history import PATCH
+        store = self._make_one()
+        self._record(store, 5)
+        records = list(self.collection.find().sort('_id', 1))
+        self.assertEqual([PATCH in r for r in records],
+                         [False, True, True, False, True])
+
+    def test_patch(self):
+        from lumin.history import PATCH
+        store = self._make_one()
+        self._record(store, 2)
+        patch = self.collection.find().sort('_id', -1).next()[PATCH]
+        self.assertEqual(patch['n'], 1)
+        self.assertEqual(sorted(patch['set']),
+                         [[['body', 'rev'], 1], [['version'], 1]])
+        self.assertEqual(patch['unset'], [])
+
+    def test_find_rebuilds_versions(self):
+        store = self._make_one()
+        self._record(store, 5)
+        result = list(store.find({'orig_id': 'doc'}))
+        self.assertEqual([r['version'] for r in result], [4, 3, 2, 1, 0])
+        self.assertEqual(result[0]['body'], {'text': 'x' * 20, 'rev': 4})
+        self.assertEqual(result[0]['orig_id'], 'doc')
+
+    def test_missing_keyframe(self):
+        from lumin.history import MissingKeyframeError
+        store = self._make_one()
+        self._record(store, 2)
+        keyframe = next(self.collection.find().sort('_id', 1))['_id']
+        self.collection.remove({'_id': keyframe})
+        try:
+            list(store.find({'orig_id': 'doc'}))
+        except MissingKeyframeError as e:
+            self.assertEqual(e.base, keyframe)
+        else:  # pragma: no cover
+            self.fail('MissingKeyframeError not raised')
+
+    def test_find_with_fields(self):
+        store = self._make_one()
+        self._record(store, 2)
+        result = list(store.find({'orig_id': 'doc'}, ['version']))
+        self.assertEqual(sorted(result[0].keys()), ['_id', 'version'])
+
+    def test_find_limit_and_count(self):
+        store = self._make_one()
+        self._record(store, 4)
+        self.assertEqual(len(list(store.find({'orig_id': 'doc'}, limit=2))), 2)
+        self.assertEqual(store.find({'orig_id': 'doc'}).count(), 4)
+
+    def test_unset(self):
+        store = self._make_one()
+        store.record({'orig_id': 'doc', 'a': 1, 'b': 2, 'c': 3, 'd': 4})
+        store.record({'orig_id': 'doc', 'a': 1, 'b': 2, 'c': 3})
+        result = store.find({'orig_id': 'doc'}).next()
+        self.assertFalse('d' in result)
+
+    def test_full_change_is_keyframe(self):
+        from lumin.history import PATCH
+        store = self._make_one()
+        store.record({'orig_id': 'doc', 'a': 1})
+        store.record({'orig_id': 'doc', 'a': 2})
+        self.assertFalse(PATCH in self.collection.find().sort('_id', -1).next())
+
+
+    def test_discard_queries_by_orig_id(self):
+        store = self._make_one()
+        self._record(store, 3)
+        versions, ids = store.load('doc')
+        specs = []
+        find = self.collection.find
+
+        def spy(spec=None, *args, **kwargs):
+            specs.append(spec)
+            return find(spec, *args, **kwargs)
+        self.collection.find = spy
+        try:
+            store.discard('doc', ids)
+        finally:
+            del self.collection.find
+        self.assertEqual(specs[0]['orig_id'], 'doc')
+        self.assertEqual(self.collection.count(), 0)
+
+
+class TestProject(unittest.TestCase):
+    def _call_fut(self, doc, fields):
+        from lumin.history import _project
+        return _project(doc, fields)
+
+    def test_include(self):
+        doc = {'_id': 1, 'a': 1, 'b': 2}
+        self.assertEqual(self._call_fut(doc, ['a']), {'_id': 1, 'a': 1})
+        self.assertEqual(self._call_fut(doc, {'_id': False, 'a': True}),
+                         {'a': 1})
+
+    def test_exclude(self):
+        doc = {'_id': 1, 'a': 1, 'b': 2}
+        self.assertEqual(self._call_fut(doc, {'a': False}), {'_id': 1, 'b': 2})
+
+
+class TestHistoryFor(unittest.TestCase):
+    def setUp(self):
+        self.config = pyramid.testing.setUp()
+        self.request = pyramid.testing.DummyRequest()
+
+    def tearDown(self):
+        pyramid.testing.tearDown()
+
+    def _call_fut(self):
+        from lumin.history import history_for
+        return history_for(self.request, None)
+
+    def test_default(self):
+        from lumin.history import SnapshotHistory
+        self.assertEqual(type(self._call_fut()), SnapshotHistory)
+
+    def test_delta(self):
+        from lumin.history import DeltaHistory
+        self.config.registry.settings['lumin.history'] = 'delta'
+        self.config.registry.settings['lumin.history.keyframe_interval'] = '5'
+        result = self._call_fut()
+        self.assertEqual(type(result), DeltaHistory)
+        self.assertEqual(result.interval, 5)
+
+    def test_bucket(self):
+        from lumin.history import BucketHistory
+        self.config.registry.settings['lumin.history'] = 'bucket'
+        self.config.registry.settings['lumin.history.bucket_size'] = '50'
+        result = self._call_fut()
+        self.assertEqual(type(result), BucketHistory)
+        self.assertEqual((result.seconds, result.size), (86400, 50))
+
+    def test_unknown(self):
+        self.config.registry.settings['lumin.history'] = 'bogus'
+        self.assertRaises(ValueError, self._call_fut)
+
+
+class TestBucketHistory(unittest.TestCase):
+    def setUp(self):
+        self.collection = Connection()['test']['test.history']
+
+    def _make_one(self, seconds=86400, size=3):
+        from lumin.history import BucketHistory
+        return BucketHistory(self.collection, seconds, size)
+
+    def _record(self, store, n, orig_id='doc'):
+        for i in range(n):
+            store.record({'orig_id': orig_id, 'version': i})
+
+    def test_buckets_capped(self):
+        store = self._make_one()
+        self._record(store, 7)
+        counts = sorted(b['count'] for b in self.collection.find())
+        self.assertEqual(counts, [1, 3, 3])
+        self.assertEqual(self.collection.find().count(), 3)
+
+    def test_find_flattens_buckets(self):
+        store = self._make_one()
+        self._record(store, 7)
+        self._record(store, 2, 'other')
+        result = list(store.find({'orig_id': 'doc'}))
+        self.assertEqual([r['version'] for r in result],
+                         [6, 5, 4, 3, 2, 1, 0])
+        self.assertEqual(result[0]['orig_id'], 'doc')
+
+    def test_find_limit_fields_and_count(self):
+        store = self._make_one()
+        self._record(store, 5)
+        cursor = store.find({'orig_id': 'doc'}, ['version'], limit=2)
+        self.assertEqual(cursor.count(), 5)
+        result = list(cursor)
+        self.assertEqual([r['version'] for r in result], [4, 3])
+        self.assertEqual(sorted(result[0].keys()), ['_id', 'version'])
+
+    def test_find_since(self):
+        store = self._make_one()
+        self._record(store, 4)
+        ids = [r['_id'] for r in store.find({'orig_id': 'doc'})]
+        after = store.find({'orig_id': 'doc', '_id': {'$gt': ids[2]}})
+        self.assertEqual([r['_id'] for r in after], ids[:2])
+        before = store.find({'orig_id': 'doc', '_id': {'$lt': ids[2]}})
+        self.assertEqual([r['_id'] for r in before], ids[3:])
+
+    def test_window(self):
+        import datetime
+        from bson.objectid import ObjectId
+        from lumin.history import _window
+        oid = ObjectId.from_datetime(datetime.datetime(2013, 5, 1, 13, 30))
+        self.assertEqual(_window(oid, 3600),
+                         datetime.datetime(2013, 5, 1, 13, 0))
+
+
+class TestConvertHistory(unittest.TestCase):
+    def setUp(self):
+        self.collection = Connection()['test']['test.history']
+        for i in range(4):
+            self.collection.insert({'orig_id': 'doc', 'version': i,
+                                    'a': 1, 'b': 2, 'c': 3})
+
+    def _call_fut(self, source, target):
+        from lumin.history import convert_history
+        return convert_history(source, target)
+
+    def test_convert(self):
+        from lumin.history import BucketHistory
+        from lumin.history import DeltaHistory
+        from lumin.history import PATCH
+        from lumin.history import SnapshotHistory
+        expected = list(self.collection.find().sort('_id', -1))
+        delta = DeltaHistory(self.collection, 3)
+        bucket = BucketHistory(self.collection)
+        self.assertEqual(self._call_fut(delta, delta), 4)
+        records = list(self.collection.find().sort('_id', 1))
+        self.assertEqual([PATCH in r for r in records],
+                         [False, True, True, False])
+        self.assertEqual(list(delta.find({'orig_id': 'doc'})), expected)
+        self._call_fut(delta, bucket)
+        self.assertEqual(self.collection.find().count(), 1)
+        self.assertEqual(list(bucket.find({'orig_id': 'doc'})), expected)
+        self._call_fut(bucket, SnapshotHistory(self.collection))
+        self.assertEqual(list(self.collection.find().sort('_id', -1)),
+                         expected)
+
+    def test_convert_skips_missing_keyframe(self):
+        from lumin.history import DeltaHistory
+        delta = DeltaHistory(self.collection, 3)
+        self._call_fut(delta, delta)
+        self.collection.insert({'orig_id': 'other', 'version': 0})
+        keyframe = next(self.collection.find().sort('_id', 1))['_id']
+        self.collection.remove({'_id': keyframe})
+        self.assertEqual(self._call_fut(delta, delta), 1)
+        self.assertEqual(self.collection.find({'orig_id': 'doc'}).count(), 3)
+
+
+class TestHistoryQueue(unittest.TestCase):
+    def setUp(self):
+        self.collection = Connection()['test']['test.history']
+
+    def _make_one(self, **kwargs):
+        from lumin.history import HistoryQueue
+        return HistoryQueue(**kwargs)
+
+    def test_write_behind(self):
+        from lumin.history import SnapshotHistory
+        queue = self._make_one(interval=0.01)
+        store = SnapshotHistory(self.collection)
+        for i in range(5):
+            queue.put(store, {'orig_id': 'doc', 'version': i})
+        queue.flush()
+        result = [r['version'] for r in store.find({'orig_id': 'doc'})]
+        self.assertEqual(result, [4, 3, 2, 1, 0])
+        stats = queue.stats()
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['queued'], 5)
+        self.assertEqual(stats['written'], 5)
+        self.assertTrue(stats['batches'] >= 1)
+
+    def test_drain_in_batches(self):
+        from lumin.history import DeltaHistory
+        queue = self._make_one(batch_size=2)
+        store = DeltaHistory(self.collection)
+        ## Queue without starting the background thread
+        queue._start = lambda: None
+        for i in range(5):
+            queue.put(store, {'orig_id': 'doc', 'version': i})
+        self.assertEqual(self.collection.find().count(), 0)
+        queue.flush()
+        self.assertEqual(queue.stats()['batches'], 3)
+        result = [r['version'] for r in store.find({'orig_id': 'doc'})]
+        self.assertEqual(result, [4, 3, 2, 1, 0])
+
+    def test_full_queue_writes_synchronously(self):
+        from lumin.history import SnapshotHistory
+        queue = self._make_one(maxsize=1)
+        queue._start = lambda: None
+        store = SnapshotHistory(self.collection)
+        queue.put(store, {'orig_id': 'doc', 'version': 0})
+        queue.put(store, {'orig_id': 'doc', 'version': 1})
+        self.assertEqual(self.collection.find().count(), 1)
+        self.assertEqual(queue.stats()['overflows'], 1)
+        queue.flush()
+        self.assertEqual(self.collection.find().count(), 2)
+
+    def test_errors_counted(self):
+        collection = self.collection
+
+        class Broken(object):
+            def __init__(self):
+                self.collection = collection
+
+            def record(self, record):
+                raise ValueError(record)
+        queue = self._make_one()
+        queue._start = lambda: None
+        queue.put(Broken(), {'orig_id': 'doc'})
+        queue.flush()
+        self.assertEqual(queue.stats()['errors'], 1)
+
+    def test_thread_survives_errors(self):
+        from lumin.history import SnapshotHistory
+
+        class Broken(object):
+            @property
+            def collection(self):
+                raise RuntimeError('unexpected')
+        queue = self._make_one(interval=0.01)
+        store = SnapshotHistory(self.collection)
+        queue.put(Broken(), {'orig_id': 'doc', 'version': 0})
+        queue.flush()
+        queue.put(store, {'orig_id': 'doc', 'version': 1})
+        queue.flush()
+        self.assertTrue(queue._thread.is_alive())
+        result = [r['version'] for r in store.find({'orig_id': 'doc'})]
+        self.assertEqual(result, [1])
+
+    def test_history_for(self):
+        from lumin.history import QueuedHistory
+        from lumin.history import get_history_queue
+        config = pyramid.testing.setUp()
+        try:
+            config.registry.settings['lumin.history.write_behind'] = 'true'
+            request = pyramid.testing.DummyRequest()
+            from lumin.history import history_for
+            result = history_for(request, self.collection)
+            self.assertEqual(type(result), QueuedHistory)
+            self.assertTrue(result.queue is get_history_queue(config.registry))
+            self.assertTrue(result.collection is self.collection)
+        finally:
+            pyramid.testing.tearDown()
+
+
+class TestHistoryPage(unittest.TestCase):
+    def setUp(self):
+        self.collection = Connection()['test']['test.history']
+
+    def _call_fut(self, store, **kwargs):
+        from lumin.history import history_page
+        return history_page(store, 'doc', **kwargs)
+
+    def _check(self, store):
+        from pymongo import ASCENDING
+        for i in range(5):
+            store.record({'orig_id': 'doc', 'version': i, 'a': 1, 'b': 2})
+        result, token = self._call_fut(store, limit=2)
+        self.assertEqual([r['version'] for r in result], [4, 3])
+        result, token = self._call_fut(store, limit=2, token=token,
+                                       fields={'_id': False, 'version': 1})
+        self.assertEqual([r['version'] for r in result], [2, 1])
+        result, token = self._call_fut(store, limit=2, token=token)
+        self.assertEqual([r['version'] for r in result], [0])
+        self.assertEqual(token, None)
+        result, token = self._call_fut(store, limit=3, sort=ASCENDING)
+        self.assertEqual([r['version'] for r in result], [0, 1, 2])
+        result, token = self._call_fut(store, limit=3, token=token,
+                                       sort=ASCENDING)
+        self.assertEqual([r['version'] for r in result], [3, 4])
+
+    def test_snapshot(self):
+        from lumin.history import SnapshotHistory
+        self._check(SnapshotHistory(self.collection))
+
+    def test_delta(self):
+        from lumin.history import DeltaHistory
+        self._check(DeltaHistory(self.collection, 3))
+
+    def test_bucket(self):
+        from lumin.history import BucketHistory
+        self._check(BucketHistory(self.collection, size=2))
+
+    def test_invalid_token(self):
+        from lumin.history import SnapshotHistory
+        store = SnapshotHistory(self.collection)
+        self.assertRaises(ValueError, self._call_fut, store, token='nope')
+        self.assertRaises(ValueError, self._call_fut, store, token=12)
+
+
+class TestAsOf(unittest.TestCase):
+    def setUp(self):
+        import datetime
+        from bson.objectid import ObjectId
+        from lumin.history import SnapshotHistory
+        self.store = SnapshotHistory(Connection()['test']['test.history'])
+        self.start = datetime.datetime(2013, 1, 1)
+        for day in (1, 2):
+            self.store.record({
+                '_id': ObjectId.from_datetime(
+                    self.start + datetime.timedelta(days=day)),
+                'orig_id': 'doc', 'version': day - 1,
+                'ctime': '2013-01-01 00:00:00.000000'})
+
+    def _call_fut(self, days, current=None):
+        import datetime
+        from lumin.history import as_of
+        when = self.start + datetime.timedelta(days=days)
+        return as_of(self.store, 'doc', when, current)
+
+    def test_versions(self):
+        self.assertEqual(self._call_fut(0.5)['version'], 0)
+        self.assertEqual(self._call_fut(1.5)['version'], 1)
+
+    def test_current(self):
+        current = {'version': 2, 'ctime': '2013-01-01 00:00:00.000000'}
+        self.assertEqual(self._call_fut(3, current), current)
+        self.assertEqual(self._call_fut(3), None)
+
+    def test_before_created(self):
+        self.assertEqual(self._call_fut(-1), None)
+
+    def test_aware(self):
+        import datetime
+        from bson.tz_util import FixedOffset
+        from lumin.history import as_of
+        when = datetime.datetime(2013, 1, 2, 14, tzinfo=FixedOffset(120, 'X'))
+        self.assertEqual(as_of(self.store, 'doc', when)['version'], 1)
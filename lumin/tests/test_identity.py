@@ -0,0 +1,168 @@
+from __future__ import unicode_literals
+import unittest
+
+import mongomock
+
+import pyramid.testing
+
+
+class TestFreeze(unittest.TestCase):
+    def _call_fut(self, value):
+        from lumin.identity import freeze
+        return freeze(value)
+
+    def test_key_order(self):
+        self.assertEqual(self._call_fut({'a': 1, 'b': 2}),
+                         self._call_fut({'b': 2, 'a': 1}))
+
+    def test_nested(self):
+        result = self._call_fut({'a': {'$in': [1, 2]}})
+        self.assertEqual(result, (('a', (('$in', (1, 2)),)),))
+        hash(result)
+
+
+class TestIdentityMap(unittest.TestCase):
+    def _make_one(self):
+        from lumin.identity import IdentityMap
+        return IdentityMap()
+
+    def _context(self, collection='test', spec=None):
+        context = pyramid.testing.DummyResource()
+        context.collection = collection
+        context._spec = spec if spec is not None else {'_id': 'frobnitz'}
+        return context
+
+    def test_add_get(self):
+        imap = self._make_one()
+        context = self._context()
+        imap.add(context)
+        self.assertTrue(imap.get('test', {'_id': 'frobnitz'}) is context)
+        self.assertEqual(imap.get('other', {'_id': 'frobnitz'}), None)
+        self.assertEqual(len(imap), 1)
+
+    def test_add_explicit_spec(self):
+        imap = self._make_one()
+        context = self._context()
+        imap.add(context, {'__name__': 'frob'})
+        self.assertTrue(imap.get('test', {'__name__': 'frob'}) is context)
+
+    def test_discard(self):
+        imap = self._make_one()
+        imap.add(self._context())
+        imap.discard('test', {'_id': 'frobnitz'})
+        imap.discard('test', {'_id': 'frobnitz'})
+        self.assertEqual(imap.get('test', {'_id': 'frobnitz'}), None)
+
+    def test_discard_id(self):
+        imap = self._make_one()
+        by_spec = self._context(spec={'title': 'Frob'})
+        by_spec.data = {'_id': 'frobnitz'}
+        other = self._context(collection='other')
+        imap.add(self._context())
+        imap.add(by_spec)
+        imap.add(other)
+        imap.discard_id('test', 'frobnitz')
+        self.assertEqual(imap.get('test', {'_id': 'frobnitz'}), None)
+        self.assertEqual(imap.get('test', {'title': 'Frob'}), None)
+        self.assertTrue(imap.get('other', {'_id': 'frobnitz'}) is other)
+
+    def test_clear(self):
+        imap = self._make_one()
+        imap.add(self._context())
+        imap.clear()
+        self.assertEqual(len(imap), 0)
+
+
+class TestGetIdentityMap(unittest.TestCase):
+    def tearDown(self):
+        pyramid.testing.tearDown()
+
+    def _call_fut(self, request):
+        from lumin.identity import get_identity_map
+        return get_identity_map(request)
+
+    def test_disabled(self):
+        pyramid.testing.setUp()
+        request = pyramid.testing.DummyRequest()
+        self.assertEqual(self._call_fut(request), None)
+
+    def test_enabled(self):
+        pyramid.testing.setUp(settings={'lumin.identity_map': 'true'})
+        request = pyramid.testing.DummyRequest()
+        imap = self._call_fut(request)
+        self.assertTrue(imap is not None)
+        self.assertTrue(self._call_fut(request) is imap)
+
+
+class TestContextIdentity(unittest.TestCase):
+    def setUp(self):
+        self.config = pyramid.testing.setUp(
+            settings={'lumin.identity_map': 'true'})
+        self.request = pyramid.testing.DummyRequest()
+        self.request.db = mongomock.Database(mongomock.Connection())
+        self.request.db['test'].insert({'_id': 'frobnitz', 'title': 'Frob'})
+
+    def tearDown(self):
+        pyramid.testing.tearDown()
+
+    def test_get_returns_same_context(self):
+        from lumin.node import Collection
+        collection = Collection(self.request, 'test')
+        context = collection.get('frobnitz')
+        self.request.db['test'].remove('frobnitz')
+        self.assertTrue(collection.get('frobnitz') is context)
+
+    def test_ctor_shares_document(self):
+        from lumin.node import ContextById
+        first = ContextById(self.request, 'frobnitz', 'test')
+        self.request.db['test'].remove('frobnitz')
+        second = ContextById(self.request, 'frobnitz', 'test')
+        self.assertTrue(second.data is first.data)
+
+    def test_projection_bypasses_map(self):
+        from lumin.node import Collection
+        collection = Collection(self.request, 'test')
+        context = collection.get('frobnitz')
+        partial = collection.get('frobnitz', fields=['title'])
+        self.assertFalse(partial is context)
+        self.assertEqual(partial.data, {'title': 'Frob'})
+
+    def test_delete_evicts(self):
+        from lumin.node import Collection
+        collection = Collection(self.request, 'test')
+        collection.get('frobnitz')
+        collection.delete('frobnitz')
+        from pyramid.exceptions import NotFound
+        self.assertRaises(NotFound, collection.get, 'frobnitz')
+
+    def test_remove_evicts(self):
+        from lumin.node import ContextById
+        context = ContextById(self.request, 'frobnitz', 'test')
+        context.remove()
+        self.assertEqual(
+            self.request.lumin_identity_map.get('test', {'_id': 'frobnitz'}),
+            None)
+
+    def test_remove_evicts_by_spec(self):
+        from lumin.node import ContextById
+        from lumin.node import ContextBySpec
+        ContextBySpec(self.request, name='test', spec={'title': 'Frob'})
+        ContextById(self.request, 'frobnitz', 'test').remove()
+        self.assertEqual(
+            self.request.lumin_identity_map.get('test', {'title': 'Frob'}),
+            None)
+
+    def test_delete_evicts_by_spec(self):
+        from lumin.node import Collection
+        from lumin.node import ContextBySpec
+        ContextBySpec(self.request, name='test', spec={'title': 'Frob'})
+        Collection(self.request, 'test').delete('frobnitz')
+        self.assertEqual(len(self.request.lumin_identity_map), 0)
+
+    def test_by_spec_shares_document(self):
+        from lumin.node import ContextBySpec
+        first = ContextBySpec(self.request, name='test',
+                              spec={'title': 'Frob'})
+        second = ContextBySpec(self.request, name='test',
+                               spec={'title': 'Frob'})
+        self.assertTrue(second.data is first.data)
@@ -0,0 +1,102 @@
+from __future__ import unicode_literals
+import unittest
+
+import pyramid.testing
+
+from lumin.testing import Connection
+
+
+class TestIndexRegistry(unittest.TestCase):
+    def setUp(self):
+        self.db = Connection()['test']
+
+    def _make_one(self):
+        from lumin.indexes import IndexRegistry
+        return IndexRegistry()
+
+    def test_add_declared(self):
+        indexes = self._make_one()
+        indexes.add_declared('pages', [
+            'title',
+            [('ctime', -1), ('title', 1)],
+            {'keys': '__name__', 'unique': True},
+            ])
+        self.assertEqual(list(indexes), [
+            ('pages', [('title', 1)], {}),
+            ('pages', [('ctime', -1), ('title', 1)], {}),
+            ('pages', [('__name__', 1)], {'unique': True}),
+            ])
+
+    def test_apply(self):
+        indexes = self._make_one()
+        indexes.add('pages', 'title', unique=True)
+        report = indexes.apply(self.db)
+        self.assertEqual(report['created'], [('pages', [('title', 1)])])
+        info = self.db['pages'].index_information()
+        self.assertEqual(info['title_1'],
+                         {'key': [('title', 1)], 'unique': True})
+        report = indexes.apply(self.db)
+        self.assertEqual(report['created'], [])
+        self.assertEqual(report['existing'], [('pages', [('title', 1)])])
+
+    def test_apply_dry_run(self):
+        indexes = self._make_one()
+        indexes.add('pages', 'title')
+        report = indexes.apply(self.db, create=False)
+        self.assertEqual(report['created'], [('pages', [('title', 1)])])
+        self.assertEqual(list(self.db['pages'].index_information()),
+                         ['_id_'])
+
+    def test_apply_drift(self):
+        self.db['sessions'].create_index('atime', expireAfterSeconds=60)
+        self.db['sessions'].create_index('stale')
+        indexes = self._make_one()
+        indexes.add('sessions', 'atime', expireAfterSeconds=1200)
+        report = indexes.apply(self.db)
+        self.assertEqual(report['drifted'], [
+            ('sessions', [('atime', 1)], {'expireAfterSeconds': (60, 1200)})])
+        self.assertEqual(report['undeclared'],
+                         [('sessions', [('stale', 1)])])
+
+
+class TestEnsureIndexes(unittest.TestCase):
+    def setUp(self):
+        self.config = pyramid.testing.setUp()
+        self.db = Connection()['test']
+
+    def tearDown(self):
+        pyramid.testing.tearDown()
+
+    def _call_fut(self):
+        from lumin.indexes import ensure_indexes
+        return ensure_indexes(self.config.registry, self.db)
+
+    def test_builtin_declared_and_added(self):
+        from lumin.indexes import add_mongodb_index
+        from lumin.node import ContextById
+
+        class Pages(ContextById):
+            collection = 'test_pages'
+            __indexes__ = ['title']
+
+        self.config.registry.settings['lumin.session.timeout'] = '600'
+        add_mongodb_index(self.config, 'users', 'email', unique=True)
+        report = self._call_fut()
+        created = report['created']
+        self.assertTrue(('test_pages', [('title', 1)]) in created)
+        self.assertTrue(
+            ('test_pages.history', [('orig_id', 1), ('_id', -1)]) in created)
+        self.assertTrue(('users', [('email', 1)]) in created)
+        self.assertTrue(('tempstore.files', [('uid', 1)]) in created)
+        self.assertEqual(
+            self.db['lumin.sessions'].index_information()['atime_1'],
+            {'key': [('atime', 1)], 'expireAfterSeconds': 600})
+
+    def test_register_mongodb(self):
+        from lumin.db import register_mongodb
+        conn = {'indexed': self.db}
+        self.config.registry.settings['mongodb.db_name'] = 'indexed'
+        self.config.registry.settings['lumin.indexes.ensure'] = 'true'
+        register_mongodb(self.config, conn=conn)
+        info = self.db['tempstore.files'].index_information()
+        self.assertTrue('uid_1' in info)
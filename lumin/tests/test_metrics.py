@@ -0,0 +1,97 @@
+from __future__ import unicode_literals
+import unittest
+
+import pyramid.testing
+
+
+class DummyEvent(object):
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+class TestMongoDBMetrics(unittest.TestCase):
+    def _make_one(self):
+        from lumin.metrics import MongoDBMetrics
+        return MongoDBMetrics()
+
+    def _command(self, metrics, request_id, name, collection, micros,
+                 failed=False):
+        commands = metrics.listeners[0]
+        commands.started(DummyEvent(
+            command_name=name, command={name: collection},
+            connection_id=('localhost', 27017), request_id=request_id))
+        finished = commands.failed if failed else commands.succeeded
+        finished(DummyEvent(
+            command_name=name, connection_id=('localhost', 27017),
+            request_id=request_id, duration_micros=micros))
+
+    def test_commands(self):
+        metrics = self._make_one()
+        self._command(metrics, 1, 'find', 'pages', 2000)
+        self._command(metrics, 2, 'find', 'pages', 20000)
+        self._command(metrics, 3, 'insert', 'pages', 500, failed=True)
+        self._command(metrics, 4, 'ismaster', 1, 100)
+        commands = metrics.snapshot()['commands']
+        find = commands[('pages', 'find')]
+        self.assertEqual((find['count'], find['errors']), (2, 0))
+        self.assertEqual(dict(find['latency']['buckets'])[0.005], 1)
+        self.assertEqual(dict(find['latency']['buckets'])[0.05], 2)
+        self.assertAlmostEqual(find['latency']['sum'], 0.022)
+        self.assertEqual(commands[('pages', 'insert')]['errors'], 1)
+        self.assertEqual(commands[('', 'ismaster')]['count'], 1)
+
+    def test_pool(self):
+        from lumin.metrics import PoolMetrics
+        metrics = self._make_one()
+        times = iter([1.0, 1.25, 2.0])
+        pool = PoolMetrics(metrics, timer=lambda: next(times))
+        event = DummyEvent(address=('localhost', 27017), connection_id=1)
+        pool.connection_created(event)
+        pool.connection_check_out_started(event)
+        pool.connection_checked_out(event)
+        self.assertEqual(metrics.snapshot()['pool']['checked_out'], 1)
+        pool.connection_checked_in(event)
+        pool.connection_check_out_started(event)
+        pool.connection_check_out_failed(event)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['pool'], {
+            'open': 1, 'checked_out': 0, 'checkouts': 1,
+            'checkout_errors': 1, 'cleared': 0})
+        self.assertEqual(snapshot['pool_wait']['count'], 1)
+        self.assertEqual(dict(snapshot['pool_wait']['buckets'])[0.5], 1)
+
+    def test_exposition(self):
+        metrics = self._make_one()
+        self._command(metrics, 1, 'find', 'pages', 2000)
+        text = metrics.exposition()
+        self.assertTrue(
+            'lumin_mongodb_commands_total{collection="pages",command="find"}'
+            ' 1\n' in text)
+        self.assertTrue(
+            'lumin_mongodb_command_seconds_bucket{collection="pages",'
+            'command="find",le="+Inf"} 1\n' in text)
+        self.assertTrue('lumin_mongodb_pool_checked_out 0\n' in text)
+        self.assertTrue('lumin_mongodb_pool_wait_seconds_count 0\n' in text)
+
+
+class TestMetricsView(unittest.TestCase):
+    def setUp(self):
+        self.config = pyramid.testing.setUp(settings={})
+
+    def tearDown(self):
+        pyramid.testing.tearDown()
+
+    def test_none_allowed_by_default(self):
+        from lumin.metrics import metrics_view
+        request = pyramid.testing.DummyRequest(remote_addr='127.0.0.1')
+        self.assertEqual(metrics_view(request).status_int, 403)
+
+    def test_allowed(self):
+        from lumin.metrics import metrics_view
+        self.config.registry.settings['lumin.metrics.allow'] = '127.0.0.1'
+        request = pyramid.testing.DummyRequest(remote_addr='127.0.0.1')
+        response = metrics_view(request)
+        self.assertEqual(response.content_type, 'text/plain')
+        self.assertTrue('lumin_mongodb_pool_open 0' in response.text)
+        request = pyramid.testing.DummyRequest(remote_addr='10.0.0.1')
+        self.assertEqual(metrics_view(request).status_int, 403)
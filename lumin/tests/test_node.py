@@ -82,6 +82,43 @@ class TestCollection(unittest.TestCase):
         result = self._call_fut(request=self.request)
         self.assertEquals(result.get(_id=0).__name__, data.__name__)
 
+    def test_collection_get_many(self):
+        result = self._call_fut(request=self.request, name='test_name')
+        for _id in ('a', 'b', 'c'):
+            result._collection.insert({'_id': _id, 'n': _id})
+        contexts, missing = result.get_many(['c', 'x', 'a', 'c'])
+        self.assertEqual([c.data['n'] for c in contexts], ['c', 'a', 'c'])
+        self.assertEqual(missing, ['x'])
+        self.assertEqual(contexts[0].__acl__, [])
+        self.assertEqual(contexts[0].collection, 'test_name')
+
+    def test_collection_get_many_identity_map(self):
+        self.config.registry.settings['lumin.identity_map'] = 'true'
+        result = self._call_fut(request=self.request, name='test_name')
+        result._collection.insert({'_id': 'a'})
+        result._collection.insert({'_id': 'b'})
+        loaded = result.get('a')
+        contexts, missing = result.get_many(['a', 'b'])
+        self.assertTrue(contexts[0] is loaded)
+        self.assertTrue(result.get('b') is contexts[1])
+
+    def test_collection_find_views(self):
+        from pyramid.security import Allow
+        result = self._call_fut(request=self.request, name='test_name')
+        acl = [[Allow, 'editors', 'edit']]
+        result._collection.insert({'_id': 'b', 'n': 1})
+        result._collection.insert({'_id': 'a', 'n': 2, '__acl__': acl})
+        views = result.find_views()
+        view = next(views)
+        self.assertEqual((view.__name__, view.oid, view.data['n']),
+                         ('b', 'b', 1))
+        self.assertEqual(view.__acl__, [])
+        view = next(views)
+        self.assertEqual(view.__acl__, acl)
+        self.assertFalse(hasattr(view, '__dict__'))
+        self.assertFalse(hasattr(view, 'save'))
+        self.assertEqual(len(list(result.find_views({'n': 1}))), 1)
+
     def test_collection_insert(self):
         result = self._call_fut(request=self.request)
         result.insert({'name': 'Foo'}, 'first user')
@@ -94,6 +131,41 @@ class TestCollection(unittest.TestCase):
         self.assertEquals(result._collection.count(), 2)
         self.assertNotEquals(result._collection.find({"_id": 'first-user1'}), None)
 
+    def test_collection_insert_suffixes_from_counter(self):
+        result = self._call_fut(request=self.request, name="test_name")
+        oids = [result.insert({'name': 'Foo'}, 'Report') for i in range(3)]
+        self.assertEqual(oids, ['report', 'report-1', 'report-2'])
+        counter = result._collection_counters.find_one({'_id': '_id:report-'})
+        self.assertEqual(counter['seq'], 3)
+
+    def test_collection_insert_counter_seeded_from_existing(self):
+        result = self._call_fut(request=self.request, name="test_name")
+        result._collection.insert({'_id': 'report'})
+        result._collection.insert({'_id': 'report-3'})
+        result._collection.insert({'_id': 'report-card'})
+        self.assertEqual(result.insert({}, 'Report'), 'report-4')
+        self.assertEqual(result.insert({}, 'Report'), 'report-5')
+
+    def test_collection_insert_unique_skips_counter(self):
+        result = self._call_fut(request=self.request, name="test_name")
+        self.assertEqual(result.insert({}, 'Report'), 'report')
+        self.assertEqual(result.insert({}, 'Summary'), 'summary')
+        self.assertEqual(result._collection_counters.count(), 0)
+
+    def test_collection_insert_counter_seeded_bare_slug_free(self):
+        result = self._call_fut(request=self.request, name="test_name")
+        result._collection.insert({'_id': 'report-2'})
+        self.assertEqual(result.insert({}, 'Report'), 'report')
+        self.assertEqual(result.insert({}, 'Report'), 'report-3')
+
+    def test_collection_insert_resyncs_counter_on_duplicate(self):
+        result = self._call_fut(request=self.request, name="test_name")
+        result.insert({}, 'Report')
+        # Written behind the counter's back
+        result._collection.insert({'_id': 'report-1'})
+        result._collection.insert({'_id': 'report-2'})
+        self.assertEqual(result.insert({}, 'Report'), 'report-3')
+
     def test_collection_insert_duplicate_key_increment_false(self):
         result = self._call_fut(request=self.request)
         result.insert({'name': 'Foo'}, 'first user', increment=False)
@@ -110,6 +182,146 @@ class TestCollection(unittest.TestCase):
         pass
 
 
+class TestCollectionInsertMany(unittest.TestCase):
+    def setUp(self):
+        self.config = pyramid.testing.setUp()
+        self.request = pyramid.testing.DummyRequest()
+
+        from lumin.testing import Connection
+        self.request.db = Connection()['test']
+
+    def tearDown(self):
+        pyramid.testing.tearDown()
+
+    def _call_fut(self, request=None, name='test_name'):
+        from lumin.node import Collection
+        return Collection(request=request, name=name, duplicate_key_error=AssertionError)
+
+    def test_insert_many(self):
+        result = self._call_fut(request=self.request)
+        docs = [{'n': 1}, {'n': 2}, {'n': 3}, {'n': 4}]
+        oids = result.insert_many(docs, ['Report', 'Untitled', 'Report', 'report'])
+        self.assertEqual(oids, ['report', 'untitled', 'report-1', 'report-2'])
+        self.assertEqual(result._collection.count(), 4)
+        self.assertEqual(docs[0]['ctime'], docs[3]['ctime'])
+        self.assertEqual(docs[0]['mtime'], docs[0]['ctime'])
+
+    def test_insert_many_suffix_equals_title(self):
+        result = self._call_fut(request=self.request)
+        oids = result.insert_many([{}, {}, {}, {}],
+                                  ['Report', 'Report', 'Report 1', 'Report'])
+        self.assertEqual(oids, ['report', 'report-1', 'report-1-1',
+                                'report-2'])
+        self.assertEqual(result._collection.count(), 4)
+
+    def test_insert_many_native_timestamps(self):
+        import datetime
+        self.config.registry.settings['lumin.native_timestamps'] = 'true'
+        result = self._call_fut(request=self.request)
+        docs = [{'n': 1}]
+        result.insert_many(docs, ['Report'])
+        self.assertTrue(isinstance(docs[0]['ctime'], datetime.datetime))
+
+    def test_insert_many_resolves_against_db(self):
+        result = self._call_fut(request=self.request)
+        result._collection.insert({'_id': 'report'})
+        result._collection.insert({'_id': 'report-7'})
+        oids = result.insert_many([{}, {}], ['Report', 'Report'])
+        self.assertEqual(oids, ['report-8', 'report-9'])
+
+    def test_insert_many_bare_slug_free(self):
+        result = self._call_fut(request=self.request)
+        result._collection.insert({'_id': 'report-2'})
+        oids = result.insert_many([{}, {}], ['Report', 'Report'])
+        self.assertEqual(oids, ['report', 'report-3'])
+
+    def test_insert_many_then_insert(self):
+        result = self._call_fut(request=self.request)
+        result.insert({}, 'Report')
+        result.insert_many([{}, {}], ['Report', 'Report'])
+        self.assertEqual(result.insert({}, 'Report'), 'report-3')
+
+    def test_insert_many_increment_false(self):
+        result = self._call_fut(request=self.request)
+        self.assertRaises(
+            AssertionError, result.insert_many, [{}, {}], ['Report', 'Report'],
+            increment=False)
+
+    def test_insert_many_title_count_mismatch(self):
+        result = self._call_fut(request=self.request)
+        self.assertRaises(ValueError, result.insert_many, [{}, {}], ['Report'])
+
+    def test_insert_many_empty(self):
+        result = self._call_fut(request=self.request)
+        self.assertEqual(result.insert_many([], []), [])
+
+    def test_context_by_spec_insert_many(self):
+        from lumin.node import ContextBySpec
+        context = ContextBySpec(
+            request=self.request, name='test_name', data={'_id': 'x'},
+            duplicate_key_error=AssertionError)
+        docs = [{'_id': 1}, {'_id': 2}]
+        result = context.insert_many(docs, ['Report', 'Report'])
+        self.assertEqual(result, [{'_id': 1}, {'_id': 2}])
+        self.assertEqual([doc['__name__'] for doc in docs],
+                         ['report', 'report-1'])
+
+
+class TestCollectionReads(unittest.TestCase):
+    def setUp(self):
+        from lumin.testing import Connection
+        self.config = pyramid.testing.setUp()
+        self.request = pyramid.testing.DummyRequest()
+        self.request.db = Connection()['test']
+        ## A secondary which has not caught up yet
+        self.stale = Connection()['stale']['test']
+
+    def tearDown(self):
+        pyramid.testing.tearDown()
+
+    def test_find_reads_with_preference(self):
+        from lumin.node import Collection
+        result = Collection(self.request, 'test')
+        result._collection_reads = self.stale
+        result._collection.insert({'_id': 'a'})
+        self.assertEqual(result.find().count(), 0)
+        self.assertEqual(list(result.find_views()), [])
+
+    def test_slugs_allocated_from_primary(self):
+        from lumin.node import Collection
+        result = Collection(self.request, 'test',
+                            duplicate_key_error=AssertionError)
+        result._collection_reads = self.stale
+        result._collection.insert({'_id': 'report'})
+        self.assertEqual(result.insert({}, 'Report'), 'report-1')
+        self.assertEqual(result.insert_many([{}], ['Report']), ['report-2'])
+
+    def test_modify_record_reads_primary(self):
+        from lumin.node import ContextById
+        self.request.db['test'].insert({'_id': 'a', 'views': 1})
+        result = ContextById(self.request, _id='a', name='test')
+        result._collection_reads = self.stale
+        result.inc('views', record=True)
+        self.assertEqual(result.data['views'], 2)
+
+    def test_secondary_reads_not_cached(self):
+        from lumin.cache import get_document_cache
+        from lumin.node import Collection
+        settings = self.config.registry.settings
+        settings['lumin.cache.collections'] = 'test'
+        settings['lumin.read.collection.test'] = 'secondary'
+        self.request.db['test'].insert({'_id': 'a'})
+        self.request.db['test'].insert({'_id': 'b'})
+        result = Collection(self.request, 'test')
+        result.get('a')
+        result.get_many(['b'])
+        cache = get_document_cache(self.config.registry)
+        self.assertEqual(len(cache), 0)
+        settings['lumin.read.collection.test'] = 'primary'
+        Collection(self.request, 'test').get('a')
+        self.assertEqual(len(cache), 1)
+
+
 class TestContextById(unittest.TestCase):
     def setUp(self):
         self.config = pyramid.testing.setUp()
@@ -238,6 +450,65 @@ class TestContextById(unittest.TestCase):
         self.assertEquals(result._id, "test_id")
         self.assertEquals(result.oid, 'test_id')
 
+    def test_load_with_fields(self):
+        data = {"_id": "test_id", "foo": "bar", "baz": "qux"}
+        self._create_context(data=data)
+        from lumin.node import ContextById
+        result = ContextById(self.request, _id="test_id", name="test",
+                             fields=['foo'])
+        self.assertEqual(result.data, {"foo": "bar"})
+        self.assertRaises(TypeError, result.save)
+        self.assertRaises(TypeError, result.update, {'foo': 'baz'})
+
+    def test_load_takes_no_snapshot(self):
+        self._create_context(data={"_id": "test_id", "foo": {"bar": 1}})
+        result = self._call_fut(request=self.request, name="test", _id="test_id")
+        self.assertEqual(result.data['foo']['bar'], 1)
+        self.assertFalse(result._tracker.changed)
+        self.assertEqual(result.orig, {"_id": "test_id", "foo": {"bar": 1}})
+
+    def test_record_writes_pre_change_document(self):
+        self._create_context(data={"_id": "test_id", "foo": {"bar": 1}})
+        result = self._call_fut(request=self.request, name="test", _id="test_id")
+        result.data['foo']['bar'] = 2
+        result._record()
+        record = result._collection_history.find_one({'orig_id': 'test_id'})
+        self.assertEqual(record['foo'], {'bar': 1})
+        self.assertFalse('mtime' in record)
+        self.assertEqual(result.data['foo']['bar'], 2)
+
+    def test_delta(self):
+        self._create_context(data={"_id": "test_id", "foo": {"bar": 1, "baz": 2},
+                                   "qux": "x" * 100, "gone": 1})
+        result = self._call_fut(request=self.request, name="test", _id="test_id")
+        result.data['foo']['bar'] = 2
+        del result.data['gone']
+        self.assertEqual(result._delta(),
+                         {'$set': {'foo.bar': 2}, '$unset': {'gone': ''}})
+
+    def test_delta_larger_than_document(self):
+        self._create_context(data={"_id": "t", "foo": 1, "gone": 1})
+        result = self._call_fut(request=self.request, name="test", _id="t")
+        result.data['foo'] = 'x' * 50
+        del result.data['gone']
+        self.assertTrue(result._delta() is result.data)
+
+    def test_delta_with_fields(self):
+        self._create_context(data={"_id": "test_id", "foo": 1, "bar": 2})
+        from lumin.node import ContextById
+        result = ContextById(self.request, _id="test_id", name="test",
+                             fields=['foo'])
+        result.data['foo'] = 2
+        self.assertEqual(result._delta(), {'$set': {'foo': 2}})
+
+    def test_collection_get_with_fields(self):
+        data = {"_id": "test_id", "foo": "bar", "baz": "qux"}
+        self._create_context(data=data)
+        from lumin.node import Collection
+        result = Collection(self.request, name="test").get(
+            "test_id", fields=['_id', 'baz'])
+        self.assertEqual(result.data, {"_id": "test_id", "baz": "qux"})
+
     def test_history(self):
         result = self._call_fut(request=self.request)
         standard_cursor = mongomock.Cursor('dataset')
@@ -247,6 +518,224 @@ class TestContextById(unittest.TestCase):
         result = self._call_fut(request=self.request)
         self.assertRaises(TypeError, result.history(), limit="string")
 
+    def _atomic_context(self):
+        self._create_context(data={"_id": "test_id", "views": 1,
+                                   "tags": ["a", "b"]})
+        return self._call_fut(request=self.request, name="test",
+                              _id="test_id")
+
+    def test_inc(self):
+        result = self._atomic_context()
+        other = self._call_fut(request=self.request, name="test",
+                               _id="test_id")
+        self.assertEqual(result.inc('views'), 2)
+        self.assertEqual(other.inc('views', 5), 7)
+        doc = self.request.db.test.find_one({'_id': 'test_id'})
+        self.assertEqual(doc['views'], 7)
+        self.assertEqual(doc['changed_by'], '')
+        self.assertEqual(other.data['mtime'], doc['mtime'])
+
+    def test_inc_shared_by_identity_map(self):
+        self.config.registry.settings['lumin.identity_map'] = 'true'
+        first = self._atomic_context()
+        second = self._call_fut(request=self.request, name="test",
+                                _id="test_id")
+        first.inc('views')
+        self.assertTrue(second.data is first.data)
+        second.save()
+        doc = self.request.db.test.find_one({'_id': 'test_id'})
+        self.assertEqual(doc['views'], 2)
+
+    def test_pull_add_to_set_set_fields(self):
+        result = self._atomic_context()
+        result.pull('tags', 'a')
+        self.assertEqual(result.data['tags'], ['b'])
+        result.add_to_set('tags', 'c')
+        self.assertEqual(sorted(result.data['tags']), ['b', 'c'])
+        result.set_fields({'title': 'T'}, views=9)
+        self.assertEqual(result.data['title'], 'T')
+        self.assertEqual(result.data['views'], 9)
+        self.assertFalse(result._tracker.changed)
+
+    def test_push(self):
+        from lumin.node import ContextById
+        from lumin.testing import Connection
+        self.request.db = Connection()['test']
+        self.request.db['test'].insert({"_id": "test_id", "tags": []})
+        result = ContextById(self.request, _id="test_id", name="test")
+        result.push('tags', 'a')
+        self.assertEqual(result.data['tags'], ['a'])
+
+    def test_modify_record(self):
+        result = self._atomic_context()
+        result.inc('views', record=True)
+        record = result._collection_history.find_one({'orig_id': 'test_id'})
+        self.assertEqual(record['views'], 1)
+        self.assertEqual(result.data['views'], 2)
+
+    def test_modify_not_found(self):
+        result = self._atomic_context()
+        self.request.db.test.remove({'_id': 'test_id'})
+        self.assertRaises(KeyError, result.inc, 'views')
+
+    def _nested_context(self):
+        from lumin.node import ContextById
+        from lumin.testing import Connection
+        self.request.db = Connection()['test']
+        self.request.db['test'].insert(
+            {'_id': 'test_id', 'nested': {'x': 1}, 'body': 'x' * 100})
+        return ContextById(self.request, _id='test_id', name='test')
+
+    def test_delta_save_dict_copy_change(self):
+        self.config.registry.settings['lumin.delta_save'] = 'true'
+        result = self._nested_context()
+        dict(result.data)['nested']['x'] = 2
+        result._touch()
+        ## mongomock shares the nested documents it stores
+        self.assertEqual(result._delta()['$set']['nested'], {'x': 2})
+
+    def test_delta_save_untracked_change(self):
+        self.config.registry.settings['lumin.delta_save'] = 'true'
+        result = self._nested_context()
+        ## Behind the tracker's back
+        dict.__setitem__(result.data, 'foo', 'baz')
+        result._touch()
+        self.assertTrue(result._delta() is result.data)
+        result.save()
+        doc = self.request.db.test.find_one({'_id': 'test_id'})
+        self.assertEqual(doc['foo'], 'baz')
+
+    def test_history_dict_copy_change(self):
+        result = self._nested_context()
+        dict(result.data)['nested']['x'] = 2
+        result.update({})
+        record = self.request.db['test.history'].find_one()
+        self.assertEqual(record['nested'], {'x': 1})
+
+    def _versioned_context(self, **doc):
+        from lumin.node import ContextById
+        from lumin.testing import Connection
+        if doc:
+            self.config.registry.settings['lumin.versioned'] = 'true'
+            self.request.db = Connection()['test']
+            self.request.db['test'].insert(dict(doc, _id='test_id'))
+        return ContextById(self.request, _id='test_id', name='test')
+
+    def test_versioned_save(self):
+        result = self._versioned_context(a=1, b=1)
+        result.data['a'] = 2
+        result.save()
+        result.data['a'] = 3
+        result.save()
+        doc = self.request.db.test.find_one({'_id': 'test_id'})
+        self.assertEqual((doc['a'], doc['_version']), (3, 2))
+
+    def test_versioned_conflict(self):
+        from lumin.node import ConflictError
+        mine = self._versioned_context(a=1, b=1)
+        theirs = self._versioned_context()
+        theirs.data['a'] = 2
+        theirs.save()
+        mine.data['a'] = 3
+        self.assertRaises(ConflictError, mine.save)
+        try:
+            mine.save(merge=True)
+        except ConflictError as e:
+            self.assertEqual(e.paths, ['a'])
+            self.assertEqual(e.current['a'], 2)
+        else:
+            self.fail('ConflictError not raised')
+
+    def test_versioned_merge(self):
+        mine = self._versioned_context(a=1, b=1)
+        theirs = self._versioned_context()
+        theirs.data['a'] = 2
+        theirs.save()
+        mine.update({'b': 2}, merge=True)
+        doc = self.request.db.test.find_one({'_id': 'test_id'})
+        self.assertEqual((doc['a'], doc['b'], doc['_version']), (2, 2, 2))
+        self.assertEqual(mine.data['a'], 2)
+        ## The version replaced is the one merged with
+        records = list(self.request.db['test.history'].find())
+        self.assertEqual([(r['a'], r['b']) for r in records], [(2, 1)])
+
+    def test_versioned_conflict_not_recorded(self):
+        from lumin.node import ConflictError
+        mine = self._versioned_context(a=1)
+        theirs = self._versioned_context()
+        theirs.data['a'] = 2
+        theirs.save()
+        self.assertRaises(ConflictError, mine.update, {'a': 3})
+        self.assertEqual(self.request.db['test.history'].count(), 0)
+
+    def test_versioned_merge_keeps_identity_map(self):
+        from lumin.node import ContextById
+        self.config.registry.settings['lumin.identity_map'] = 'true'
+        mine = self._versioned_context(a=1, b=1)
+        same = ContextById(self.request, _id='test_id', name='test')
+        other = pyramid.testing.DummyRequest()
+        other.db = self.request.db
+        theirs = ContextById(other, _id='test_id', name='test')
+        theirs.data['a'] = 2
+        theirs.save()
+        mine.update({'b': 2}, merge=True)
+        self.assertTrue(same.data is mine.data)
+        self.assertEqual((same.data['a'], same.data['b']), (2, 2))
+
+    def test_versioned_under_unit_of_work(self):
+        from lumin.node import ConflictError
+        from lumin.unit_of_work import UnitOfWork
+        mine = self._versioned_context(a=1)
+        theirs = self._versioned_context()
+        theirs.data['a'] = 2
+        theirs.save()
+        ## Versioned saves are not queued, the conflict is seen at once
+        self.request.lumin_unit_of_work = work = UnitOfWork()
+        mine.data['a'] = 3
+        self.assertRaises(ConflictError, mine.save)
+        self.assertEqual(len(work), 0)
+
+    def test_versioned_modify(self):
+        result = self._versioned_context(views=0)
+        result.inc('views')
+        self.assertEqual(result.data['_version'], 1)
+
+    def test_history_sort(self):
+        from pymongo import ASCENDING
+        self._create_context(data={"_id": "test_id", "foo": 1})
+        result = self._call_fut(request=self.request, name="test",
+                                _id="test_id")
+        for i in range(3):
+            result._collection_history.insert({'orig_id': 'test_id', 'n': i})
+        self.assertEqual([r['n'] for r in result.history()], [2, 1, 0])
+        self.assertEqual([r['n'] for r in result.history(sort=ASCENDING)],
+                         [0, 1, 2])
+
+    def test_history_page(self):
+        self._create_context(data={"_id": "test_id", "foo": 1})
+        result = self._call_fut(request=self.request, name="test",
+                                _id="test_id")
+        for i in range(3):
+            result._collection_history.insert({'orig_id': 'test_id', 'n': i})
+        page, token = result.history_page(limit=2)
+        self.assertEqual([r['n'] for r in page], [2, 1])
+        page, token = result.history_page(limit=2, token=token)
+        self.assertEqual([r['n'] for r in page], [0])
+        self.assertEqual(token, None)
+        from webob.exc import HTTPBadRequest
+        self.assertRaises(HTTPBadRequest, result.history_page, token='bad')
+
+    def test_as_of(self):
+        import datetime
+        self._create_context(data={"_id": "test_id", "foo": 1})
+        result = self._call_fut(request=self.request, name="test",
+                                _id="test_id")
+        result._collection_history.insert({'orig_id': 'test_id', 'foo': 0})
+        past = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+        future = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+        self.assertEqual(result.as_of(past)['foo'], 0)
+        self.assertEqual(result.as_of(future), {"_id": "test_id", "foo": 1})
+
     def test_history_with_timestamp(self):
         from datetime import datetime
         now = datetime.now()
@@ -396,6 +885,26 @@ class TestContextBySpec(unittest.TestCase):
         result.set___name__(slug=slug)
         self.assertEquals(result.data['__name__'], slug)
 
+    def test_load_by_spec(self):
+        self._create_context({"_id": "a", "kind": "x", "n": 1})
+        from lumin.node import ContextBySpec
+        result = ContextBySpec(self.request, name='test', spec={'kind': 'x'})
+        self.assertEqual(result.data, {"_id": "a", "kind": "x", "n": 1})
+
+    def test_load_by_spec_multiple(self):
+        self._create_context({"_id": "a", "kind": "x"})
+        self._create_context({"_id": "b", "kind": "x"})
+        from lumin.node import ContextBySpec
+        from webob.exc import HTTPInternalServerError
+        self.assertRaises(HTTPInternalServerError, ContextBySpec,
+                          self.request, name='test', spec={'kind': 'x'})
+
+    def test_load_by_spec_not_found(self):
+        from lumin.node import ContextBySpec
+        from pyramid.exceptions import NotFound
+        self.assertRaises(NotFound, ContextBySpec,
+                          self.request, name='test', spec={'kind': 'x'})
+
     def test_history(self):
         result = self._call_fut(request=self.request)
         standard_cursor = mongomock.Cursor('dataset')
@@ -437,6 +946,23 @@ class TestContextBySpec(unittest.TestCase):
         self.assertEquals(result._collection.count(), 3)  # There's one created in `_call_fut`
         self.assertNotEquals(result._collection.find({"_id": 'first-user1'}), None)
 
+    def test_insert_duplicate_name_suffixed(self):
+        result = self._call_fut(request=self.request)
+        insert = result._collection.insert
+
+        def unique_name(doc):
+            ## As a unique index on __name__
+            if result._collection.find_one({'__name__': doc['__name__']}):
+                raise AssertionError('duplicate key')
+            return insert(doc)
+        result._collection.insert = unique_name
+        doc = {'name': 'Foo'}
+        result.insert(doc, 'first user')
+        self.assertEqual(doc['__name__'], 'first-user')
+        doc = {'name': 'Foo'}
+        result.insert(doc, 'first user')
+        self.assertEqual(doc['__name__'], 'first-user-1')
+
     def test_insert_duplicate_key_increment_false(self):
         result = self._call_fut(request=self.request)
         result.insert({'name': 'Foo'}, 'first user', increment=False)
@@ -451,6 +977,17 @@ class TestContextBySpec(unittest.TestCase):
         result = self._call_fut(request=self.request)
         self.assertRaises(KeyError, result.save())
 
+    def test_delta_save(self):
+        self.config.registry.settings['lumin.delta_save'] = 'true'
+        result = self._call_fut(request=self.request)
+        result.data['foo'] = 'baz'
+        result.data['body'] = 'x' * 100
+        result.save()
+        doc = self.request.db.test.find_one({'_id': 'test_id'})
+        self.assertEqual(doc['foo'], 'baz')
+        self.assertEqual(doc['changed_by'], '')
+        self.assertFalse(result._tracker.changed)
+
     # ======================================================================
     # FAIL: test_update (test_node.TestContextBySpec)
     # ----------------------------------------------------------------------
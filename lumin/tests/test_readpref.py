@@ -0,0 +1,75 @@
+from __future__ import unicode_literals
+import unittest
+
+import pyramid.testing
+
+
+class DummyCollection(object):
+    options = None
+
+    def with_options(self, **options):
+        copy = DummyCollection()
+        copy.options = options
+        return copy
+
+
+class DummyRoute(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class TestParseRead(unittest.TestCase):
+    def _call_fut(self, value):
+        from lumin.readpref import parse_read
+        return parse_read(value)
+
+    def test_it(self):
+        self.assertEqual(self._call_fut('nearest'), ('nearest', None))
+        self.assertEqual(self._call_fut(' secondary  majority'),
+                         ('secondary', 'majority'))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self._call_fut, 'secondaries')
+        self.assertRaises(ValueError, self._call_fut, '')
+        self.assertRaises(ValueError, self._call_fut, 'primary local x')
+
+
+class TestReadFor(unittest.TestCase):
+    def setUp(self):
+        self.config = pyramid.testing.setUp(settings={
+            'lumin.read.route.search': 'nearest',
+            'lumin.read.collection.pages': 'secondary',
+            'lumin.read.collection.pages.history': 'primaryPreferred',
+            'lumin.read.history': 'secondaryPreferred local',
+            })
+        self.request = pyramid.testing.DummyRequest()
+
+    def tearDown(self):
+        pyramid.testing.tearDown()
+
+    def _call_fut(self, name, default=None):
+        from lumin.readpref import read_for
+        return read_for(self.request, name, default)
+
+    def test_precedence(self):
+        self.assertEqual(self._call_fut('pages'), ('secondary', None))
+        self.assertEqual(self._call_fut('pages.history'),
+                         ('primaryPreferred', None))
+        self.assertEqual(self._call_fut('users.history'),
+                         ('secondaryPreferred', 'local'))
+        self.assertEqual(self._call_fut('users'), None)
+        self.assertEqual(self._call_fut('users', 'nearest'),
+                         ('nearest', None))
+        self.request.matched_route = DummyRoute('search')
+        self.assertEqual(self._call_fut('pages'), ('nearest', None))
+
+    def test_read_collection(self):
+        from pymongo import ReadPreference
+        from lumin.readpref import read_collection
+        collection = DummyCollection()
+        self.request.db = {'users': collection, 'users.history': collection}
+        self.assertTrue(read_collection(self.request, 'users') is collection)
+        options = read_collection(self.request, 'users.history').options
+        self.assertEqual(options['read_preference'],
+                         ReadPreference.SECONDARY_PREFERRED)
+        self.assertEqual(options['read_concern'].level, 'local')
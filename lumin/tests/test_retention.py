@@ -0,0 +1,159 @@
+from __future__ import unicode_literals
+import datetime
+import unittest
+
+from bson.objectid import ObjectId
+
+from lumin.testing import Connection
+
+NOW = datetime.datetime(2013, 6, 30, 12, 0)
+
+
+def _oid(days, hours=0):
+    return ObjectId.from_datetime(
+        NOW - datetime.timedelta(days=days, hours=hours))
+
+
+class TestRetentionPolicy(unittest.TestCase):
+    def _make_one(self, **kwargs):
+        from lumin.retention import RetentionPolicy
+        return RetentionPolicy(**kwargs)
+
+    def _versions(self, *ages):
+        return [{'_id': _oid(*age)} for age in ages]
+
+    def test_keep_last(self):
+        policy = self._make_one(keep_last=2)
+        versions = self._versions((0, 1), (0, 2), (0, 3))
+        self.assertEqual(policy.expired(versions, NOW),
+                         set([versions[2]['_id']]))
+
+    def test_keep_age(self):
+        policy = self._make_one(keep_age=datetime.timedelta(days=2))
+        versions = self._versions((1, ), (3, ), (4, ))
+        self.assertEqual(policy.expired(versions, NOW),
+                         set([versions[1]['_id'], versions[2]['_id']]))
+
+    def test_thin_daily(self):
+        policy = self._make_one(keep_last=1, thin='daily')
+        versions = self._versions((0, 1), (3, 1), (3, 2), (4, 1))
+        self.assertEqual(policy.expired(versions, NOW),
+                         set([versions[2]['_id']]))
+
+    def test_thin_weekly(self):
+        policy = self._make_one(thin='weekly')
+        ## NOW is a Sunday
+        versions = self._versions((0, ), (1, ), (7, ), (8, ))
+        self.assertEqual(policy.expired(versions, NOW),
+                         set([versions[1]['_id'], versions[3]['_id']]))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self._make_one)
+        self.assertRaises(ValueError, self._make_one, thin='hourly')
+
+
+class TestPolicyFromSettings(unittest.TestCase):
+    def _call_fut(self, settings):
+        from lumin.retention import policy_from_settings
+        return policy_from_settings(settings, 'pages')
+
+    def test_none(self):
+        self.assertEqual(self._call_fut({}), None)
+
+    def test_policy(self):
+        result = self._call_fut({
+            'lumin.history.retention.pages.keep_last': '10',
+            'lumin.history.retention.pages.keep_days': '30',
+            'lumin.history.retention.pages.thin': 'weekly',
+            })
+        self.assertEqual(result.keep_last, 10)
+        self.assertEqual(result.keep_age, datetime.timedelta(days=30))
+        self.assertEqual(result.thin, 'weekly')
+
+
+class TestCompact(unittest.TestCase):
+    def setUp(self):
+        self.collection = Connection()['test']['test.history']
+
+    def _fill(self, store, docs=3, versions=4):
+        for doc in range(docs):
+            for days in range(versions, 0, -1):
+                store.record({'_id': _oid(days, doc), 'orig_id': doc,
+                              'version': versions - days, 'a': 1, 'b': 2,
+                              'body': 'x' * 50})
+
+    def _call_fut(self, store, **kwargs):
+        from lumin.retention import RetentionPolicy
+        from lumin.retention import compact
+        return list(compact(store, RetentionPolicy(keep_last=2), now=NOW,
+                            **kwargs))
+
+    def _remaining(self, store, orig_id):
+        return [v['version'] for v in store.find({'orig_id': orig_id})]
+
+    def test_snapshot(self):
+        from lumin.history import SnapshotHistory
+        store = SnapshotHistory(self.collection)
+        self._fill(store)
+        reports = self._call_fut(store, batch_size=2)
+        self.assertEqual([r['documents'] for r in reports], [2, 1])
+        self.assertEqual(sum(r['versions'] for r in reports), 6)
+        self.assertTrue(reports[0]['bytes'] > 0)
+        self.assertEqual(self._remaining(store, 0), [3, 2])
+
+    def test_delta(self):
+        from lumin.history import DeltaHistory
+        store = DeltaHistory(self.collection, 3)
+        self._fill(store, docs=1)
+        reports = self._call_fut(store)
+        self.assertEqual(reports[0]['versions'], 2)
+        self.assertEqual(self._remaining(store, 0), [3, 2])
+
+    def test_bucket(self):
+        from lumin.history import BucketHistory
+        store = BucketHistory(self.collection)
+        self._fill(store, docs=1)
+        reports = self._call_fut(store)
+        self.assertEqual(reports[0]['versions'], 2)
+        self.assertEqual(self._remaining(store, 0), [3, 2])
+
+    def _record_while_compacting(self, store):
+        ## A version recorded between reading and dropping a document's
+        ## history
+        load = store.load
+
+        def load_then_record(orig_id):
+            result = load(orig_id)
+            store.record({'_id': _oid(0), 'orig_id': orig_id, 'version': 4,
+                          'a': 1, 'b': 2, 'body': 'x' * 50})
+            return result
+        store.load = load_then_record
+
+    def test_delta_keeps_concurrent_versions(self):
+        from lumin.history import DeltaHistory
+        store = DeltaHistory(self.collection, 10)
+        self._fill(store, docs=1)
+        self._record_while_compacting(store)
+        self._call_fut(store)
+        ## The expired keyframe the new version is a patch of is kept
+        self.assertEqual(self._remaining(store, 0), [4, 3, 2, 0])
+
+    def test_bucket_keeps_concurrent_versions(self):
+        from lumin.history import BucketHistory
+        store = BucketHistory(self.collection, seconds=86400 * 30)
+        self._fill(store, docs=1)
+        self._record_while_compacting(store)
+        self._call_fut(store)
+        self.assertEqual(self._remaining(store, 0), [4, 3, 2])
+        self.assertEqual(self.collection.find_one()['count'], 3)
+
+
+class TestHistoryIds(unittest.TestCase):
+    def test_pages(self):
+        from lumin.history import history_ids
+        collection = Connection()['test']['test.history']
+        for orig_id in ['b', 'a', 'c', 'a', 'b', 'b']:
+            collection.insert({'orig_id': orig_id})
+        collection.insert({'other': 1})
+        self.assertEqual(list(history_ids(collection, batch_size=2)),
+                         ['a', 'b', 'c'])
@@ -285,3 +285,92 @@ class TestDeSentinel(unittest.TestCase):
                'two': {'foo': ''},
                'one': {'foo': {'bar': ''}}}
             )
+
+
+class TestTimestampTransformer(unittest.TestCase):
+    def _make_one(self):
+        from lumin.son import TimestampTransformer
+        return TimestampTransformer()
+
+    def test_out(self):
+        import datetime
+        doc = {'ctime': '2013-01-02 03:04:05.678000', 'title': 'x'}
+        result = self._make_one().transform_outgoing(doc, None)
+        self.assertEqual(result['ctime'],
+                         datetime.datetime(2013, 1, 2, 3, 4, 5, 678000))
+        self.assertEqual(result['title'], 'x')
+
+
+class TestPipelineFromSettings(unittest.TestCase):
+    def _call_fut(self, settings):
+        from lumin.son import pipeline_from_settings
+        return pipeline_from_settings(settings)
+
+    def test_default(self):
+        from lumin.son import ColanderNullTransformer
+        from lumin.son import TimestampTransformer
+        pipeline = self._call_fut({})
+        self.assertEqual([type(m) for m in pipeline.default],
+                         [ColanderNullTransformer])
+        pipeline = self._call_fut({'lumin.native_timestamps': 'true'})
+        self.assertEqual([type(m) for m in pipeline.default],
+                         [ColanderNullTransformer, TimestampTransformer])
+
+    def test_settings_and_dotted_names(self):
+        from lumin.son import DecimalTransformer
+        from lumin.son import TimestampTransformer
+        pipeline = self._call_fut({'mongodb.manipulators':
+                                   'decimal\nlumin.son.TimestampTransformer'})
+        self.assertEqual([type(m) for m in pipeline.default],
+                         [DecimalTransformer, TimestampTransformer])
+
+    def test_native_timestamps_always_included(self):
+        from lumin.node import Collection
+        from lumin.son import DecimalTransformer
+        from lumin.son import TimestampTransformer
+
+        class Cold(Collection):
+            collection = 'cold'
+            __manipulators__ = ()
+
+        class Named(object):
+            def __init__(self, name):
+                self.name = name
+        pipeline = self._call_fut({'mongodb.manipulators': 'decimal',
+                                   'lumin.native_timestamps': 'true'})
+        self.assertEqual([type(m) for m in pipeline.default],
+                         [DecimalTransformer, TimestampTransformer])
+        self.assertEqual(
+            [type(m) for m in pipeline.manipulators(Named('cold'))],
+            [TimestampTransformer])
+
+    def test_collection_overrides(self):
+        import colander
+        from decimal import Decimal
+        from lumin.node import Collection
+        from lumin.son import SENTINEL
+
+        class Hot(Collection):
+            collection = 'hot'
+            __manipulators__ = ()
+
+        class Money(Collection):
+            collection = 'money'
+            __manipulators__ = ['decimal']
+
+        class Named(object):
+            def __init__(self, name):
+                self.name = name
+        pipeline = self._call_fut({})
+        doc = {'a': colander.null, 'b': Decimal('1.5')}
+        self.assertEqual(pipeline.transform_incoming(dict(doc), Named('hot')),
+                         doc)
+        self.assertEqual(
+            pipeline.transform_incoming(dict(doc), Named('hot.history')), doc)
+        result = pipeline.transform_incoming(dict(doc), Named('money'))
+        self.assertEqual(result['b'], {'_type': 'decimal', 'value': '1.5'})
+        self.assertTrue(result['a'] is colander.null)
+        result = pipeline.transform_incoming(dict(doc), Named('other'))
+        self.assertEqual(result['a'], SENTINEL)
+        out = pipeline.transform_outgoing({'a': SENTINEL}, Named('other'))
+        self.assertTrue(out['a'] is colander.null)
@@ -0,0 +1,108 @@
+from __future__ import unicode_literals
+import datetime
+import unittest
+
+from lumin.testing import Connection
+
+STRING = '2013-01-02 03:04:05.678000'
+STAMP = datetime.datetime(2013, 1, 2, 3, 4, 5, 678000)
+
+
+class TestNow(unittest.TestCase):
+    def _call_fut(self, settings=None):
+        from lumin.timestamps import now
+        return now(settings)
+
+    def test_string(self):
+        from lumin.util import TS_FORMAT
+        result = self._call_fut()
+        datetime.datetime.strptime(result, TS_FORMAT)
+
+    def test_native(self):
+        result = self._call_fut({'lumin.native_timestamps': 'true'})
+        self.assertTrue(isinstance(result, datetime.datetime))
+        self.assertEqual(result.microsecond % 1000, 0)
+
+
+class TestAsDatetime(unittest.TestCase):
+    def _call_fut(self, value):
+        from lumin.timestamps import as_datetime
+        return as_datetime(value)
+
+    def test_forms(self):
+        from bson.tz_util import utc
+        self.assertEqual(self._call_fut(STRING), STAMP)
+        self.assertEqual(self._call_fut(STAMP), STAMP)
+        self.assertEqual(self._call_fut(STAMP.replace(tzinfo=utc)), STAMP)
+        self.assertEqual(self._call_fut(None), None)
+
+
+class TestConvertTimestamps(unittest.TestCase):
+    def setUp(self):
+        self.collection = Connection()['test']['test']
+
+    def _call_fut(self, **kwargs):
+        from lumin.timestamps import convert_timestamps
+        return convert_timestamps(self.collection, **kwargs)
+
+    def test_batches(self):
+        for i in range(5):
+            self.collection.insert({'_id': i, 'ctime': STRING,
+                                    'mtime': STRING, 'title': i})
+        self.collection.insert({'_id': 5, 'ctime': STAMP, 'mtime': STAMP})
+        self.assertEqual(self._call_fut(batch_size=2), 5)
+        for doc in self.collection.find():
+            self.assertEqual(doc['ctime'], STAMP)
+            self.assertEqual(doc['mtime'], STAMP)
+        self.assertEqual(self.collection.find_one({'_id': 3})['title'], 3)
+
+
+class TestConvertHistoryTimestamps(unittest.TestCase):
+    def setUp(self):
+        self.collection = Connection()['test']['test.history']
+
+    def _call_fut(self, store):
+        from lumin.timestamps import convert_history_timestamps
+        return convert_history_timestamps(store)
+
+    def _check(self, store, records):
+        for i in range(3):
+            store.record({'orig_id': 'doc', 'version': i, 'a': 1, 'b': 2,
+                          'mtime': STRING.replace('05.', '0%d.' % i)})
+        self.assertEqual(self._call_fut(store), records)
+        result = list(store.find({'orig_id': 'doc'}))
+        self.assertEqual([r['version'] for r in result], [2, 1, 0])
+        self.assertEqual([r['mtime'].second for r in result], [2, 1, 0])
+        self.assertEqual(self._call_fut(store), 0)
+
+    def test_snapshot(self):
+        from lumin.history import SnapshotHistory
+        self._check(SnapshotHistory(self.collection), 3)
+
+    def test_delta(self):
+        from lumin.history import DeltaHistory
+        ## A keyframe and two patches of mtime
+        self._check(DeltaHistory(self.collection), 3)
+
+    def test_bucket(self):
+        from lumin.history import BucketHistory
+        self._check(BucketHistory(self.collection), 1)
+
+    def test_changed_meanwhile(self):
+        from lumin.history import BucketHistory
+        from lumin.timestamps import as_datetime
+        store = BucketHistory(self.collection)
+        store.record({'orig_id': 'doc', 'mtime': STRING})
+        update = self.collection.update
+
+        def record_then_update(*args, **kwargs):
+            self.collection.update = update
+            store.record({'orig_id': 'doc', 'mtime': STAMP})
+            return update(*args, **kwargs)
+        self.collection.update = record_then_update
+        self._call_fut(store)
+        ## The version recorded since the bucket was read is kept
+        result = list(store.find({'orig_id': 'doc'}))
+        self.assertEqual(len(result), 2)
+        self.assertEqual([as_datetime(r['mtime']) for r in result],
+                         [STAMP, STAMP])
@@ -0,0 +1,239 @@
+from __future__ import unicode_literals
+import copy
+import pickle
+import unittest
+
+
+class TestPlainCopy(unittest.TestCase):
+    def _call_fut(self, value):
+        from lumin.tracking import plain_copy
+        return plain_copy(value)
+
+    def test_nested(self):
+        doc = {'a': {'b': [1, {'c': 2}]}, 'd': 'e'}
+        result = self._call_fut(doc)
+        self.assertEqual(result, doc)
+        self.assertFalse(result['a'] is doc['a'])
+        self.assertFalse(result['a']['b'][1] is doc['a']['b'][1])
+
+    def test_tracked_becomes_plain(self):
+        from lumin.tracking import ChangeTracker
+        tracker = ChangeTracker({'a': {'b': [1]}})
+        tracker.data['a']['b']
+        result = self._call_fut(tracker.data)
+        self.assertTrue(type(result) is dict)
+        self.assertTrue(type(result['a']) is dict)
+        self.assertTrue(type(result['a']['b']) is list)
+
+    def test_other_values_deepcopied(self):
+        value = set([1])
+        result = self._call_fut({'a': value})
+        self.assertEqual(result['a'], value)
+        self.assertFalse(result['a'] is value)
+
+
+class TestDiff(unittest.TestCase):
+    def _call_fut(self, orig, data):
+        from lumin.tracking import diff
+        return diff(orig, data)
+
+    def test_unchanged(self):
+        doc = {'a': 1, 'b': {'c': [1, 2]}}
+        self.assertEqual(self._call_fut(doc, dict(doc)), ({}, []))
+
+    def test_top_level(self):
+        sets, unsets = self._call_fut({'a': 1, 'b': 2}, {'a': 3, 'c': 4})
+        self.assertEqual(sets, {'a': 3, 'c': 4})
+        self.assertEqual(unsets, ['b'])
+
+    def test_nested_paths(self):
+        orig = {'a': {'b': 1, 'c': 2, 'd': 3, 'e': 4}}
+        data = {'a': {'b': 5, 'c': 2, 'e': 4}}
+        self.assertEqual(self._call_fut(orig, data), ({'a.b': 5}, ['a.d']))
+
+    def test_nested_all_changed_sets_whole(self):
+        orig = {'a': {'b': 1, 'c': 2}}
+        data = {'a': {'b': 3, 'c': 4}}
+        self.assertEqual(self._call_fut(orig, data), ({'a': data['a']}, []))
+
+    def test_nested_emptied(self):
+        self.assertEqual(self._call_fut({'a': {'b': 1}}, {'a': {}}),
+                         ({'a': {}}, []))
+
+    def test_lists_set_whole(self):
+        sets, unsets = self._call_fut({'a': [1, 2]}, {'a': [1, 3]})
+        self.assertEqual(sets, {'a': [1, 3]})
+
+    def test_type_change(self):
+        sets, unsets = self._call_fut({'a': 1}, {'a': True})
+        self.assertEqual(sets, {'a': True})
+        sets, unsets = self._call_fut({'a': {'b': 1}}, {'a': [1]})
+        self.assertEqual(sets, {'a': [1]})
+
+    def test_tracked_against_plain(self):
+        from lumin.tracking import ChangeTracker
+        tracker = ChangeTracker({'a': {'b': [1]}, 'c': 1})
+        tracker.data['a']['b']
+        tracker.data['c'] = 2
+        self.assertEqual(self._call_fut(tracker.orig, tracker.data),
+                         ({'c': 2}, []))
+
+
+class TestMerge(unittest.TestCase):
+    def _call_fut(self, base, mine, theirs, ignore=()):
+        from lumin.tracking import merge
+        return merge(base, mine, theirs, ignore)
+
+    def test_disjoint(self):
+        base = {'a': 1, 'b': {'c': 1, 'd': 1, 'e': 1}, 'f': 1}
+        mine = {'a': 2, 'b': {'c': 1, 'd': 1, 'e': 1}}
+        theirs = {'a': 1, 'b': {'c': 2, 'd': 1, 'e': 1}, 'f': 1, 'g': 1}
+        merged, conflicts = self._call_fut(base, mine, theirs)
+        self.assertEqual(conflicts, [])
+        self.assertEqual(merged, {'a': 2, 'b': {'c': 2, 'd': 1, 'e': 1},
+                                  'g': 1})
+
+    def test_conflicts(self):
+        base = {'a': 1, 'b': {'c': 1, 'd': 1, 'e': 1}}
+        mine = {'a': 2, 'b': {'c': 2, 'd': 1, 'e': 1}}
+        theirs = {'a': 3, 'b': 5}
+        merged, conflicts = self._call_fut(base, mine, theirs)
+        self.assertEqual(sorted(conflicts), ['a', 'b.c'])
+
+    def test_same_change_and_ignored(self):
+        base = {'a': 1, 'mtime': 1}
+        merged, conflicts = self._call_fut(
+            base, {'a': 2, 'mtime': 2}, {'a': 2, 'mtime': 3}, ['mtime'])
+        self.assertEqual(conflicts, [])
+        self.assertEqual(merged, {'a': 2, 'mtime': 2})
+
+
+class TestChangeTracker(unittest.TestCase):
+    def _make_one(self, doc):
+        from lumin.tracking import ChangeTracker
+        return ChangeTracker(doc)
+
+    def test_unchanged(self):
+        tracker = self._make_one({'a': {'b': 1}})
+        self.assertEqual(tracker.data['a']['b'], 1)
+        self.assertFalse(tracker.changed)
+        self.assertEqual(tracker.orig, {'a': {'b': 1}})
+
+    def test_top_level_change(self):
+        tracker = self._make_one({'a': 1})
+        tracker.data['a'] = 2
+        self.assertTrue(tracker.changed)
+        self.assertEqual(tracker.orig, {'a': 1})
+        self.assertEqual(tracker.data, {'a': 2})
+
+    def test_nested_dict_change(self):
+        tracker = self._make_one({'a': {'b': 1}})
+        tracker.data['a']['b'] = 2
+        self.assertEqual(tracker.orig, {'a': {'b': 1}})
+
+    def test_nested_get_change(self):
+        tracker = self._make_one({'a': {'b': 1}})
+        tracker.data.get('a')['b'] = 2
+        self.assertEqual(tracker.orig, {'a': {'b': 1}})
+
+    def test_nested_list_change(self):
+        tracker = self._make_one({'a': [{'b': 1}]})
+        tracker.data['a'].append(2)
+        self.assertEqual(tracker.orig, {'a': [{'b': 1}]})
+
+    def test_list_item_change(self):
+        tracker = self._make_one({'a': [{'b': 1}]})
+        for item in tracker.data['a']:
+            item['b'] = 2
+        self.assertEqual(tracker.orig, {'a': [{'b': 1}]})
+        self.assertEqual(tracker.data, {'a': [{'b': 2}]})
+
+    def test_values_and_items_change(self):
+        tracker = self._make_one({'a': {'b': 1}})
+        for value in tracker.data.values():
+            value['b'] = 2
+        self.assertEqual(tracker.orig, {'a': {'b': 1}})
+        tracker.reset()
+        for key, value in tracker.data.items():
+            value['b'] = 3
+        self.assertEqual(tracker.orig, {'a': {'b': 2}})
+
+    def test_first_change_only(self):
+        tracker = self._make_one({'a': 1})
+        tracker.data['a'] = 2
+        tracker.data['a'] = 3
+        self.assertEqual(tracker.orig, {'a': 1})
+
+    def test_mutators(self):
+        tracker = self._make_one({'a': 1, 'b': 2, 'c': 3})
+        for mutate in (lambda d: d.pop('a'),
+                       lambda d: d.popitem(),
+                       lambda d: d.update(x=1),
+                       lambda d: d.setdefault('y', 1),
+                       lambda d: d.__delitem__('x'),
+                       lambda d: d.clear()):
+            tracker.reset()
+            before = dict(tracker.data)
+            mutate(tracker.data)
+            self.assertEqual(tracker.orig, before)
+
+    def test_setdefault_existing_is_not_a_change(self):
+        tracker = self._make_one({'a': 1})
+        self.assertEqual(tracker.data.setdefault('a', 2), 1)
+        self.assertFalse(tracker.changed)
+
+    def test_list_mutators(self):
+        tracker = self._make_one({'a': [3, 1, 2]})
+        for mutate in (lambda l: l.append(1),
+                       lambda l: l.extend([1]),
+                       lambda l: l.insert(0, 1),
+                       lambda l: l.pop(),
+                       lambda l: l.remove(1),
+                       lambda l: l.reverse(),
+                       lambda l: l.sort(),
+                       lambda l: l.__setitem__(0, 5),
+                       lambda l: l.__delitem__(0)):
+            tracker.reset()
+            before = list(tracker.data['a'])
+            mutate(tracker.data['a'])
+            self.assertEqual(tracker.orig['a'], before)
+
+    def test_slice(self):
+        tracker = self._make_one({'a': [{'b': 1}, {'b': 2}]})
+        tracker.data['a'][1:][0]['b'] = 3
+        self.assertEqual(tracker.orig, {'a': [{'b': 1}, {'b': 2}]})
+
+    def test_copy(self):
+        tracker = self._make_one({'a': {'b': 1}})
+        tracker.data.copy()['a']['b'] = 2
+        self.assertEqual(tracker.orig, {'a': {'b': 1}})
+
+    def test_dict_views(self):
+        tracker = self._make_one({'a': {'b': 1}, 'c': [{'d': 1}]})
+        dict(tracker.data)['a']['b'] = 2
+        self.assertEqual(tracker.orig, {'a': {'b': 1}, 'c': [{'d': 1}]})
+        tracker.reset()
+        list(dict.values(tracker.data))[1][0]['d'] = 2
+        self.assertEqual(tracker.orig, {'a': {'b': 2}, 'c': [{'d': 1}]})
+
+    def test_replace(self):
+        tracker = self._make_one({'a': 1})
+        data = tracker.data
+        tracker.replace({'b': {'c': 1}}, None)
+        self.assertTrue(tracker.data is data)
+        dict(data)['b']['c'] = 2
+        self.assertEqual(tracker.orig, {'b': {'c': 1}})
+
+    def test_deepcopy_and_pickle(self):
+        tracker = self._make_one({'a': {'b': [1]}})
+        self.assertTrue(type(copy.deepcopy(tracker.data)) is dict)
+        result = pickle.loads(pickle.dumps(tracker.data))
+        self.assertEqual(result, {'a': {'b': [1]}})
+        self.assertTrue(type(result) is dict)
+
+    def test_tracked_doc_is_copied(self):
+        first = self._make_one({'a': {'b': 1}})
+        second = self._make_one(first.data)
+        second.data['a']['b'] = 2
+        self.assertFalse(first.changed)
+        self.assertEqual(first.data, {'a': {'b': 1}})
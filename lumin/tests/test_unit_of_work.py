@@ -0,0 +1,212 @@
+from __future__ import unicode_literals
+import unittest
+
+import pyramid.testing
+
+from lumin.testing import Connection
+
+
+class TestUnitOfWork(unittest.TestCase):
+    def setUp(self):
+        self.db = Connection()['test']
+
+    def _make_one(self):
+        from lumin.unit_of_work import UnitOfWork
+        return UnitOfWork()
+
+    def test_flush(self):
+        work = self._make_one()
+        self.db['docs'].insert({'_id': 'a', 'n': 1})
+        self.db['docs'].insert({'_id': 'b'})
+        oid = work.insert(self.db['history'], {'orig_id': 'a', 'n': 1})
+        work.update(self.db['docs'], {'_id': 'a'}, {'n': 2})
+        work.update(self.db['docs'], {'_id': 'a'}, {'$inc': {'n': 1}})
+        work.update(self.db['docs'], {'_id': 'c'}, {'n': 1}, upsert=True)
+        work.remove(self.db['docs'], {'_id': 'b'})
+        self.assertEqual(len(work), 5)
+        self.assertEqual(self.db['history'].count(), 0)
+        work.flush()
+        self.assertEqual(len(work), 0)
+        self.assertEqual(self.db['history'].find_one()['_id'], oid)
+        self.assertEqual(self.db['docs'].find_one({'_id': 'a'})['n'], 3)
+        self.assertEqual(self.db['docs'].find_one({'_id': 'c'})['n'], 1)
+        self.assertEqual(self.db['docs'].find_one({'_id': 'b'}), None)
+
+    def test_flush_in_order_across_collection_objects(self):
+        ## pymongo returns a new Collection object for every lookup
+        work = self._make_one()
+        first, second = Handle(self.db['docs']), Handle(self.db['docs'])
+        work.insert(first, {'_id': 'a', 'n': 1})
+        work.insert(Handle(self.db['history']), {'orig_id': 'a'})
+        work.update(second, {'_id': 'a'}, {'n': 2})
+        work.update(first, {'_id': 'a'}, {'$inc': {'n': 1}})
+        work.flush()
+        self.assertEqual(self.db['docs'].find_one({'_id': 'a'})['n'], 3)
+        self.assertEqual(self.db['history'].count(), 1)
+
+    def test_flush_manipulates_update_operators(self):
+        class Fix(object):
+            def _fix_incoming(self, son, collection):
+                return dict((k, self._fix_incoming(v, collection)
+                             if isinstance(v, dict) else
+                             '<null>' if v is None else v)
+                            for (k, v) in son.items())
+        docs = Handle(self.db['docs'], database=Fix())
+        work = self._make_one()
+        self.db['docs'].insert({'_id': 'a', 'n': 1})
+        work.update(docs, {'_id': 'a'}, {'$set': {'n': None}})
+        work.flush()
+        self.assertEqual(self.db['docs'].find_one({'_id': 'a'})['n'],
+                         '<null>')
+
+    def test_flush_not_found(self):
+        work = self._make_one()
+        work.update(self.db['docs'], {'_id': 'a'}, {'n': 2})
+        self.assertRaises(KeyError, work.flush)
+
+    def test_discard(self):
+        work = self._make_one()
+        work.insert(self.db['docs'], {'n': 1})
+        work.discard()
+        work.flush()
+        self.assertEqual(self.db['docs'].count(), 0)
+
+    def test_after_flush(self):
+        work = self._make_one()
+        called = []
+        work.after_flush(called.append, 'flushed')
+        work.flush()
+        work.flush()
+        self.assertEqual(called, ['flushed'])
+        work.after_flush(called.append, 'discarded')
+        work.discard()
+        work.flush()
+        self.assertEqual(called, ['flushed'])
+
+
+class TestUnitOfWorkTween(unittest.TestCase):
+    def setUp(self):
+        self.config = pyramid.testing.setUp(
+            settings={'lumin.unit_of_work': 'true'})
+        self.request = pyramid.testing.DummyRequest()
+        self.request.db = Connection()['test']
+        self.request.db['test'].insert({'_id': 'test_id', 'foo': 1})
+
+    def tearDown(self):
+        pyramid.testing.tearDown()
+
+    def _tween(self, view):
+        from lumin.unit_of_work import unit_of_work_tween_factory
+        return unit_of_work_tween_factory(view, self.config.registry)
+
+    def _respond(self, view):
+        response = self._tween(view)(self.request)
+        for callback in self.request.response_callbacks:
+            callback(self.request, response)
+        return response
+
+    def test_disabled(self):
+        from lumin.unit_of_work import get_unit_of_work
+        from lumin.unit_of_work import unit_of_work_tween_factory
+        self.config.registry.settings['lumin.unit_of_work'] = 'false'
+        view = lambda request: None
+        self.assertTrue(
+            unit_of_work_tween_factory(view, self.config.registry) is view)
+        self.assertEqual(get_unit_of_work(self.request), None)
+
+    def test_outside_tween(self):
+        from lumin.node import ContextById
+        from lumin.unit_of_work import get_unit_of_work
+        self.assertEqual(get_unit_of_work(self.request), None)
+        ## e.g. a script, writes are made at once rather than dropped
+        context = ContextById(self.request, _id='test_id', name='test')
+        context.update({'foo': 2})
+        self.assertEqual(
+            self.request.db['test'].find_one({'_id': 'test_id'})['foo'], 2)
+
+    def test_context_writes_flushed(self):
+        from lumin.node import ContextById
+
+        def view(request):
+            context = ContextById(request, _id='test_id', name='test')
+            context.update({'foo': 2})
+            context.insert({}, 'other', increment=False)
+            self.assertEqual(
+                request.db['test'].find_one({'_id': 'test_id'})['foo'], 1)
+            self.assertEqual(request.db['test.history'].count(), 0)
+            return 'response'
+        self.assertEqual(self._respond(view), 'response')
+        db = self.request.db
+        self.assertEqual(db['test'].find_one({'_id': 'test_id'})['foo'], 2)
+        self.assertEqual(db['test.history'].find_one()['foo'], 1)
+        self.assertEqual(db['test'].count(), 2)
+
+    def test_session_saved(self):
+        from lumin.session import LuminSessionFactoryConfig
+
+        from pyramid.response import Response
+
+        def view(request):
+            session = LuminSessionFactoryConfig('secret')(request)
+            session['foo'] = 'bar'
+            session.save()
+            self.assertEqual(request.db['lumin.sessions'].count(), 0)
+            return Response()
+        self._respond(view)
+        self.assertEqual(
+            self.request.db['lumin.sessions'].find_one()['foo'], 'bar')
+
+    def test_error_discards(self):
+        from lumin.node import ContextById
+
+        def view(request):
+            ContextById(request, _id='test_id', name='test').remove()
+            raise ValueError('failed')
+        self.assertRaises(ValueError, self._respond, view)
+        self.assertEqual(self.request.db['test'].count(), 1)
+        self.assertEqual(self.request.db['test.history'].count(), 0)
+
+
+    def test_http_exception_flushes(self):
+        from pyramid.httpexceptions import HTTPFound
+        from lumin.node import ContextById
+
+        def view(request):
+            ContextById(request, _id='test_id', name='test').update(
+                {'foo': 2})
+            raise HTTPFound('/test_id')
+        try:
+            self._tween(view)(self.request)
+        except HTTPFound as e:
+            ## As the exception view tween
+            self.request.exception = response = e
+        for callback in self.request.response_callbacks:
+            callback(self.request, response)
+        self.assertEqual(
+            self.request.db['test'].find_one({'_id': 'test_id'})['foo'], 2)
+
+    def test_flush_invalidates_cache(self):
+        from lumin.node import ContextById
+        self.config.registry.settings['lumin.cache.collections'] = 'test'
+        other = pyramid.testing.DummyRequest()
+        other.db = self.request.db
+
+        def view(request):
+            ContextById(request, _id='test_id', name='test').update(
+                {'foo': 2})
+            ## A concurrent request caches the stored document
+            ContextById(other, _id='test_id', name='test')
+            return 'response'
+        self._respond(view)
+        context = ContextById(other, _id='test_id', name='test')
+        self.assertEqual(context.data['foo'], 2)
+
+
+class Handle(object):
+    # A distinct object for the same collection, like pymongo's
+    def __init__(self, collection, database=None):
+        self.collection = collection
+        self.database = database
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
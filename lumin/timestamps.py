@@ -0,0 +1,125 @@
+from __future__ import unicode_literals
+
+import datetime
+
+from pyramid.compat import string_types
+from pyramid.settings import asbool
+
+from lumin.util import TS_FORMAT
+
+# The timestamps lumin keeps on every document
+FIELDS = ('ctime', 'mtime')
+
+
+def now(settings=None):
+    """
+    Return the current UTC time to store as a ``ctime`` or ``mtime``, a
+    ``datetime`` with ``lumin.native_timestamps = true`` and a string in
+    :data:`lumin.util.TS_FORMAT` otherwise.
+    """
+    stamp = datetime.datetime.utcnow()
+    if asbool((settings or {}).get('lumin.native_timestamps', False)):
+        ## BSON dates have millisecond precision, truncate so the
+        ## document in memory equals the stored one
+        return stamp.replace(microsecond=stamp.microsecond // 1000 * 1000)
+    return stamp.strftime(TS_FORMAT)
+
+
+def as_datetime(value):
+    """
+    Return the timestamp ``value``, stored either as a ``datetime`` or a
+    string in :data:`lumin.util.TS_FORMAT`, as a naive UTC ``datetime``.
+    """
+    if isinstance(value, string_types):
+        return datetime.datetime.strptime(value, TS_FORMAT)
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        return (value - value.utcoffset()).replace(tzinfo=None)
+    return value
+
+
+def convert_document(doc, fields=FIELDS):
+    """
+    Replace the string timestamps ``fields`` of ``doc`` with
+    ``datetime`` objects. Returns the ``dict`` of fields converted.
+    """
+    converted = {}
+    for field in fields:
+        value = doc.get(field, None)
+        if isinstance(value, string_types):
+            converted[field] = doc[field] = as_datetime(value)
+    return converted
+
+
+def convert_timestamps(collection, fields=FIELDS, batch_size=500):
+    """
+    Convert the string timestamps ``fields`` of every document of
+    ``collection`` to native BSON dates, walking the collection in
+    ``_id`` order ``batch_size`` documents at a time. Each document is
+    only updated while its timestamps are unchanged, so it can run
+    while the application is writing. Returns the number of documents
+    converted.
+    """
+    count = 0
+    spec = {}
+    while True:
+        batch = list(collection.find(spec, ['_id'] + list(fields))
+                     .sort('_id', 1).limit(batch_size))
+        if not batch:
+            return count
+        for doc in batch:
+            original = dict(doc)
+            converted = convert_document(doc, fields)
+            if converted:
+                match = {'_id': doc['_id']}
+                match.update((k, original[k]) for k in converted)
+                collection.update(match, {'$set': converted})
+                count += 1
+        spec = {'_id': {'$gt': batch[-1]['_id']}}
+
+
+def convert_history_timestamps(store, fields=FIELDS, batch_size=500):
+    """
+    Convert the string timestamps ``fields`` of every version kept by
+    the history ``store``, in keyframes, in the patches of a
+    :class:`lumin.history.DeltaHistory` and in the versions of each
+    bucket of a :class:`lumin.history.BucketHistory`. Records are
+    walked in ``_id`` order ``batch_size`` at a time and each is
+    updated in place while the values converted are unchanged, so it
+    can run while the application is writing. Returns the number of
+    history records converted.
+    """
+    from lumin.history import PATCH
+    collection = store.collection
+    count = 0
+    spec = {}
+    while True:
+        batch = list(collection.find(spec).sort('_id', 1).limit(batch_size))
+        if not batch:
+            return count
+        for record in batch:
+            match = {'_id': record['_id']}
+            converted = {}
+            for field, value in convert_document(dict(record),
+                                                 fields).items():
+                match[field] = record[field]
+                converted[field] = value
+            meta = record.get(PATCH, None)
+            if meta is not None:
+                sets = [[path, as_datetime(value)
+                         if len(path) == 1 and path[0] in fields else value]
+                        for (path, value) in meta['set']]
+                if sets != meta['set']:
+                    match[PATCH + '.set'] = meta['set']
+                    converted[PATCH] = dict(meta, set=sets)
+            if 'versions' in record:
+                versions = [dict(version) for version in record['versions']]
+                if any([convert_document(version, fields)
+                        for version in versions]):
+                    ## Buckets only grow, an unchanged count means
+                    ## unchanged versions
+                    match['count'] = record['count']
+                    converted['versions'] = versions
+            if converted:
+                collection.update(match, {'$set': converted})
+                count += 1
+        spec = {'_id': {'$gt': batch[-1]['_id']}}
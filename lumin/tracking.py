@@ -0,0 +1,343 @@
+from __future__ import unicode_literals
+
+import copy
+import datetime
+import time
+from decimal import Decimal
+
+from bson.objectid import ObjectId
+
+from pyramid.compat import PY3
+
+if PY3:  # pragma: no cover
+    _ATOMIC = (str, bytes, int, float, bool, type(None),
+               ObjectId, datetime.datetime, Decimal)
+else:  # pragma: no cover
+    _ATOMIC = (str, unicode, int, long, float, bool, type(None),
+               ObjectId, datetime.datetime, Decimal)
+
+
+def plain_copy(value):
+    """
+    Deep copy ``value``, a document or any value nested in it, into
+    plain ``dict`` and ``list`` containers. Immutable leaves are shared
+    rather than copied, which makes this a good deal cheaper than
+    :func:`copy.deepcopy`.
+    """
+    cls = type(value)
+    if cls in _ATOMIC:
+        return value
+    if cls is dict or cls is TrackedDict:
+        return {k: plain_copy(v) for (k, v) in dict.items(value)}
+    if cls is list or cls is TrackedList:
+        return [plain_copy(v) for v in list.__iter__(value)]
+    return copy.deepcopy(value)
+
+
+def diff(orig, data, prefix=''):
+    """
+    Compare the documents ``orig`` and ``data``. Returns a ``dict`` of
+    the dotted paths to ``$set`` to turn ``orig`` into ``data`` and a
+    ``list`` of the paths to ``$unset``. Nested documents are compared
+    field by field, any other changed value is set as a whole.
+    """
+    sets = {}
+    unsets = []
+    for key in orig:
+        if key not in data:
+            unsets.append(prefix + key)
+    for key in data:
+        value = dict.__getitem__(data, key)
+        path = prefix + key
+        if key not in orig:
+            sets[path] = value
+            continue
+        old = dict.__getitem__(orig, key)
+        kind = _kind(value)
+        if kind is not _kind(old):
+            sets[path] = value
+        elif kind is dict:
+            more_sets, more_unsets = diff(old, value, path + '.')
+            if not more_sets and not more_unsets:
+                continue
+            if len(more_sets) + len(more_unsets) < len(value):
+                sets.update(more_sets)
+                unsets.extend(more_unsets)
+            else:
+                ## Every field changed, setting the whole document is
+                ## shorter
+                sets[path] = value
+        elif old != value:
+            sets[path] = value
+    return sets, unsets
+
+
+def merge(base, mine, theirs, ignore=()):
+    """
+    Merge the changes made to the document ``base`` in ``mine`` and in
+    ``theirs``. Returns the merged document, a copy of ``theirs`` with
+    the changes of ``mine`` applied, and the ``list`` of the dotted
+    paths both changed differently. Changes of ``theirs`` to the
+    ``ignore`` paths do not conflict, ``mine`` wins.
+    """
+    my_sets, my_unsets = diff(base, mine)
+    their_sets, their_unsets = diff(base, theirs)
+    theirs_changed = [path for path in list(their_sets) + their_unsets
+                      if path not in ignore]
+    conflicts = []
+    for path in list(my_sets) + my_unsets:
+        for other in theirs_changed:
+            if not _overlap(path, other):
+                continue
+            if (path == other and path in my_sets and other in their_sets
+                    and my_sets[path] == their_sets[other]):
+                continue
+            if path == other and path in my_unsets and other in their_unsets:
+                continue
+            conflicts.append(path)
+            break
+    merged = plain_copy(theirs)
+    for path, value in my_sets.items():
+        _set_path(merged, path, plain_copy(value))
+    for path in my_unsets:
+        _unset_path(merged, path)
+    return merged, conflicts
+
+
+def _overlap(path, other):
+    return (path == other or path.startswith(other + '.') or
+            other.startswith(path + '.'))
+
+
+def _set_path(doc, path, value):
+    keys = path.split('.')
+    for key in keys[:-1]:
+        if not isinstance(doc.get(key, None), dict):
+            doc[key] = {}
+        doc = doc[key]
+    doc[keys[-1]] = value
+
+
+def _unset_path(doc, path):
+    keys = path.split('.')
+    for key in keys[:-1]:
+        doc = doc.get(key, None)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(keys[-1], None)
+
+
+def _kind(value):
+    cls = type(value)
+    if cls is TrackedDict:
+        return dict
+    if cls is TrackedList:
+        return list
+    return cls
+
+
+class ChangeTracker(object):
+    """
+    Holds the ``data`` of a :term:`context` and the ``snapshot`` of the
+    document as it was before ``data`` was first changed. Instead of
+    copying every document on load, the snapshot is only taken when a
+    change happens, so contexts which are only read never pay for it.
+    ``loaded`` is the time ``data`` was taken.
+    """
+    __slots__ = ('data', 'snapshot', 'loaded')
+
+    def __init__(self, doc):
+        if isinstance(doc, TrackedDict):
+            doc = plain_copy(doc)
+        self.snapshot = None
+        self.loaded = time.time()
+        self.data = TrackedDict(doc, self)
+
+    @property
+    def changed(self):
+        return self.snapshot is not None
+
+    @property
+    def orig(self):
+        """
+        The document before ``data`` was changed.
+        """
+        if self.snapshot is None:
+            return plain_copy(self.data)
+        return self.snapshot
+
+    def changing(self):
+        if self.snapshot is None:
+            self.snapshot = plain_copy(self.data)
+
+    def reset(self):
+        """
+        Accept the current ``data`` as the unchanged document.
+        """
+        self.snapshot = None
+
+    def replace(self, doc, snapshot):
+        """
+        Replace the contents of ``data`` with ``doc``, keeping the
+        ``data`` object the contexts sharing this tracker hold, and
+        take ``snapshot`` as the unchanged document.
+        """
+        dict.clear(self.data)
+        dict.update(self.data,
+                    ((k, _wrap(self, v)) for (k, v) in doc.items()))
+        self.snapshot = snapshot
+        self.loaded = time.time()
+
+
+def _wrap(tracker, value):
+    cls = type(value)
+    if cls is dict:
+        return TrackedDict(value, tracker)
+    if cls is list:
+        return TrackedList(value, tracker)
+    return value
+
+
+class TrackedDict(dict):
+    """
+    A ``dict`` which tells its :class:`ChangeTracker` before it is
+    changed. Nested ``dict`` and ``list`` values are swapped for tracked
+    ones up front, as ``dict(data)``, ``{**data}`` and the like read the
+    stored values directly, and again when assigned ones are accessed.
+    """
+    __slots__ = ('_tracker', )
+
+    def __init__(self, doc, tracker):
+        dict.__init__(self, doc)
+        self._tracker = tracker
+        for key, value in list(dict.items(self)):
+            self._tracked(key, value)
+
+    def _tracked(self, key, value):
+        wrapped = _wrap(self._tracker, value)
+        if wrapped is not value:
+            dict.__setitem__(self, key, wrapped)
+        return wrapped
+
+    def __getitem__(self, key):
+        return self._tracked(key, dict.__getitem__(self, key))
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+    if not PY3:  # pragma: no cover
+        def itervalues(self):
+            return iter(self.values())
+
+        def iteritems(self):
+            return iter(self.items())
+
+    def copy(self):
+        return dict(self.items())
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def __setitem__(self, key, value):
+        self._tracker.changing()
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._tracker.changing()
+        dict.__delitem__(self, key)
+
+    def clear(self):
+        self._tracker.changing()
+        dict.clear(self)
+
+    def pop(self, *args):
+        self._tracker.changing()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._tracker.changing()
+        return dict.popitem(self)
+
+    def update(self, *args, **kwargs):
+        self._tracker.changing()
+        dict.update(self, *args, **kwargs)
+
+    def __deepcopy__(self, memo):
+        return plain_copy(self)
+
+    def __reduce__(self):
+        return (dict, (plain_copy(self), ))
+
+
+class TrackedList(list):
+    """
+    A ``list`` which tells its :class:`ChangeTracker` before it is
+    changed. See :class:`TrackedDict`.
+    """
+    __slots__ = ('_tracker', )
+
+    def __init__(self, items, tracker):
+        list.__init__(self, items)
+        self._tracker = tracker
+        for index, value in enumerate(list.__iter__(self)):
+            self._tracked(index, value)
+
+    def _tracked(self, index, value):
+        wrapped = _wrap(self._tracker, value)
+        if wrapped is not value:
+            list.__setitem__(self, index, wrapped)
+        return wrapped
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._tracked(index, list.__getitem__(self, index))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _changing(name):
+        method = getattr(list, name)
+
+        def changing(self, *args, **kwargs):
+            self._tracker.changing()
+            return method(self, *args, **kwargs)
+        changing.__name__ = str(name)
+        return changing
+
+    __setitem__ = _changing('__setitem__')
+    __delitem__ = _changing('__delitem__')
+    __iadd__ = _changing('__iadd__')
+    __imul__ = _changing('__imul__')
+    append = _changing('append')
+    extend = _changing('extend')
+    insert = _changing('insert')
+    pop = _changing('pop')
+    remove = _changing('remove')
+    reverse = _changing('reverse')
+    sort = _changing('sort')
+
+    if PY3:  # pragma: no cover
+        clear = _changing('clear')
+    else:  # pragma: no cover
+        __setslice__ = _changing('__setslice__')
+        __delslice__ = _changing('__delslice__')
+
+    del _changing
+
+    def __deepcopy__(self, memo):
+        return plain_copy(self)
+
+    def __reduce__(self):
+        return (list, (plain_copy(self), ))
@@ -0,0 +1,183 @@
+from __future__ import unicode_literals
+
+from itertools import groupby
+
+from bson.objectid import ObjectId
+
+from pyramid.httpexceptions import HTTPException
+from pyramid.settings import asbool
+
+INSERT, UPDATE, REMOVE = 'insert', 'update', 'remove'
+
+
+class UnitOfWork(object):
+    """
+    A request scoped queue of the writes lumin makes: history records,
+    saves, inserts without slug increments, deletes and session saves.
+    At the end of the request they are written in the order they were
+    made, with one ordered bulk write per run of writes to the same
+    :term:`collection`, so an edit costs a few round trips instead of
+    one per write. Writes which need their result at once, such as
+    versioned saves or slug allocation, are not queued.
+
+    Reads are not affected: until the end of the request they don't
+    see the documents inserted, saved or removed through the queue.
+
+    Enable it by setting ``lumin.unit_of_work = true`` in the
+    configuration .ini and adding the
+    :func:`unit_of_work_tween_factory` tween, which
+    :meth:`lumin.includeme` does.
+    """
+    def __init__(self):
+        # [(collection, op, args)]
+        self._writes = []
+        # [(callback, args)]
+        self._after = []
+
+    def _queue(self, collection, op, *args):
+        self._writes.append((collection, op, args))
+
+    def insert(self, collection, doc):
+        """
+        Queue the insert of ``doc`` into ``collection``. Returns the
+        ``_id`` of ``doc``, an :class:`ObjectId` if it had none.
+        """
+        if '_id' not in doc:
+            doc['_id'] = ObjectId()
+        self._queue(collection, INSERT, doc)
+        return doc['_id']
+
+    def update(self, collection, spec, document, upsert=False):
+        """
+        Queue the update of the single document matching ``spec``, with
+        update operators or a replacement ``document``.
+        """
+        self._queue(collection, UPDATE, spec, document, upsert)
+
+    def remove(self, collection, spec):
+        """
+        Queue the removal of the single document matching ``spec``.
+        """
+        self._queue(collection, REMOVE, spec)
+
+    def after_flush(self, callback, *args):
+        """
+        Call ``callback(*args)`` once the queued writes are flushed,
+        e.g. to drop the cached copies of the documents written.
+        """
+        self._after.append((callback, args))
+
+    def __len__(self):
+        return len(self._writes)
+
+    def discard(self):
+        """
+        Drop the queued writes, e.g. when the request failed.
+        """
+        self._writes = []
+        self._after = []
+
+    def flush(self):
+        """
+        Write the queued writes in order, with an ordered bulk write per
+        run of writes to the same :term:`collection`. Raises the
+        ``BulkWriteError`` of a failed write, and ``KeyError`` if a
+        document to update was not found.
+        """
+        writes, self._writes = self._writes, []
+        after, self._after = self._after, []
+        ## pymongo returns a new Collection object for every lookup, so
+        ## writes are grouped by name
+        for name, run in groupby(writes, lambda w: w[0].full_name):
+            run = list(run)
+            collection = run[0][0]
+            fix = getattr(getattr(collection, 'database', None),
+                          '_fix_incoming', None)
+            bulk = collection.initialize_ordered_bulk_op()
+            expected = 0
+            for _, op, args in run:
+                if op == INSERT:
+                    doc = args[0]
+                    bulk.insert(fix(doc, collection) if fix else doc)
+                elif op == UPDATE:
+                    spec, document, upsert = args
+                    ## As Collection.update(manipulate=True), which
+                    ## converts the values of update operators too
+                    if fix:
+                        document = fix(document, collection)
+                    found = bulk.find(spec)
+                    if upsert:
+                        found = found.upsert()
+                    else:
+                        expected += 1
+                    if any(k.startswith('$') for k in document):
+                        found.update_one(document)
+                    else:
+                        found.replace_one(document)
+                else:
+                    bulk.find(args[0]).remove_one()
+            result = bulk.execute()
+            if result and result.get('nMatched', expected) < expected:
+                raise KeyError(
+                    "Update failed: %d of %d documents not found" % (
+                        expected - result['nMatched'], expected))
+        for callback, args in after:
+            callback(*args)
+
+
+def get_unit_of_work(request):
+    """
+    Return the :class:`UnitOfWork` :func:`unit_of_work_tween_factory`
+    installed on ``request``, or ``None`` when there is none, e.g. in
+    scripts and requests made outside the tween, or the request's
+    writes were already flushed.
+    """
+    if getattr(request, 'lumin_unit_of_work_done', False):
+        return None
+    return getattr(request, 'lumin_unit_of_work', None)
+
+
+def _end(request):
+    work = getattr(request, 'lumin_unit_of_work', None)
+    request.lumin_unit_of_work_done = True
+    return work
+
+
+def unit_of_work_tween_factory(handler, registry):
+    """
+    A tween flushing the :class:`UnitOfWork` of each request once its
+    response callbacks, which save the session, have run; before the
+    response is returned to the server, so a failed write fails the
+    request. The writes of a request whose view raised are discarded,
+    unless it raised an ``HTTPException`` such as the ``HTTPFound`` of
+    a redirect after a POST.
+    """
+    settings = registry.settings or {}
+    if not asbool(settings.get('lumin.unit_of_work', False)):
+        return handler
+
+    def flush(request, response):
+        work = _end(request)
+        exception = getattr(request, 'exception', None)
+        if work is not None and (exception is None or
+                                 isinstance(exception, HTTPException)):
+            work.flush()
+
+    def unit_of_work_tween(request):
+        request.lumin_unit_of_work = UnitOfWork()
+        try:
+            response = handler(request)
+        except HTTPException:
+            request.add_response_callback(flush)
+            raise
+        except Exception:
+            work = _end(request)
+            if work is not None:
+                work.discard()
+            raise
+        ## Response callbacks run in the order they were added, after
+        ## the session's
+        request.add_response_callback(flush)
+        return response
+
+    return unit_of_work_tween
@@ -2,12 +2,14 @@ import re
 
 from webob.exc import HTTPNotFound
 
+from lumin.readpref import read_collection
+
 
 def autocomplete_id(request):
     collection = request.matchdict.get('collection')
     if collection in request.db.collection_names():
         term = request.params.get('term')
-        cursor = request.db[collection].find(
+        cursor = read_collection(request, collection).find(
             {'_id': re.compile('.*%s.*' % term, re.IGNORECASE)})
         return [term['_id'] for term in cursor]
     else:
@@ -21,7 +23,7 @@ def autocomplete_name(request):
     collection = request.matchdict.get('collection')
     if collection in request.db.collection_names():
         term = request.params.get('term')
-        cursor = request.db[collection].find(
+        cursor = read_collection(request, collection).find(
             {'name': re.compile('.*%s.*' % term, re.IGNORECASE)})
         return [term['name'] for term in cursor]
     else:
@@ -30,7 +32,7 @@ def autocomplete_name(request):
 
 def word_suggest(request):
     text = request.params.get('term', None)
-    cursor = request.db['words'].find(
+    cursor = read_collection(request, 'words').find(
         {'_id': re.compile('^%s.*' % text, re.IGNORECASE)})
     return [text['_id'] for text in cursor]
 
@@ -112,6 +112,13 @@ setup(name='lumin',
       install_requires=requires+tests_require,
       test_suite="nose.collector",
       cmdclass={'doc': doc},
+      entry_points="""\
+        [console_scripts]
+        lumin_history = lumin.scripts.history:main
+        lumin_compact_history = lumin.scripts.history:compact_main
+        lumin_indexes = lumin.scripts.indexes:main
+        lumin_timestamps = lumin.scripts.timestamps:main
+      """,
       # entry_points="""\
       #   [nose.plugins.0.10]
       #   #mongodb = lumin.tests.mongodb:MongoDBPlugin